@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' Offline benchmarks for the scheduling and rendering hot paths of civilite.
+
+Usage (with the src directory on sys.path, see tests/README.md):
+    python benchmarks/run_benchmarks.py [--output results.json] [--quick]
+
+Each benchmark reports the best and mean wall time of several runs in seconds.
+Results are written as JSON, together with the commit and environment they were
+measured on, so that runs on different commits can be compared.
+'''
+
+# Builtins
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict
+
+# 3rd party
+from dateutil.parser import parse
+
+# Our stuff
+import civilite._meta as meta
+from civilite import batch, plancache, render, schedule, twilight
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+# Sunsets generated with astral: a consistency check, not an independent reference.
+ASTRAL_SUNSETS = os.path.join(BENCHMARKS_PATH, 'data', 'astral_sunsets_rochester_2020.json')
+CALENDAR_SCRIPT = os.path.join(BENCHMARKS_PATH, '..', 'src', 'scripts', 'make_calendar_pdf.py')
+START_YEAR = 2020
+
+
+def measure(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    '''Run a function several times and return its timings in seconds.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'best': min(timings), 'mean': sum(timings) / len(timings), 'repeat': repeat}
+
+
+def createYears(num_years: int, backend: str) -> None:
+    '''Create events for consecutive years with a fresh schedule.'''
+    curr_schedule = schedule.getCurrentSchedule()
+    curr_schedule.backend = backend
+    for year in range(START_YEAR, START_YEAR + num_years):
+        curr_schedule.createEvents(year)
+
+
+def civilTwilightCold() -> None:
+    '''Compute a year of twilight times with an empty cache.'''
+    curr_schedule = schedule.getCurrentSchedule()
+    for day in range(365):
+        curr_schedule.getCivilTwilight(date(START_YEAR, 1, 1) + timedelta(days=day))
+
+
+def instrumented(function: Callable[[], object]) -> Callable[[], None]:
+    '''Return a function that runs another with the instrumentation enabled.'''
+    def run():
+        schedule.INSTRUMENTATION.enable()
+        try:
+            function()
+        finally:
+            schedule.INSTRUMENTATION.enable(False)
+            schedule.INSTRUMENTATION.reset()
+    return run
+
+
+def csvOutput(work_path: str) -> Callable[[], None]:
+    '''Return a function that writes one year of events as CSV into a working directory.'''
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()), _workingDirectory(work_path):
+            schedule.getCurrentSchedule().createEvents(START_YEAR, create_output=True)
+    return run
+
+
+def renderCalendar() -> None:
+    '''Render one year's PDF calendar in memory.'''
+    render.renderCalendar(schedule.getCurrentSchedule(), START_YEAR)
+
+
+def calendarPdf(work_path: str) -> Callable[[], None]:
+    '''Return a function that renders one year's PDF calendar into a working directory.'''
+    def run():
+        saved_argv = sys.argv
+        sys.argv = [CALENDAR_SCRIPT, str(START_YEAR)]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), _workingDirectory(work_path):
+                runpy.run_path(CALENDAR_SCRIPT, run_name='__main__')
+        finally:
+            sys.argv = saved_argv
+    return run
+
+
+def planCacheHit(work_path: str) -> Callable[[], None]:
+    '''Return a function that loads one year's plan from a plan cache with a fresh schedule.'''
+    cache_path = os.path.join(work_path, 'benchmark_plans')
+    curr_schedule = schedule.getCurrentSchedule()
+    curr_schedule.plan_cache = plancache.PlanCache(cache_path)
+    curr_schedule.createEvents(START_YEAR)
+
+    def run():
+        curr_schedule = schedule.getCurrentSchedule()
+        curr_schedule.plan_cache = plancache.PlanCache(cache_path)
+        curr_schedule.createEvents(START_YEAR)
+    return run
+
+
+def planSites(num_sites: int, max_workers: int) -> Callable[[], None]:
+    '''Return a function that plans one year for a number of copies of the current schedule.'''
+    def run():
+        batch.planSites([schedule.getCurrentSchedule() for _ in range(num_sites)],
+                        [START_YEAR], max_workers=max_workers)
+    return run
+
+
+def cliStateAt(work_path: str) -> Callable[[], None]:
+    '''Return a function that runs ``civilite state-at`` in a new process, answered from a
+    saved plan.'''
+    plan_path = os.path.join(work_path, 'plan.json')
+    transitions = schedule.getCurrentSchedule().buildTransitions(date(START_YEAR, 1, 1),
+                                                                 date(START_YEAR + 1, 1, 1))
+    transitions.save(plan_path)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    def run():
+        subprocess.run([sys.executable, '-m', 'civilite', 'state-at', f'{START_YEAR}-06-01T20:00',
+                        '--plan', plan_path], check=True, capture_output=True, env=env)
+    return run
+
+
+def consistencyError() -> float:
+    '''Return the largest difference in seconds between computed sunsets and the sunsets
+    generated with astral, which are truncated to whole minutes.'''
+    with open(ASTRAL_SUNSETS, 'r', encoding='utf-8') as in_file:
+        reference = json.load(in_file)
+    curr_events = schedule.getCurrentSchedule().createEvents(START_YEAR)
+    return max(abs((sunset_time - parse(reference[evt_date.isoformat()][1])).total_seconds())
+               for evt_date, (sunset_time, *etc) in curr_events.items())
+
+
+@contextlib.contextmanager
+def _workingDirectory(path: str):
+    '''Temporarily change the current working directory.'''
+    saved_path = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(saved_path)
+
+
+def _gitCommit() -> str:
+    '''Return the current git commit, or an empty string outside of a work tree.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_PATH,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def runBenchmarks(quick: bool = False) -> Dict[str, object]:
+    '''Run all benchmarks and return the results as a JSON-serializable dictionary.'''
+    repeat = 1 if quick else 5
+    year_counts = (1, 10) if quick else (1, 10, 50)
+    warm_schedule = schedule.getCurrentSchedule()
+    warm_schedule.createEvents(START_YEAR)
+    year_dates = [date(START_YEAR, 1, 1) + timedelta(days=day) for day in range(365)]
+    results = {}
+    with tempfile.TemporaryDirectory() as work_path:
+        # The calendar script keeps its plans in a plan cache when this is set.
+        os.environ['CIVILITE_CACHE_DIR'] = os.path.join(work_path, 'plans')
+        benchmarks = {
+            'getCivilTwilight.cold.365': civilTwilightCold,
+            'getCivilTwilight.warm.365': lambda: [warm_schedule.getCivilTwilight(day)
+                                                  for day in year_dates],
+            'getEventType.warm.365': lambda: [warm_schedule.getEventType(day)
+                                              for day in year_dates],
+        }
+        benchmarks['getEventType.warm.365.instrumented'] = instrumented(
+            benchmarks['getEventType.warm.365'])
+        for num_years in year_counts:
+            for backend in twilight.BACKENDS:
+                benchmarks[f'createEvents.{backend}.{num_years}y'] = (
+                    lambda num_years=num_years, backend=backend: createYears(num_years, backend))
+        benchmarks['createEvents.csv.1y'] = csvOutput(work_path)
+        benchmarks['createEvents.plancache.hit.1y'] = planCacheHit(work_path)
+        benchmarks['make_calendar_pdf.1y'] = calendarPdf(work_path)
+        benchmarks['renderCalendar.1y'] = renderCalendar
+        benchmarks['cli.state-at.startup'] = cliStateAt(work_path)
+        benchmarks['python.startup'] = lambda: subprocess.run([sys.executable, '-c', 'pass'],
+                                                              check=True)
+        num_sites = 8 if quick else 32
+        for max_workers in (1, 2, 4):
+            benchmarks[f'planSites.{num_sites}sites.{max_workers}workers'] = planSites(
+                num_sites, max_workers)
+        for name, function in benchmarks.items():
+            results[name] = measure(function, repeat)
+            print(f'{name:45s} best {results[name]["best"]:.4f} s')
+    return {
+        'version': meta.__version__,
+        'commit': _gitCommit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'astral_consistency_max_seconds': consistencyError(),
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Run the civilite benchmarks.')
+    PARSER.add_argument('--output', default='benchmarks.json', help='path of the JSON results file')
+    PARSER.add_argument('--quick', action='store_true',
+                        help='fewer repetitions and shorter horizons')
+    ARGS = PARSER.parse_args()
+    REPORT = runBenchmarks(ARGS.quick)
+    with open(ARGS.output, 'w', encoding='utf-8') as OUT_FILE:
+        json.dump(REPORT, OUT_FILE, indent=2)
+    print(f'Benchmark results {ARGS.output} created.')
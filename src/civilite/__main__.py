@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+''' Run the civilite command line interface with ``python -m civilite`` '''
+
+# Builtins
+import sys
+
+# self
+from civilite.cli import main
+
+sys.exit(main())
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+''' Multi-site batch planning for civilite
+
+Creates the yearly events of many weekly schedules at once, spreading the
+sites across a pool of worker processes. Workers return each year as compact
+``EventColumns``, which cross the process boundary as a few byte strings.
+'''
+
+# Builtins
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, tzinfo as TzInfo
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+# 3rd party
+from astral import Observer
+
+# self
+import civilite._meta as meta
+from civilite.loader import buildSchedule
+from civilite.results import EventColumns
+from civilite.schedule import GAP_THRESHOLD, ScheduleEvent, WeeklySchedule
+from civilite.twilight import BACKEND_ASTRAL
+
+__version__ = meta.__version__
+
+# A site given as (observer, tzinfo, events), where events maps weekdays, or specific dates,
+# to a ScheduleEvent or a list of them.
+SiteSpec = Tuple[Observer, TzInfo,
+                 Mapping[Union[int, date], Union[ScheduleEvent, List[ScheduleEvent]]]]
+# The events of one site: key: year, value: the events of that year as ``EventColumns``,
+# a mapping with the same records as ``WeeklySchedule.createEvents`` with sunsets rounded
+# to whole seconds.
+SitePlan = Dict[int, EventColumns]
+
+
+def packSite(site: Union[WeeklySchedule, SiteSpec], backend: str = BACKEND_ASTRAL) -> Tuple:
+    '''Reduce a site to a small picklable tuple of plain values.
+    This keeps the twilight cache and other state of a schedule out of the worker payload.'''
+    gap_threshold = GAP_THRESHOLD
+    if isinstance(site, WeeklySchedule):
+        observer, tzinfo = site.observer, site.tzinfo
+        backend, gap_threshold = site.backend, site.gap_threshold
+        events = dict(site.events)
+        events.update(site.date_events)
+    else:
+        observer, tzinfo, events = site
+    packed_events = []
+    for key, key_events in events.items():
+        if isinstance(key_events, ScheduleEvent):
+            key_events = [key_events]
+        packed_events += [(key, event.start, event.stop) for event in key_events]
+    return ((observer.latitude, observer.longitude, observer.elevation),
+            tzinfo, tuple(packed_events), backend, gap_threshold)
+
+
+def unpackSite(packed_site: Tuple) -> WeeklySchedule:
+    '''Rebuild a schedule from the result of ``packSite``.'''
+    (latitude, longitude, elevation), tzinfo, events, backend, gap_threshold = packed_site
+    return buildSchedule(Observer(latitude, longitude, elevation), tzinfo, events,
+                         backend=backend, gap_threshold=gap_threshold)
+
+
+def runJobs(function: Callable, jobs: List[Tuple], max_workers: Optional[int] = None,
+            progress: Optional[Callable[[int, int], None]] = None) -> List:
+    '''Call a module-level function with each tuple of arguments in a process pool.
+
+    Args:
+        function:    The function to call; it and its arguments must be picklable.
+        jobs:        One tuple of arguments per call.
+        max_workers: Number of worker processes. `None` uses one per CPU,
+                       and 1 runs all jobs serially in the calling process.
+        progress:    Optional callback invoked as ``progress(completed, total)``
+                       each time a job is finished.
+
+    Return:
+        The results of the calls, in the order of the jobs.
+    '''
+    total = len(jobs)
+    results = [None] * total
+    if max_workers == 1:
+        for index, job in enumerate(jobs):
+            results[index] = function(*job)
+            if progress is not None:
+                progress(index + 1, total)
+        return results
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(function, *job): index for index, job in enumerate(jobs)}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(completed, total)
+    return results
+
+
+def _planSite(packed_site: Tuple, years: Tuple[int, ...]) -> SitePlan:
+    '''Worker entry point: rebuild a schedule from its packed form and create its events.'''
+    site_schedule = unpackSite(packed_site)
+    return {year: site_schedule.createColumns(date(year, 1, 1), date(year + 1, 1, 1))
+            for year in years}
+
+
+def planSites(sites: Iterable[Union[WeeklySchedule, SiteSpec]], years: Iterable[int],
+              max_workers: Optional[int] = None, backend: str = BACKEND_ASTRAL,
+              progress: Optional[Callable[[int, int], None]] = None) -> List[SitePlan]:
+    '''Create events for many sites over a range of years.
+
+    Args:
+        sites:       ``WeeklySchedule`` instances and/or (observer, tzinfo, events) tuples.
+        years:       The years to plan, e.g. ``range(2021, 2031)``.
+        max_workers: Number of worker processes. `None` uses one per CPU,
+                       and 1 plans all sites serially in the calling process.
+        backend:     Twilight backend for sites given as tuples.
+                       Schedules keep their own ``WeeklySchedule.backend``.
+        progress:    Optional callback invoked as ``progress(completed, total)``
+                       each time a site is finished.
+
+    Return:
+        A list with one ``SitePlan`` per site, in the order the sites were given.
+    '''
+    years = tuple(years)
+    return runJobs(_planSite, [(packSite(site, backend), years) for site in sites],
+                   max_workers, progress)
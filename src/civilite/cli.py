@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+''' Command line interface for civilite
+
+Usage:
+    civilite plan [YEAR] [--plan PATH]
+    civilite program YEAR [YEAR ...] [--output PATH]
+    civilite export YEAR [YEAR ...] [--format csv|jsonl|parquet] [--output PATH]
+    civilite render [YEAR] [--output PATH]
+    civilite state-at [WHEN] [--plan PATH]
+
+The site is the built-in HoP schedule (see ``civilite.site``). ``--calendar``
+replaces its events with those of an iCalendar path or URL (see ``civilite.loader``),
+and ``--latitude``, ``--longitude``, ``--elevation`` and ``--timezone`` replace
+its location.
+
+With ``--metrics``, the instrumentation counters and stage timings of the run
+are printed to standard error as JSON. Year plans are kept in the plan cache
+(see ``civilite.plancache``) unless ``--no-cache`` is given.
+
+Only the standard library is imported at startup; the solar, timezone and PDF
+libraries are imported by the subcommands that need them. ``state-at`` answers
+from the plan file written by ``plan`` without importing any of them.
+'''
+
+# Builtins
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+# self
+import civilite._meta as meta
+
+__version__ = meta.__version__
+
+# Plan file written by ``plan`` and read by ``state-at``.
+DEFAULT_PLAN_PATH = 'civilite_plan.json'
+# Days after the end of the year kept in a plan, so that ``state-at`` keeps working over New Year.
+PLAN_OVERLAP_DAYS = 7
+
+
+def _siteSchedule(args: argparse.Namespace):
+    '''Return the schedule of the site, with the plan cache unless it is disabled.
+    The built-in schedule gets the location, timezone and calendar events given as options.'''
+    from civilite.schedule import getCurrentSchedule
+    result = getCurrentSchedule()
+    if args.latitude is not None:
+        from astral import Observer
+        result.observer = Observer(args.latitude, args.longitude, args.elevation)
+    if args.timezone is not None:
+        import pytz
+        try:
+            result.tzinfo = pytz.timezone(args.timezone)
+        except pytz.UnknownTimeZoneError:
+            raise SystemExit(f'civilite: unknown timezone {args.timezone!r}') from None
+    if args.calendar is not None:
+        from civilite.loader import CalendarLoader, buildSchedule
+        with CalendarLoader() as calendar_loader:
+            events = calendar_loader.loadEvents(args.calendar, result.tzinfo)
+        result = buildSchedule(result.observer, result.tzinfo, events)
+    if not args.no_cache:
+        from civilite.plancache import PlanCache
+        result.plan_cache = PlanCache()
+    return result
+
+
+def plan(args: argparse.Namespace) -> int:
+    '''Build the ON/OFF transitions of a year and save them as a plan file.'''
+    site_schedule = _siteSchedule(args)
+    start_date = date(args.year, 1, 1)
+    end_date = date(args.year + 1, 1, 1) + timedelta(days=PLAN_OVERLAP_DAYS)
+    # The year's plan is loaded from the plan cache if the schedule is unchanged,
+    # and the transitions are built from it; only the overlap is computed.
+    site_schedule.createEvents(args.year)
+    transitions = site_schedule.buildTransitions(start_date, end_date)
+    transitions.save(args.plan)
+    print(f'Plan {args.plan} created with {len(transitions)} transitions.')
+    return 0
+
+
+def program(args: argparse.Namespace) -> int:
+    '''Write the astro clock program of the given years.'''
+    from civilite.export import exportClockPlan
+    site_schedule = _siteSchedule(args)
+    # Plans of unchanged years are loaded from the plan cache.
+    for year in range(min(args.years), max(args.years) + 1):
+        site_schedule.createEvents(year)
+    segments = site_schedule.createClockPlan(date(min(args.years), 1, 1),
+                                             date(max(args.years) + 1, 1, 1))
+    if args.output == '-':
+        exportClockPlan(segments, sys.stdout)
+    else:
+        exportClockPlan(segments, args.output)
+        print(f'Clock program {args.output} created with {len(segments)} segments.')
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    '''Export the day records of one or more years.'''
+    from civilite.export import WRITERS, exportSchedules
+    if args.output == '-':
+        # Binary formats are written to the bytes of standard output.
+        out_file = sys.stdout.buffer if WRITERS[args.format].binary else sys.stdout
+        exportSchedules(_siteSchedule(args), args.years, out_file, args.format)
+    else:
+        count = exportSchedules(_siteSchedule(args), args.years, args.output, args.format)
+        print(f'Exported {count} records to {args.output}.')
+    return 0
+
+
+def render(args: argparse.Namespace) -> int:
+    '''Render the PDF calendar of a year.'''
+    from civilite.render import renderCalendar
+    output = args.output or f'lighting_calendar_{args.year}.pdf'
+    with open(output, 'wb') as out_file:
+        out_file.write(renderCalendar(_siteSchedule(args), args.year))
+    print(f'Calendar {output} created.')
+    return 0
+
+
+def stateAt(args: argparse.Namespace) -> int:
+    '''Print whether the lights are ON or OFF at an instant, and the next transition.'''
+    from civilite.results import TransitionIndex
+    transitions = TransitionIndex.load(args.plan) if os.path.exists(args.plan) else None
+    tzinfo = None if transitions is None else transitions.start.tzinfo
+    when = datetime.now(tzinfo) if args.when is None else datetime.fromisoformat(args.when)
+    if when.tzinfo is None:
+        # A local time of the plan's timezone, or of the system.
+        when = when.replace(tzinfo=tzinfo) if tzinfo is not None else when.astimezone()
+    if transitions is not None and transitions.covers(when):
+        state, next_transition = transitions.stateAt(when), transitions.nextTransition(when)
+    else:
+        # No usable plan: compute the transitions around this instant.
+        site_schedule = _siteSchedule(args)
+        state, next_transition = site_schedule.stateAt(when), site_schedule.nextTransition(when)
+    print('ON' if state else 'OFF', end='')
+    if next_transition is not None:
+        print(f' until {next_transition[0].isoformat()}', end='')
+    print()
+    return 0
+
+
+def createParser() -> argparse.ArgumentParser:
+    '''Return the argument parser of the command line interface.'''
+    this_year = date.today().year
+    parser = argparse.ArgumentParser(prog='civilite', description='Outdoor lighting schedules.')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
+    parser.add_argument('--metrics', action='store_true',
+                        help='print instrumentation counters and stage timings to standard error')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='neither load nor save year plans in the plan cache')
+    site = parser.add_argument_group(
+        'site', 'the default is the built-in HoP schedule, location and timezone')
+    site.add_argument('--calendar', metavar='SOURCE',
+                      help='iCalendar path or URL of the events, instead of the built-in schedule')
+    site.add_argument('--latitude', type=float, help='latitude of the site in degrees')
+    site.add_argument('--longitude', type=float, help='longitude of the site in degrees')
+    site.add_argument('--elevation', type=float, default=0.0,
+                      help='elevation of the site in meters, default is 0')
+    site.add_argument('--timezone', help='IANA timezone of the site, e.g. US/Pacific')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('plan',
+                                  help='save the ON/OFF transitions of a year as a plan file')
+    command.add_argument('year', nargs='?', type=int, default=this_year,
+                         help='default is the current year')
+    command.add_argument('--plan', default=DEFAULT_PLAN_PATH,
+                         help=f'plan file, default is {DEFAULT_PLAN_PATH}')
+    command.set_defaults(function=plan)
+
+    command = commands.add_parser(
+        'program', help='write the astro clock program from the first to the last year')
+    command.add_argument('years', nargs='+', type=int, metavar='year')
+    command.add_argument('--output', default='-', help='CSV file, default is standard output')
+    command.set_defaults(function=program)
+
+    command = commands.add_parser('export', help='export day records as CSV, JSON Lines or Parquet')
+    command.add_argument('years', nargs='+', type=int, metavar='year')
+    command.add_argument('--format', default='csv', choices=('csv', 'jsonl', 'parquet'))
+    command.add_argument('--output', default='-', help='output file, default is standard output')
+    command.set_defaults(function=export)
+
+    command = commands.add_parser('render', help='render the PDF calendar of a year')
+    command.add_argument('year', nargs='?', type=int, default=this_year,
+                         help='default is the current year')
+    command.add_argument('--output', help='PDF file, default is lighting_calendar_<year>.pdf')
+    command.set_defaults(function=render)
+
+    command = commands.add_parser('state-at', help='print whether the lights are ON at an instant')
+    command.add_argument('when', nargs='?', help='ISO 8601 date and time, default is now')
+    command.add_argument('--plan', default=DEFAULT_PLAN_PATH,
+                         help=f'plan file, default is {DEFAULT_PLAN_PATH}')
+    command.set_defaults(function=stateAt)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    '''Entry point of the ``civilite`` command.'''
+    parser = createParser()
+    args = parser.parse_args(argv)
+    if (args.latitude is None) != (args.longitude is None):
+        parser.error('--latitude and --longitude must be given together')
+    if not args.metrics:
+        return args.function(args)
+    from civilite.instrumentation import INSTRUMENTATION
+    INSTRUMENTATION.enable()
+    try:
+        return args.function(args)
+    finally:
+        INSTRUMENTATION.enable(False)
+        json.dump(INSTRUMENTATION.snapshot(), sys.stderr, indent=2)
+        sys.stderr.write('\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+''' asyncio lighting controller for civilite
+
+Drives the outputs of one or more lighting zones from their weekly schedules.
+Each zone sleeps until its next ON/OFF transition, local midnight, or a schedule
+change, whichever comes first, instead of polling.
+
+Transitions are absolute instants, so DST changes need no special handling.
+After every wake-up the state is re-evaluated from the clock's current time,
+so jumps of the system clock in either direction are corrected at the next
+wake-up, which is never more than ``MAX_SLEEP_SECONDS`` away.
+
+An output that raises an exception is logged to ``LOGGER`` and does not stop
+its zone, the other outputs of the zone or the other zones.
+'''
+
+# Builtins
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# self
+import civilite._meta as meta
+from civilite.schedule import WeeklySchedule
+
+__version__ = meta.__version__
+
+# Longest time a zone sleeps without re-checking the clock, in seconds.
+MAX_SLEEP_SECONDS = 300.0
+
+# An output receives (zone name, lights ON, instant of the change).
+Output = Callable[[str, bool, datetime], Awaitable[None]]
+
+# Logger of the outputs that failed.
+LOGGER = logging.getLogger(__name__)
+
+
+class Clock:
+    '''Source of the current time and of sleeping for ``LightingController``.
+    Tests may substitute a fake clock with the same two methods.'''
+
+    def now(self) -> datetime:
+        '''Return the current timezone-aware time.'''
+        return datetime.now(timezone.utc)
+
+    async def sleep(self, seconds: float) -> None:
+        '''Suspend the calling task for a number of seconds.'''
+        await asyncio.sleep(seconds)
+
+
+class Zone:
+    '''A lighting zone: a schedule and the outputs that switch its lights.'''
+
+    def __init__(self, name: str, schedule: WeeklySchedule, outputs: List[Output]) -> None:
+        self.name = name
+        self.schedule = schedule
+        self.outputs = outputs
+        # The last state sent to the outputs, `None` before the first one.
+        self.state = None
+        # Set to wake the zone early, e.g. when its schedule changed. Created by
+        # ``LightingController.run`` in its event loop; `None` while the zone is not running.
+        self.changed: Optional[asyncio.Event] = None
+
+
+class LightingController:
+    '''Runs many lighting zones concurrently in one event loop.'''
+
+    def __init__(self, clock: Optional[Clock] = None, max_sleep: float = MAX_SLEEP_SECONDS) -> None:
+        '''Create a new controller.
+
+        Args:
+            clock:     Source of time and sleeping. Default is the system clock.
+            max_sleep: Longest time, in seconds, a zone sleeps without re-checking the clock.
+        '''
+        self.clock = Clock() if clock is None else clock
+        self.max_sleep = max_sleep
+        self.zones: Dict[str, Zone] = {}
+        self._running = False
+
+    def addZone(self, name: str, schedule: WeeklySchedule, *outputs: Output) -> Zone:
+        '''Add a zone driven by a schedule.
+        Zones added while running start with the next ``run``.'''
+        zone = Zone(name, schedule, list(outputs))
+        self.zones[name] = zone
+        return zone
+
+    def updateSchedule(self, name: str, schedule: Optional[WeeklySchedule] = None) -> None:
+        '''Re-plan a zone after its schedule was edited or replaced.'''
+        zone = self.zones[name]
+        if schedule is not None:
+            zone.schedule = schedule
+        zone.schedule.transitions = None
+        if zone.changed is not None:
+            zone.changed.set()
+
+    def stop(self) -> None:
+        '''Stop all zones. ``run`` returns once every zone has woken up.'''
+        self._running = False
+        for zone in self.zones.values():
+            if zone.changed is not None:
+                zone.changed.set()
+
+    async def run(self) -> None:
+        '''Drive all zones until ``stop`` is called.'''
+        self._running = True
+        zones = list(self.zones.values())
+        for zone in zones:
+            # Created here so that the event belongs to the running loop on any Python version.
+            zone.changed = asyncio.Event()
+        try:
+            await asyncio.gather(*(self._runZone(zone) for zone in zones))
+        finally:
+            for zone in zones:
+                zone.changed = None
+
+    async def _runZone(self, zone: Zone) -> None:
+        '''Switch a zone's outputs at each transition of its schedule.'''
+        while self._running:
+            now = self.clock.now()
+            state = zone.schedule.stateAt(now)
+            if state != zone.state:
+                zone.state = state
+                await self._switch(zone, state, now)
+            await self._sleepUntil(zone, self._nextWakeUp(zone, now))
+
+    @staticmethod
+    async def _switch(zone: Zone, state: bool, now: datetime) -> None:
+        '''Send a new state to all outputs of a zone concurrently, logging those that fail.'''
+        results = await asyncio.gather(*(output(zone.name, state, now) for output in zone.outputs),
+                                       return_exceptions=True)
+        for output, result in zip(zone.outputs, results):
+            if isinstance(result, Exception):
+                LOGGER.error('Output %r of zone %s failed to switch the lights %s',
+                             output, zone.name, 'ON' if state else 'OFF', exc_info=result)
+            elif isinstance(result, BaseException):
+                raise result
+
+    def _nextWakeUp(self, zone: Zone, now: datetime) -> datetime:
+        '''Return the earliest of the next transition, the next local midnight
+        and the longest sleep.'''
+        schedule = zone.schedule
+        local_date = now.astimezone(schedule.tzinfo).date()
+        midnight = schedule.twilight.localize(local_date + timedelta(days=1), time())
+        transitions = schedule.transitions
+        if transitions is not None and not transitions.covers(midnight + timedelta(days=1)):
+            # Re-plan before the index runs out;
+            # twilight for days already planned comes from the cache.
+            schedule.transitions = None
+        candidates = [midnight, now + timedelta(seconds=self.max_sleep)]
+        transition = schedule.nextTransition(now)
+        if transition is not None:
+            candidates.append(transition[0])
+        return min(candidates)
+
+    async def _sleepUntil(self, zone: Zone, wake_up: datetime) -> None:
+        '''Sleep until an instant, or until the zone is woken up early.'''
+        delay = max((wake_up - self.clock.now()).total_seconds(), 0.0)
+        sleeper = asyncio.ensure_future(self.clock.sleep(delay))
+        waker = asyncio.ensure_future(zone.changed.wait())
+        _, pending = await asyncio.wait({sleeper, waker}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        zone.changed.clear()
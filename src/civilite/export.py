@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+''' Bulk export of schedule records for civilite
+
+Streams day records of one or many sites to CSV, JSON Lines, or Parquet
+(the latter requires pyarrow). Records are written in batches as they are
+generated, so multi-site and multi-year datasets never need to fit in memory.
+Astro clock programs are written as CSV.
+
+A record is a tuple of (site, date, sunset datetime, event type, "event type changed" flag),
+where site is a name or `None` for a single unnamed schedule.
+'''
+
+# Builtins
+import abc
+import calendar
+import json
+from datetime import date, datetime, timezone
+from typing import IO, TYPE_CHECKING, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+# self
+import civilite._meta as meta
+from civilite.instrumentation import INSTRUMENTATION, STAGE_EXPORT
+from civilite.results import EVENT_TYPES, ClockSegment
+
+if TYPE_CHECKING:
+    # Only for annotations: civilite.schedule writes its CSV output with this module.
+    from civilite.schedule import WeeklySchedule
+
+__version__ = meta.__version__
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMATS = (FORMAT_CSV, FORMAT_JSONL, FORMAT_PARQUET)
+# Number of records buffered before they are written out.
+EXPORT_BATCH_SIZE = 4096
+
+ExportRecord = Tuple[Optional[str], date, datetime, Optional[int], bool]
+ExportTarget = Union[str, IO]
+
+_DAY_ABBR = tuple(calendar.day_abbr)
+_TYPE_NAMES = {None: ''}
+_TYPE_NAMES.update(EVENT_TYPES)
+
+
+def iterRecords(schedules: Union['WeeklySchedule', Mapping[str, 'WeeklySchedule']],
+                start_date: date, end_date: date) -> Iterator[ExportRecord]:
+    '''Lazily generate the export records of one or many schedules.
+
+    Args:
+        schedules:  A schedule, or a mapping of site names to schedules.
+        start_date: The first day to export.
+        end_date:   The day after the last day to export.
+
+    Yield:
+        Records of each site in turn, ordered by date.
+    '''
+    if not isinstance(schedules, Mapping):
+        schedules = {None: schedules}
+    for site, site_schedule in schedules.items():
+        for calendar_date, sunset_time, evt_type, evt_changed in site_schedule.iterEvents(
+                start_date, end_date):
+            yield site, calendar_date, sunset_time, evt_type, evt_changed
+
+
+class RecordWriter(abc.ABC):
+    '''Base class of the streaming writers: buffers records and writes them in batches.
+
+    Writers are context managers; the last batch is written when the writer is closed.
+    Subclasses implement ``RecordWriter._writeBatch``.
+    '''
+    # Open the target in binary mode.
+    binary = False
+
+    def __init__(self, target: ExportTarget, batch_size: int = EXPORT_BATCH_SIZE) -> None:
+        '''Create a writer.
+
+        Args:
+            target:     A path, or a file object that stays open after the writer is closed.
+            batch_size: Number of records buffered before they are written out.
+        '''
+        if isinstance(target, str):
+            if self.binary:
+                self.out_file = open(target, 'wb')
+            else:
+                self.out_file = open(target, 'w', encoding='utf-8', newline='')
+            self._owns_file = True
+        else:
+            self.out_file = target
+            self._owns_file = False
+        self.batch_size = batch_size
+        self.count = 0
+        self._batch: List[ExportRecord] = []
+
+    def __enter__(self) -> 'RecordWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, record: ExportRecord) -> None:
+        '''Add one record.'''
+        self._batch.append(record)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def writeAll(self, records: Iterable[ExportRecord]) -> int:
+        '''Add all records of an iterable and return the number of records written so far.'''
+        for record in records:
+            self.write(record)
+        return self.count + len(self._batch)
+
+    def flush(self) -> None:
+        '''Write the buffered records.'''
+        if self._batch:
+            with INSTRUMENTATION.timer(STAGE_EXPORT):
+                self._writeBatch(self._batch)
+            self.count += len(self._batch)
+            self._batch = []
+
+    def close(self) -> None:
+        '''Write the buffered records and close the target if the writer opened it.'''
+        if self.out_file is None:
+            return
+        self.flush()
+        with INSTRUMENTATION.timer(STAGE_EXPORT):
+            self._finish()
+        if self._owns_file:
+            self.out_file.close()
+        self.out_file = None
+
+    @abc.abstractmethod
+    def _writeBatch(self, batch: List[ExportRecord]) -> None:
+        '''Write a batch of records to ``RecordWriter.out_file``.'''
+
+    def _finish(self) -> None:
+        '''Complete the output after the last batch.'''
+
+
+class CsvWriter(RecordWriter):
+    '''Writes records as CSV with the columns of
+    ``WeeklySchedule.createEvents(create_output=True)``.
+    A leading "Site" column is added when site_column is True.'''
+
+    def __init__(self, target: ExportTarget, batch_size: int = EXPORT_BATCH_SIZE,
+                 site_column: bool = False) -> None:
+        super().__init__(target, batch_size)
+        self.site_column = site_column
+        header = '"Weekday","Date","Sunset","Event Type","Event Change?"\n'
+        self.out_file.write('"Site",' + header if site_column else header)
+
+    def _writeBatch(self, batch: List[ExportRecord]) -> None:
+        site_column = self.site_column
+        lines = []
+        for site, calendar_date, sunset_time, evt_type, evt_changed in batch:
+            line = (f'"{_DAY_ABBR[calendar_date.weekday()]}",{calendar_date.isoformat()},'
+                    f'{sunset_time.hour:02d}:{sunset_time.minute:02d}:{sunset_time.second:02d},'
+                    f'"{_TYPE_NAMES[evt_type]}",{"*" if evt_changed else ""}\n')
+            lines.append(f'"{site or ""}",' + line if site_column else line)
+        self.out_file.write(''.join(lines))
+
+
+class JsonLinesWriter(RecordWriter):
+    '''Writes records as JSON Lines, one object per day with an ISO 8601 sunset time.'''
+
+    def _writeBatch(self, batch: List[ExportRecord]) -> None:
+        dumps = json.dumps
+        self.out_file.write(''.join(
+            dumps({'site': site,
+                   'date': calendar_date.isoformat(),
+                   'sunset': sunset_time.isoformat(),
+                   'event_type': EVENT_TYPES.get(evt_type),
+                   'changed': evt_changed}) + '\n'
+            for site, calendar_date, sunset_time, evt_type, evt_changed in batch))
+
+
+class ParquetWriter(RecordWriter):
+    '''Writes records as a Parquet file with one row group per batch. Requires pyarrow.
+
+    Sunsets are stored as UTC timestamps in whole seconds,
+    together with their UTC offset in seconds.
+    '''
+    binary = True
+
+    def __init__(self, target: ExportTarget, batch_size: int = EXPORT_BATCH_SIZE) -> None:
+        # Imported here so that pyarrow is only needed for this format.
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(target, batch_size)
+        self._pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('site', pyarrow.string()),
+            ('date', pyarrow.date32()),
+            ('sunset', pyarrow.timestamp('s', tz='UTC')),
+            ('utc_offset', pyarrow.int32()),
+            ('event_type', pyarrow.string()),
+            ('changed', pyarrow.bool_()),
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(self.out_file, self.schema)
+
+    def _writeBatch(self, batch: List[ExportRecord]) -> None:
+        sites, dates, sunsets, offsets, types, changes = zip(*(
+            (site, calendar_date, sunset_time.astimezone(timezone.utc).replace(microsecond=0),
+             int(sunset_time.utcoffset().total_seconds()), EVENT_TYPES.get(evt_type), evt_changed)
+            for site, calendar_date, sunset_time, evt_type, evt_changed in batch))
+        self._writer.write_table(self._pyarrow.Table.from_arrays(
+            [self._pyarrow.array(column, field.type)
+             for column, field in zip((sites, dates, sunsets, offsets, types, changes),
+                                      self.schema)],
+            schema=self.schema))
+
+    def _finish(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {FORMAT_CSV: CsvWriter, FORMAT_JSONL: JsonLinesWriter, FORMAT_PARQUET: ParquetWriter}
+
+
+def exportRecords(records: Iterable[ExportRecord], target: ExportTarget,
+                  output_format: str = FORMAT_CSV, batch_size: int = EXPORT_BATCH_SIZE,
+                  **options) -> int:
+    '''Stream records to a path or file object.
+
+    Args:
+        records:       Records such as those generated by ``iterRecords``.
+        target:        A path, or a file object opened in text mode (binary mode for Parquet).
+        output_format: One of ``FORMATS``.
+        batch_size:    Number of records buffered before they are written out.
+        options:       Extra keyword arguments of the writer, e.g. ``site_column`` for CSV.
+
+    Return:
+        The number of records written.
+    '''
+    if output_format not in WRITERS:
+        raise ValueError(f'Unknown export format {output_format!r}, expected one of {FORMATS}')
+    # Only the writes of each batch are timed as the export stage: generating the records
+    # is timed by the stages of the schedule.
+    with WRITERS[output_format](target, batch_size, **options) as writer:
+        writer.writeAll(records)
+    return writer.count
+
+
+def _yearRecords(schedules: Mapping[Optional[str], 'WeeklySchedule'],
+                 year: int) -> Iterator[ExportRecord]:
+    '''Generate the records of a whole year of each schedule in turn. The records of schedules
+    with a plan cache come from their year plans, so that unchanged plans are not computed again.'''
+    for site, site_schedule in schedules.items():
+        if site_schedule.plan_cache is None:
+            yield from iterRecords({site: site_schedule}, date(year, 1, 1), date(year + 1, 1, 1))
+        else:
+            plan = site_schedule.createEvents(year)
+            for calendar_date in sorted(plan):
+                yield (site, calendar_date) + plan[calendar_date]
+
+
+def exportSchedules(schedules: Union['WeeklySchedule', Mapping[str, 'WeeklySchedule']],
+                    years: Iterable[int], target: ExportTarget, output_format: str = FORMAT_CSV,
+                    batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    '''Export whole years of one or many schedules.
+
+    With a mapping of sites, CSV output gets a "Site" column. Returns the number of records written.
+    '''
+    multi_site = isinstance(schedules, Mapping)
+    sites = schedules if multi_site else {None: schedules}
+    records = (record for year in years for record in _yearRecords(sites, year))
+    options = {'site_column': multi_site} if output_format == FORMAT_CSV else {}
+    return exportRecords(records, target, output_format, batch_size, **options)
+
+
+def exportClockPlan(segments: Iterable[ClockSegment], target: ExportTarget) -> int:
+    '''Write an astro clock program, such as the result of ``WeeklySchedule.createClockPlan``,
+    as CSV.
+
+    Each row is one segment. Where a day has several intervals that turn lights ON,
+    their ON and OFF times are separated by spaces. Returns the number of segments written.
+    '''
+    # Generate the segments first, so that the export stage times writing only.
+    segments = list(segments)
+    with INSTRUMENTATION.timer(STAGE_EXPORT):
+        out_file = (open(target, 'w', encoding='utf-8', newline='') if isinstance(target, str)
+                    else target)
+        try:
+            lines = ['"Weekday","Event Type","First Date","Last Date","Weeks","ON","OFF"\n']
+            for segment in segments:
+                on_times = ' '.join('SUNSET' if on_time is None else f'{on_time:%H:%M}'
+                                    for on_time, _ in segment.switching)
+                off_times = ' '.join('SUNRISE' if off_time is None else f'{off_time:%H:%M}'
+                                     for _, off_time in segment.switching)
+                lines.append(f'"{_DAY_ABBR[segment.weekday]}","{_TYPE_NAMES[segment.event_type]}",'
+                             f'{segment.first_date.isoformat()},{segment.last_date.isoformat()},'
+                             f'{segment.weeks},'
+                             f'"{on_times}","{off_times}"\n')
+            out_file.write(''.join(lines))
+        finally:
+            if out_file is not target:
+                out_file.close()
+    return len(lines) - 1
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+''' Opt-in instrumentation for civilite
+
+Counters, stage timers and hooks for finding out where civilite spends its time.
+``INSTRUMENTATION`` is the instrumentation of this process, shared by all modules.
+Stages are timed where their own work is done, so that the stage totals of a run
+never add up to more than its wall time.
+'''
+
+# Builtins
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List
+
+# self
+import civilite._meta as meta
+
+__version__ = meta.__version__
+
+# Stages timed by the instrumentation.
+STAGE_TWILIGHT = 'twilight'
+STAGE_CLASSIFY = 'classify'
+STAGE_EXPORT = 'export'
+STAGE_RENDER = 'render'
+
+
+class Instrumentation:
+    '''Opt-in counters, stage timers and hooks for finding out where civilite spends its time.
+
+    Disabled by default. While disabled, instrumented code only checks ``Instrumentation.enabled``.
+    Counters:
+        solar_computations:    dates whose twilight was computed by a backend
+        twilight_table_hits:   twilight read from a twilight table
+        twilight_cache_hits:   twilight read from the twilight cache
+        twilight_cache_misses: twilight not in the cache
+        plan_cache_hits:       years whose plan ``WeeklySchedule.createEvents`` had kept
+        plan_cache_misses:     years planned by ``WeeklySchedule.createEvents``
+        plan_disk_hits:        year plans loaded from ``WeeklySchedule.plan_cache``
+        plan_disk_misses:      year plans not found in ``WeeklySchedule.plan_cache``
+        days_classified:       days whose event type was determined
+        fast_exact_fallbacks:  dates the fast backend computed exactly instead of interpolating
+    Timers, by stage: ``STAGE_TWILIGHT``, ``STAGE_CLASSIFY``, ``STAGE_EXPORT``, ``STAGE_RENDER``.
+    Measurements of worker processes, e.g. of ``civilite.batch``, stay in those processes.
+    '''
+
+    def __init__(self) -> None:
+        self.enabled = False
+        # Key: counter name, value: count.
+        self.counters: Dict[str, int] = {}
+        # Key: stage, value: [number of timed calls, total seconds].
+        self.timers: Dict[str, List[float]] = {}
+        # Functions called as ``hook(stage, seconds)`` each time a stage is timed.
+        self.hooks: List[Callable[[str, float], None]] = []
+
+    def enable(self, enabled: bool = True) -> None:
+        '''Turn instrumentation on or off. Collected measurements are kept.'''
+        self.enabled = enabled
+
+    def reset(self) -> None:
+        '''Clear all counters and timers.'''
+        self.counters.clear()
+        self.timers.clear()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        '''Add to a counter.'''
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def addTime(self, stage: str, seconds: float) -> None:
+        '''Record one timed call of a stage and pass it on to the hooks.'''
+        timer = self.timers.setdefault(stage, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        for hook in self.hooks:
+            hook(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        '''Time the enclosed block as a call of a stage, if instrumentation is enabled.'''
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(stage, perf_counter() - start)
+
+    def addHook(self, hook: Callable[[str, float], None]) -> None:
+        '''Call a function as ``hook(stage, seconds)`` each time a stage is timed.'''
+        self.hooks.append(hook)
+
+    def removeHook(self, hook: Callable[[str, float], None]) -> None:
+        '''Stop calling a hook.'''
+        self.hooks.remove(hook)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        '''Return the current measurements as a JSON-serializable dictionary.'''
+        return {'counters': dict(self.counters),
+                'timers': {stage: {'calls': calls, 'seconds': seconds}
+                           for stage, (calls, seconds) in self.timers.items()}}
+
+
+# The instrumentation of this process.
+INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+''' Occupancy schedules from iCalendar sources for civilite
+
+Builds ``WeeklySchedule`` objects from iCalendar (RFC 5545) files or HTTP
+endpoints, for many buildings at once. HTTP sources are fetched concurrently
+over pooled connections with conditional requests (ETag / If-Modified-Since),
+and parsed results are kept in an on-disk cache, so a calendar that did not
+change since the last load is neither downloaded nor parsed again.
+
+Supported calendar content:
+    * VEVENTs with a DTSTART date-time and a DTEND or DURATION.
+      Times in UTC or with a TZID are converted to the building's timezone.
+    * Weekly (``FREQ=WEEKLY``, optionally with ``BYDAY``) and daily recurrences
+      without UNTIL or COUNT become weekly events; events without RRULE become
+      events on their date.
+    * Weekly and daily recurrences with UNTIL or COUNT are expanded into events
+      on the dates of their occurrences, leaving out the dates of EXDATE.
+      Weekly events have no exceptions: EXDATE of open-ended recurrences is ignored.
+    * All-day events, cancelled events, and other recurrences are ignored.
+HTTP sources require the ``requests`` package.
+'''
+
+# Builtins
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone, tzinfo as TzInfo
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+
+# 3rd party
+from astral import Observer
+
+# self
+import civilite._meta as meta
+from civilite.schedule import ScheduleEvent, WeeklySchedule
+from civilite.offsets import timezoneName
+
+__version__ = meta.__version__
+
+# Version of the files in the parsed-result cache. Files of other versions are ignored.
+CACHE_VERSION = 2
+# Default number of concurrent fetches and of pooled connections per host.
+LOADER_MAX_WORKERS = 8
+# Timeout of HTTP requests in seconds.
+HTTP_TIMEOUT = 10.0
+
+# A parsed event: (weekday or date, start, stop), as in ``civilite.batch.packSite``.
+PackedEvent = Tuple[Union[int, date], time, time]
+# A building: (observer, timezone, iCalendar path or URL).
+CalendarSite = Tuple[Observer, TzInfo, str]
+
+_WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+_RE_DURATION = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+# Last time of a day for events that continue past midnight.
+_END_OF_DAY = time(23, 59, 59)
+
+
+def _contentLines(text: str) -> List[Tuple[str, Dict[str, str], str]]:
+    '''Unfold iCalendar content lines and split them into (name, parameters, value).'''
+    result = []
+    for line in re.sub(r'\r?\n[ \t]', '', text).splitlines():
+        if not line:
+            continue
+        # The value starts at the first colon outside of a quoted parameter value.
+        quoted = False
+        for index, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif char == ':' and not quoted:
+                break
+        else:
+            continue
+        name, *params = line[:index].split(';')
+        parts = (param.partition('=') for param in params)
+        result.append((name.upper(),
+                       {key.upper(): value.strip('"') for key, _, value in parts},
+                       line[index + 1:]))
+    return result
+
+
+def _dateTime(value: str, params: Dict[str, str], tzinfo: TzInfo) -> Optional[datetime]:
+    '''Return a DATE-TIME value in a timezone, or `None` for a DATE value.'''
+    if params.get('VALUE') == 'DATE' or 'T' not in value:
+        return None
+    naive = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return naive.replace(tzinfo=timezone.utc).astimezone(tzinfo)
+    if 'TZID' in params:
+        try:
+            # Imported here because zoneinfo is new in Python 3.9
+            # and only needed for foreign timezones.
+            from zoneinfo import ZoneInfo
+            return naive.replace(tzinfo=ZoneInfo(params['TZID'])).astimezone(tzinfo)
+        except (ImportError, LookupError, ValueError):
+            pass
+    # Floating time, or a timezone we do not know: the building's local time.
+    return naive
+
+
+def _duration(value: str) -> timedelta:
+    '''Return the value of a DURATION property.'''
+    match = _RE_DURATION.match(value)
+    if match is None:
+        raise ValueError(f'Invalid iCalendar duration {value!r}')
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    result = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                       minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -result if sign == '-' else result
+
+
+def _occurrences(rule: Dict[str, str], first_date: date, until: Optional[date]) -> List[date]:
+    '''Return the dates of the occurrences of a daily or weekly rule with UNTIL or COUNT.
+
+    Args:
+        rule:       The parts of the RRULE.
+        first_date: The date of DTSTART.
+        until:      The last date on which an occurrence may start, or `None` to use COUNT.
+    '''
+    interval = int(rule.get('INTERVAL', '1'))
+    count = int(rule['COUNT']) if until is None else None
+    if rule['FREQ'] == 'DAILY':
+        period, weekdays = interval, [0]
+        period_start = first_date
+    else:
+        period = 7 * interval
+        weekdays = sorted({_WEEKDAYS[day[-2:]] for day in rule['BYDAY'].split(',')}
+                          if 'BYDAY' in rule else {first_date.weekday()})
+        # Weeks start on Monday.
+        period_start = first_date - timedelta(days=first_date.weekday())
+    result = []
+    while True:
+        for weekday in weekdays:
+            occurrence = period_start + timedelta(days=weekday)
+            if occurrence < first_date:
+                continue
+            if ((until is not None and occurrence > until) or
+                    (count is not None and len(result) >= count)):
+                return result
+            result.append(occurrence)
+        period_start += timedelta(days=period)
+
+
+def _packEvent(properties: Dict[str, Tuple[Dict[str, str], str]],
+               tzinfo: TzInfo) -> List[PackedEvent]:
+    '''Convert the properties of one VEVENT to packed events.'''
+    if 'DTSTART' not in properties or properties.get('STATUS', ({}, ''))[1].upper() == 'CANCELLED':
+        return []
+    start = _dateTime(properties['DTSTART'][1], properties['DTSTART'][0], tzinfo)
+    if start is None:
+        return []
+    if 'DTEND' in properties:
+        stop = _dateTime(properties['DTEND'][1], properties['DTEND'][0], tzinfo)
+        if stop is None:
+            return []
+    else:
+        stop = start + _duration(properties.get('DURATION', ({}, 'PT0S'))[1])
+    start, stop = start.replace(tzinfo=None), stop.replace(tzinfo=None)
+    # Events must lie within one day: split them at midnight.
+    days = []
+    day_start = start
+    while day_start.date() < stop.date():
+        days.append((day_start.date(), day_start.time(), _END_OF_DAY))
+        day_start = datetime.combine(day_start.date() + timedelta(days=1), time())
+    if stop > day_start or not days:
+        days.append((day_start.date(), day_start.time(), stop.time()))
+
+    if 'RRULE' not in properties:
+        return days
+    rule = dict(part.partition('=')[::2] for part in properties['RRULE'][1].upper().split(';'))
+    # Weekdays refer to DTSTART in its own timezone; keep the shift of the conversion.
+    original_start = datetime.strptime(properties['DTSTART'][1][:8], '%Y%m%d').date()
+    shift = (start.date() - original_start).days
+    if rule.get('FREQ') in ('DAILY', 'WEEKLY') and ('UNTIL' in rule or 'COUNT' in rule):
+        return _expandEvent(properties, rule, original_start, start, days, tzinfo)
+    if rule.get('INTERVAL', '1') != '1':
+        return []
+    if rule.get('FREQ') == 'DAILY':
+        weekdays = range(7)
+    elif rule.get('FREQ') == 'WEEKLY' and 'BYDAY' in rule:
+        weekdays = [_WEEKDAYS[day[-2:]] for day in rule['BYDAY'].split(',')]
+    elif rule.get('FREQ') == 'WEEKLY':
+        weekdays = [original_start.weekday()]
+    else:
+        return []
+    return [((weekday + shift + (day_date - start.date()).days) % 7, day_start_time, day_stop)
+            for weekday in weekdays for day_date, day_start_time, day_stop in days]
+
+
+def _expandEvent(properties: Dict[str, Tuple[Dict[str, str], str]], rule: Dict[str, str],
+                 original_start: date, start: datetime, days: List[PackedEvent],
+                 tzinfo: TzInfo) -> List[PackedEvent]:
+    '''Return the events on the dates of the occurrences of a rule with UNTIL or COUNT,
+    leaving out the occurrences on the dates of EXDATE.
+
+    Args:
+        properties:     The properties of the VEVENT.
+        rule:           The parts of its RRULE.
+        original_start: The date of DTSTART in its own timezone.
+        start:          DTSTART in the building's timezone.
+        days:           The events of the first occurrence, split at midnight.
+        tzinfo:         The building's timezone.
+    '''
+    until = None
+    if 'UNTIL' in rule:
+        until_time = _dateTime(rule['UNTIL'], {}, tzinfo)
+        if until_time is None:
+            until = datetime.strptime(rule['UNTIL'][:8], '%Y%m%d').date()
+        else:
+            # The last occurrence starts at or before UNTIL.
+            until = original_start + timedelta(days=(until_time.replace(tzinfo=None) - start).days)
+    # Dates of DATE values refer to DTSTART's own timezone, date-times are converted.
+    excluded = set()
+    excluded_local = set()
+    exdate_params, exdate_values = properties.get('EXDATE', ({}, ''))
+    for value in filter(None, exdate_values.split(',')):
+        exdate_time = _dateTime(value, exdate_params, tzinfo)
+        if exdate_time is None:
+            excluded.add(datetime.strptime(value[:8], '%Y%m%d').date())
+        else:
+            excluded_local.add(exdate_time.date())
+    result = []
+    for occurrence in _occurrences(rule, original_start, until):
+        offset = occurrence - original_start
+        if occurrence in excluded or (start + offset).date() in excluded_local:
+            continue
+        result += [(day_date + offset, day_start_time, day_stop)
+                   for day_date, day_start_time, day_stop in days]
+    return result
+
+
+def parseCalendar(text: str, tzinfo: TzInfo) -> List[PackedEvent]:
+    '''Parse iCalendar content into packed events in a building's timezone.'''
+    result = []
+    properties = None
+    for name, params, value in _contentLines(text):
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            properties = {}
+        elif name == 'END' and value.upper() == 'VEVENT' and properties is not None:
+            result += _packEvent(properties, tzinfo)
+            properties = None
+        elif properties is not None and name == 'EXDATE' and name in properties:
+            # EXDATE may be given several times.
+            properties[name] = (properties[name][0], f'{properties[name][1]},{value}')
+        elif properties is not None:
+            properties.setdefault(name, (params, value))
+    return result
+
+
+def buildSchedule(observer: Observer, tzinfo: TzInfo, events: List[PackedEvent],
+                  **options) -> WeeklySchedule:
+    '''Build a schedule from packed events. Options are passed on to ``WeeklySchedule``.'''
+    result = WeeklySchedule(observer, tzinfo, **options)
+    for key, start, stop in events:
+        if isinstance(key, date):
+            result.addDateEvent(key, ScheduleEvent(start, stop))
+        else:
+            result.addEvent(key, ScheduleEvent(start, stop))
+    return result
+
+
+class CalendarLoader:
+    '''Loads iCalendar sources with pooled connections, conditional requests
+    and a parsed-result cache.
+
+    Counters of the work done are kept in ``CalendarLoader.downloads``,
+    ``CalendarLoader.not_modified`` and ``CalendarLoader.parsed``.
+    '''
+
+    def __init__(self, cache_path: Optional[str] = None, max_workers: int = LOADER_MAX_WORKERS,
+                 timeout: float = HTTP_TIMEOUT) -> None:
+        '''Create a new loader.
+
+        Args:
+            cache_path:  Directory of the parsed-result cache. If `None`, results are only
+                           kept in memory for the lifetime of the loader.
+            max_workers: Number of concurrent fetches, and of pooled connections per host.
+            timeout:     Timeout of HTTP requests in seconds.
+        '''
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.downloads = 0
+        self.not_modified = 0
+        self.parsed = 0
+        self._memory: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._session = None
+        if cache_path is not None:
+            os.makedirs(cache_path, exist_ok=True)
+
+    def __enter__(self) -> 'CalendarLoader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        '''Close the pooled HTTP connections.'''
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _getSession(self):
+        '''Return the HTTP session, creating it on first use.'''
+        with self._lock:
+            if self._session is None:
+                # Imported here so that requests is only needed for HTTP sources.
+                import requests
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_workers,
+                                                        pool_maxsize=self.max_workers)
+                self._session = requests.Session()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def _cacheFile(self, key: str) -> Optional[str]:
+        '''Return the path of the cache file of a key, if there is an on-disk cache.'''
+        if self.cache_path is None:
+            return None
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_path, digest + '.json')
+
+    def _readCache(self, key: str) -> Optional[dict]:
+        '''Return the cache entry of a key from memory or disk.'''
+        entry = self._memory.get(key)
+        cache_file = self._cacheFile(key)
+        if entry is None and cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as in_file:
+                    entry = json.load(in_file)
+            except (OSError, ValueError):
+                return None
+            if entry.get('version') != CACHE_VERSION or entry.get('key') != key:
+                return None
+            self._memory[key] = entry
+        return entry
+
+    def _writeCache(self, key: str, entry: dict) -> None:
+        '''Store the cache entry of a key in memory and on disk.'''
+        entry.update(version=CACHE_VERSION, key=key)
+        self._memory[key] = entry
+        cache_file = self._cacheFile(key)
+        if cache_file is not None:
+            temporary_file = f'{cache_file}.{threading.get_ident()}.tmp'
+            with open(temporary_file, 'w', encoding='utf-8') as out_file:
+                json.dump(entry, out_file)
+            os.replace(temporary_file, cache_file)
+
+    def _count(self, counter: str) -> None:
+        '''Increment a work counter.'''
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _parse(self, content: bytes, tzinfo: TzInfo, entry: Optional[dict]) -> Tuple[str, list]:
+        '''Return the digest and the events of content,
+        reusing the cached events if it did not change.'''
+        digest = hashlib.sha256(content).hexdigest()
+        if entry is not None and entry.get('digest') == digest:
+            return digest, entry['events']
+        self._count('parsed')
+        return digest, [[key.isoformat() if isinstance(key, date) else key,
+                         start.isoformat(), stop.isoformat()]
+                        for key, start, stop in parseCalendar(content.decode('utf-8'), tzinfo)]
+
+    def _loadEntry(self, source: str, tzinfo: TzInfo) -> dict:
+        '''Return the cache entry of a source, refreshing it if the source changed.'''
+        key = f'{source}|{timezoneName(tzinfo)}'
+        entry = self._readCache(key)
+        if source.startswith(('http://', 'https://')):
+            headers = {}
+            if entry is not None and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            response = self._getSession().get(source, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and entry is not None:
+                self._count('not_modified')
+                return entry
+            response.raise_for_status()
+            self._count('downloads')
+            digest, events = self._parse(response.content, tzinfo, entry)
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+        else:
+            status = os.stat(source)
+            validators = {'etag': f'{status.st_mtime_ns}-{status.st_size}', 'last_modified': None}
+            if entry is not None and entry.get('etag') == validators['etag']:
+                self._count('not_modified')
+                return entry
+            with open(source, 'rb') as in_file:
+                digest, events = self._parse(in_file.read(), tzinfo, entry)
+        entry = dict(validators, digest=digest, events=events)
+        self._writeCache(key, entry)
+        return entry
+
+    def loadEvents(self, source: str, tzinfo: TzInfo) -> List[PackedEvent]:
+        '''Return the events of an iCalendar path or URL in a building's timezone.'''
+        result = []
+        for key, start, stop in self._loadEntry(source, tzinfo)['events']:
+            result.append((date.fromisoformat(key) if isinstance(key, str) else key,
+                           time.fromisoformat(start), time.fromisoformat(stop)))
+        return result
+
+    def loadSchedules(self, sites: Mapping[str, CalendarSite],
+                      **options) -> Dict[str, WeeklySchedule]:
+        '''Load the schedules of many buildings concurrently.
+
+        Args:
+            sites:   Key: building name, value: (observer, timezone, iCalendar path or URL).
+            options: Keyword arguments passed on to each ``WeeklySchedule``.
+
+        Return:
+            Key: building name, value: its schedule.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {name: executor.submit(self.loadEvents, source, tzinfo)
+                       for name, (_, tzinfo, source) in sites.items()}
+            return {name: buildSchedule(sites[name][0], sites[name][1], future.result(), **options)
+                    for name, future in futures.items()}
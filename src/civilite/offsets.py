@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+''' UTC offset transitions of a timezone for civilite
+
+``UtcOffsetIndex`` resolves a timezone once for a span of dates into a sorted
+table of the instants at which its UTC offset changes. Converting between UTC
+and local time is then a bisection into that table instead of a timezone
+lookup per date, and the days on which the offset changes (DST changes) can be
+queried directly.
+
+Local times are resolved like PEP 495 with ``fold=0``, for pytz timezones too:
+a time that occurs twice when clocks are set back is the first occurrence, and
+a time skipped when clocks are set forward is moved forward by the gap.
+'''
+
+# Builtins
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta, timezone, tzinfo as TzInfo
+from typing import List, Optional, Tuple
+
+# self
+import civilite._meta as meta
+
+__version__ = meta.__version__
+
+# Interval between probes of timezones without a transition table, in seconds.
+PROBE_INTERVAL = 6 * 3600
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def ianaName(tzinfo: Optional[TzInfo]) -> Optional[str]:
+    '''Return the IANA name of a pytz or zoneinfo timezone, or `None` for other timezones.'''
+    return getattr(tzinfo, 'zone', None) or getattr(tzinfo, 'key', None)
+
+
+def timezoneName(tzinfo: TzInfo) -> str:
+    '''Return the IANA name of a pytz or zoneinfo timezone, or the name of other timezones.'''
+    return ianaName(tzinfo) or str(tzinfo)
+
+
+class UtcOffsetIndex:
+    '''The UTC offsets of a timezone over a span of dates.'''
+
+    def __init__(self, tzinfo: Optional[TzInfo], start_date: date, end_date: date) -> None:
+        '''Build the index.
+
+        Args:
+            tzinfo:     A pytz or ``datetime.tzinfo`` timezone. `None` is the local system timezone.
+            start_date: The first date covered by the index.
+            end_date:   The day after the last date covered by the index.
+        '''
+        self.tzinfo = tzinfo
+        self.start_date = start_date
+        self.end_date = end_date
+        # UTC epoch seconds spanned by the index, with a day of margin for any UTC offset.
+        self.start = (datetime.combine(start_date, time()) - _EPOCH).total_seconds() - 86400.0
+        self.end = (datetime.combine(end_date, time()) - _EPOCH).total_seconds() + 86400.0
+        # Segments of constant UTC offset: the instant each starts at as UTC epoch seconds,
+        # its UTC offset in seconds, and the tzinfo of local times in it.
+        self.times = array('d')
+        self.offsets = array('l')
+        self.zones: List[TzInfo] = []
+        if hasattr(tzinfo, '_utc_transition_times'):
+            self._fromPytz()
+        else:
+            self._fromProbes()
+
+    def _addSegment(self, start: float, local_time: datetime) -> None:
+        '''Start a new segment at an instant if the UTC offset changes there.'''
+        offset = int(local_time.utcoffset().total_seconds())
+        if not self.offsets or offset != self.offsets[-1]:
+            self.times.append(start)
+            self.offsets.append(offset)
+            self.zones.append(local_time.tzinfo)
+
+    def _localTime(self, seconds: float) -> datetime:
+        '''Convert UTC epoch seconds to local time with the timezone itself.'''
+        return datetime.fromtimestamp(seconds, timezone.utc).astimezone(self.tzinfo)
+
+    def _fromPytz(self) -> None:
+        '''Read the segments from the transition table of a pytz timezone.'''
+        tzinfo = self.tzinfo
+        transitions = [(transition - _EPOCH).total_seconds()
+                       for transition in tzinfo._utc_transition_times[1:]]
+        first = bisect_right(transitions, self.start)
+        self._addSegment(self.start, self._localTime(self.start))
+        for seconds in transitions[first:bisect_right(transitions, self.end)]:
+            self._addSegment(seconds, self._localTime(seconds))
+
+    def _fromProbes(self) -> None:
+        '''Find the segments of any other timezone by probing its UTC offset.'''
+        seconds = self.start
+        self._addSegment(seconds, self._localTime(seconds))
+        while seconds < self.end:
+            following = min(seconds + PROBE_INTERVAL, self.end)
+            local_time = self._localTime(following)
+            if local_time.utcoffset().total_seconds() != self.offsets[-1]:
+                # Find the first second of the new offset by bisection.
+                low, high = seconds, following
+                while high - low > 1.0:
+                    middle = (low + high) // 2
+                    if self._localTime(middle).utcoffset().total_seconds() == self.offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                self._addSegment(high, local_time)
+            seconds = following
+
+    def extend(self, start_date: date, end_date: date) -> None:
+        '''Extend the span of the index to include the dates from start_date up to, but not
+        including, end_date. Only the dates added to the span are resolved.'''
+        if start_date < self.start_date:
+            self._join(UtcOffsetIndex(self.tzinfo, start_date, self.start_date), self)
+        if end_date > self.end_date:
+            self._join(self, UtcOffsetIndex(self.tzinfo, self.end_date, end_date))
+
+    def _join(self, first: 'UtcOffsetIndex', second: 'UtcOffsetIndex') -> None:
+        '''Replace the span and segments of this index by those of two adjacent indexes.
+        The segments of the first one are kept up to the start of the second one.'''
+        segments = [segment for segment in zip(first.times, first.offsets, first.zones)
+                    if segment[0] < second.start]
+        segments += zip(second.times, second.offsets, second.zones)
+        self.start_date, self.end_date = first.start_date, second.end_date
+        self.start, self.end = first.start, second.end
+        self.times, self.offsets, self.zones = array('d'), array('l'), []
+        for start, offset, zone in segments:
+            if not self.offsets or offset != self.offsets[-1]:
+                self.times.append(start)
+                self.offsets.append(offset)
+                self.zones.append(zone)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def covers(self, seconds: float) -> bool:
+        '''Return True if an instant, in UTC epoch seconds, lies within the span of this index.'''
+        return self.start <= seconds < self.end
+
+    def _segment(self, seconds: float) -> int:
+        '''Return the index of the segment containing an instant given in UTC epoch seconds.'''
+        return max(bisect_right(self.times, seconds) - 1, 0)
+
+    def segmentAt(self, seconds: float) -> Tuple[float, float, int, TzInfo]:
+        '''Return the segment containing an instant given in UTC epoch seconds as a tuple
+        (start, end, UTC offset in seconds, tzinfo of local times), where the first segment
+        starts at -inf and the last one ends at +inf, like ``UtcOffsetIndex.offsetAt``.
+        Converting many instants in order can then skip the bisection while they stay in it.'''
+        index = self._segment(seconds)
+        start = self.times[index] if index else float('-inf')
+        end = self.times[index + 1] if index + 1 < len(self.times) else float('inf')
+        return start, end, self.offsets[index], self.zones[index]
+
+    def offsetAt(self, seconds: float) -> int:
+        '''Return the UTC offset in seconds at an instant given in UTC epoch seconds.'''
+        return self.offsets[self._segment(seconds)]
+
+    def toLocal(self, seconds: float) -> datetime:
+        '''Convert UTC epoch seconds to a timezone-aware local datetime.'''
+        index = self._segment(seconds)
+        offset = self.offsets[index]
+        result = (_EPOCH + timedelta(seconds=seconds + offset)).replace(tzinfo=self.zones[index])
+        if result.utcoffset().total_seconds() != offset:
+            # The second occurrence of a local time repeated when clocks are set back.
+            result = result.replace(fold=1)
+        return result
+
+    def localize(self, naive: datetime) -> datetime:
+        '''Return a timezone-aware datetime for a naive local datetime.'''
+        local_seconds = (naive - _EPOCH).total_seconds()
+        index = self._segment(local_seconds - self.offsetAt(local_seconds))
+        candidates = range(max(index - 1, 0), min(index + 2, len(self.offsets)))
+        # The first segment whose offset maps the local time into itself is the first occurrence.
+        for candidate in candidates:
+            seconds = local_seconds - self.offsets[candidate]
+            if self._segment(seconds) == candidate:
+                return self.toLocal(seconds)
+        # Skipped when clocks were set forward: apply the offset in effect before the change.
+        for candidate in candidates:
+            if candidate + 1 < len(self.times):
+                change = self.times[candidate + 1]
+                if (local_seconds - self.offsets[candidate + 1] < change
+                        <= local_seconds - self.offsets[candidate]):
+                    return self.toLocal(local_seconds - self.offsets[candidate])
+        return self.toLocal(local_seconds - self.offsets[index])
+
+    def changeDates(self) -> List[date]:
+        '''Return the local dates within the span on which the UTC offset changes, in order.'''
+        result = []
+        for seconds in self.times[1:]:
+            change_date = self.toLocal(seconds).date()
+            if self.start_date <= change_date < self.end_date:
+                result.append(change_date)
+        return result
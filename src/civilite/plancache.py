@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+''' Persistent cache of year plans for civilite
+
+A plan cache keeps the year plans of ``WeeklySchedule.createEvents`` on disk,
+one small binary file per plan, named by ``planKey``: a digest
+of the schedule's content hash, the year, and the versions of civilite and of
+the timezone database. A plan is computed once for a given observer, timezone
+and set of events, and later runs load it in about a millisecond. When the
+files exceed the size limit of the cache, the least recently used are removed.
+
+File layout:
+    header:  ``HEADER`` (magic, format version, key digest, first day, number of days)
+    columns: sunsets as int64 UTC epoch microseconds, one per day,
+             event types as int8, 0 where a day has no event,
+             "event type changed" flags as uint8.
+Columns are in the byte order of the machine; a plan cache is local to a machine.
+'''
+
+# Builtins
+import hashlib
+import os
+import struct
+import threading
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Mapping, Optional
+
+# 3rd party
+import pytz
+
+# self
+import civilite._meta as meta
+from civilite.results import DayRecord
+
+if TYPE_CHECKING:
+    from civilite.schedule import WeeklySchedule
+
+__version__ = meta.__version__
+
+MAGIC = b'CVPL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sH32siI')
+# Bytes per day of the columns.
+DAY_SIZE = 10
+# Extension of plan files.
+PLAN_SUFFIX = '.plan'
+# Default size limit of a plan cache in bytes, enough for hundreds of sites and years.
+PLAN_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# Days in the header are counted from this date.
+EPOCH_DATE = date(1970, 1, 1)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def defaultCacheDirectory() -> str:
+    '''Return the default plan cache directory: ``$CIVILITE_CACHE_DIR`` if it is set,
+    otherwise civilite/plans in ``$XDG_CACHE_HOME`` or ~/.cache.'''
+    directory = os.environ.get('CIVILITE_CACHE_DIR')
+    if directory:
+        return directory
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'civilite', 'plans')
+
+
+def environmentPlanCache() -> Optional['PlanCache']:
+    '''Return a plan cache in ``$CIVILITE_CACHE_DIR`` if it is set, otherwise `None`.
+    Scripts keep plans on disk only when asked to with this variable.'''
+    directory = os.environ.get('CIVILITE_CACHE_DIR')
+    return PlanCache(directory) if directory else None
+
+
+def planKey(schedule: 'WeeklySchedule', year: int) -> Optional[str]:
+    '''Return the key of a year's plan of a schedule in a plan cache: a hex digest of
+    ``WeeklySchedule.contentHash``, the year, and the versions of civilite and of the pytz
+    timezone database. Return `None` for a schedule in the local system timezone,
+    whose plans are not cached.'''
+    if schedule.tzinfo is None:
+        return None
+    content = f'{schedule.contentHash()} {year} {__version__} {pytz.OLSON_VERSION}'
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    '''A directory of year plans with a size limit.
+
+    Lookups are counted in ``PlanCache.hits`` and ``PlanCache.misses``. Files that are
+    damaged, of another format version, or of another key are misses.
+    '''
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = PLAN_CACHE_MAX_BYTES) -> None:
+        '''Open a plan cache, creating its directory if needed.
+
+        Args:
+            path:      Directory of the plan files. Default is ``defaultCacheDirectory()``.
+            max_bytes: The least recently used plans are removed when the files exceed this size.
+        '''
+        self.path = defaultCacheDirectory() if path is None else path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def _planFile(self, key: str) -> str:
+        '''Return the path of the plan file of a key.'''
+        return os.path.join(self.path, key + PLAN_SUFFIX)
+
+    def load(self, key: str,
+             to_local: Callable[[float], datetime]) -> Optional[Dict[date, DayRecord]]:
+        '''Return the plan of a key, or `None` if it is not cached.
+
+        Args:
+            key:      A key such as ``planKey``.
+            to_local: Converts UTC epoch seconds to local datetimes,
+                      such as ``UtcOffsetIndex.toLocal``.
+        '''
+        plan_file = self._planFile(key)
+        try:
+            with open(plan_file, 'rb') as in_file:
+                data = in_file.read()
+        except OSError:
+            self.misses += 1
+            return None
+        result = self._decode(key, data, to_local)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # The modification time marks the plan as recently used.
+            os.utime(plan_file)
+        except OSError:
+            pass
+        return result
+
+    @staticmethod
+    def _decode(key: str, data: bytes,
+                to_local: Callable[[float], datetime]) -> Optional[Dict[date, DayRecord]]:
+        '''Return the plan of a plan file's content,
+        or `None` if the content is not a plan of the key.'''
+        if len(data) < HEADER.size:
+            return None
+        magic, version, digest, first_day, num_days = HEADER.unpack_from(data)
+        if (magic != MAGIC or version != FORMAT_VERSION or digest != bytes.fromhex(key) or
+                len(data) != HEADER.size + num_days * DAY_SIZE):
+            return None
+        columns = memoryview(data)[HEADER.size:]
+        sunsets = columns[:num_days * 8].cast('q')
+        event_types = columns[num_days * 8:num_days * 9].cast('b')
+        changes = columns[num_days * 9:]
+        first_date = EPOCH_DATE + timedelta(days=first_day)
+        result = {}
+        for index in range(num_days):
+            seconds, microseconds = divmod(sunsets[index], 1000000)
+            result[first_date + timedelta(days=index)] = (
+                to_local(seconds).replace(microsecond=microseconds),
+                event_types[index] or None, bool(changes[index]))
+        return result
+
+    def store(self, key: str, plan: Mapping[date, DayRecord]) -> None:
+        '''Save the plan of a key, then remove the least recently used plans beyond the size limit.
+        The plan must be of consecutive days.'''
+        dates = sorted(plan)
+        if not dates:
+            return
+        first_date = dates[0]
+        if (dates[-1] - first_date).days != len(dates) - 1:
+            raise ValueError('A plan must be of consecutive days')
+        records = [plan[calendar_date] for calendar_date in dates]
+        sunsets = array('q', ((sunset_time - _EPOCH) // _MICROSECOND
+                              for sunset_time, _, _ in records))
+        event_types = array('b', (evt_type or 0 for _, evt_type, _ in records))
+        changes = bytes(evt_changed for _, _, evt_changed in records)
+        plan_file = self._planFile(key)
+        # Written under a temporary name, so that concurrent runs never read a partial file.
+        temporary_file = f'{plan_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_file, 'wb') as out_file:
+            out_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, bytes.fromhex(key),
+                                       (first_date - EPOCH_DATE).days, len(dates)))
+            out_file.write(sunsets.tobytes())
+            out_file.write(event_types.tobytes())
+            out_file.write(changes)
+        os.replace(temporary_file, plan_file)
+        self.evict()
+
+    def evict(self) -> int:
+        '''Remove the least recently used plans until the files fit the size limit.
+        Return the number of plans removed.'''
+        entries = []
+        total = 0
+        with os.scandir(self.path) as directory:
+            for entry in directory:
+                if entry.name.endswith(PLAN_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        removed = 0
+        for _, size, plan_file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(plan_file)
+            except OSError:
+                # Removed by a concurrent run.
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        '''Remove all plans.'''
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+''' PDF calendar rendering for civilite
+
+Renders a year of a weekly schedule as a one-page PDF calendar: one row per
+week with each day colored by its event type, the weekly occupancy schedule
+and a legend.
+'''
+
+# Builtins
+import calendar
+import io
+from datetime import date, time, timedelta
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# 3rd party
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import inch, letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+# self
+import civilite._meta as meta
+from civilite.batch import packSite, runJobs, unpackSite
+from civilite.instrumentation import INSTRUMENTATION, STAGE_RENDER
+from civilite.results import EVENT_TYPES, EVT_FIXED, EVT_NEVER_ON, EVT_SUNRISE, EVT_SUNSET
+from civilite.schedule import WeeklySchedule
+
+__version__ = meta.__version__
+
+DOC_COLOR_BLUE = colors.HexColor('#99ccff')
+DOC_COLOR_GREEN = colors.HexColor('#ccffcc')
+DOC_COLOR_ORANGE = colors.HexColor('#ffcc99')
+DOC_COLOR_PURPLE = colors.HexColor('#ccccff')
+DOC_COLOR_GRAY_1 = colors.HexColor('#777777')
+DOC_COLOR_GRAY_2 = colors.HexColor('#969696')
+DOC_COLOR_GRAY_3 = colors.HexColor('#AF9E93')
+EVENT_COLORS = {EVT_FIXED: DOC_COLOR_GREEN,
+                EVT_SUNSET: DOC_COLOR_ORANGE,
+                EVT_NEVER_ON: DOC_COLOR_GRAY_3,
+                EVT_SUNRISE: DOC_COLOR_PURPLE}
+# Columns of the calendar table before and after the seven day columns.
+NUM_PREFIX_COLUMNS = 1
+NUM_SUFFIX_COLUMNS = 1
+# Rows of the calendar table that the schedule table leaves to the legend.
+ROW_ADJUST = 21
+
+# Rows of the legend of the schedule table.
+LEGEND_ROWS = (('LEGEND', '', '', ''),
+               ('01', '%s event' % EVENT_TYPES[EVT_SUNSET], '', ''),
+               ('01', '%s event' % EVENT_TYPES[EVT_FIXED], '', ''),
+               ('01', '%s event' % EVENT_TYPES[EVT_NEVER_ON], '', ''),
+               ('01', '%s event' % EVENT_TYPES[EVT_SUNRISE], '', ''),
+               ('01', 'First day of month', '', ''),
+               ('01', 'DST change', '', ''))
+
+# A calendar to render: (schedule, year) or (schedule, year, title).
+CalendarJob = Tuple
+
+
+@lru_cache(maxsize=None)
+def calendarStyleTemplate() -> Tuple[tuple, ...]:
+    '''Return the style commands of the calendar table that do not depend on the year.'''
+    return (
+        # global
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),   # all cells
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),    # day columns
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),       # month column
+        ('ALIGN', (8, 0), (8, -1), 'CENTER'),     # sunset time column
+        # header
+        ('BACKGROUND', (0, 0), (7, 0), DOC_COLOR_GRAY_1),
+        ('TEXTCOLOR', (0, 0), (7, 0), colors.white),
+        ('BACKGROUND', (1, 0), (1, 0), DOC_COLOR_GRAY_2),
+        ('BACKGROUND', (7, 0), (7, 0), DOC_COLOR_GRAY_2),
+        ('BACKGROUND', (8, 0), (8, 0), DOC_COLOR_ORANGE),
+        # sunset column formats
+        ('LINEAFTER', (7, 0), (7, -1), 1, colors.black),
+        ('GRID', (8, 0), (8, -1), 1, colors.black),
+    )
+
+
+@lru_cache(maxsize=None)
+def scheduleStyleTemplate() -> Tuple[tuple, ...]:
+    '''Return the style commands of the schedule table that do not depend on the schedule.'''
+    return (
+        # global
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (2, 0), (2, 2), 'CENTER'),
+        ('ALIGN', (1, 3), (1, -1), 'LEFT'),
+        ('ALIGN', (2, 3), (-1, -1), 'CENTER'),
+        # year cell
+        ('FONT', (2, 0), (2, 0), 'Times-Bold', 64),
+        # header
+        ('BACKGROUND', (1, 3), (-1, 3), DOC_COLOR_GRAY_1),
+        ('TEXTCOLOR', (1, 3), (-1, 3), colors.white),
+    )
+
+
+@lru_cache(maxsize=None)
+def legendStyles(legend_row: int) -> Tuple[tuple, ...]:
+    '''Return the style commands of the legend starting at a row of the schedule table.'''
+    first = legend_row + 1
+    return (
+        ('ALIGN', (0, legend_row), (-1, -1), 'LEFT'),
+        ('ALIGN', (0, first), (0, -1), 'CENTER'),
+        ('BACKGROUND', (0, first), (0, first), EVENT_COLORS[EVT_SUNSET]),
+        ('BACKGROUND', (0, first + 1), (0, first + 1), EVENT_COLORS[EVT_FIXED]),
+        ('BACKGROUND', (0, first + 2), (0, first + 2), EVENT_COLORS[EVT_NEVER_ON]),
+        ('BACKGROUND', (0, first + 3), (0, first + 3), EVENT_COLORS[EVT_SUNRISE]),
+        ('BOX', (0, first + 4), (0, first + 4), 1, DOC_COLOR_GRAY_2),
+        ('BACKGROUND', (0, first + 5), (0, first + 5), colors.yellow),
+    )
+
+
+def _mergeRuns(cells: List[Tuple[int, int, tuple]]) -> List[tuple]:
+    '''Merge per-cell styles into one command per run of adjacent cells in a row.
+
+    Args:
+        cells: (column, row, style) in row-major order, where style is a command
+               without its cell range, e.g. ``('BACKGROUND', color)``.
+    '''
+    result = []
+    run_start = None
+    for index, (column, row, style) in enumerate(cells):
+        if run_start is None:
+            run_start = column
+        following = cells[index + 1] if index + 1 < len(cells) else None
+        if following is None or following != (column + 1, row, style):
+            result.append((style[0], (run_start, row), (column, row)) + style[1:])
+            run_start = None
+    return result
+
+
+def calendarTable(schedule: WeeklySchedule, year: int) -> Tuple[Table, int]:
+    '''Return the calendar table of a year and its number of rows.'''
+    sunset_events = schedule.createEvents(year)
+    dst_changes = set(schedule.twilight.dstChangeDates(date(year, 1, 1), date(year + 1, 1, 1)))
+    data = [['MONTH', 'Su', 'Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Sunset']]
+    month_styles = []
+    first_day_boxes = []
+    event_cells = []
+    dst_cells = []
+    cell_date = date(year, 1, 1)
+    while cell_date.year == year:
+        row_index = len(data)
+        # gives us Sunday first (Mon=0, Sun=6 in Python)
+        column_id = (cell_date.weekday() + 1) % 7
+        row = [''] * (NUM_PREFIX_COLUMNS + column_id)
+        sunset_time = None
+        for column_index in range(NUM_PREFIX_COLUMNS + column_id, NUM_PREFIX_COLUMNS + 7):
+            if cell_date.year != year:
+                break
+            row.append('%02d' % cell_date.day)
+            sunset_time, event_type, _ = sunset_events[cell_date]
+            if cell_date.day == 1:
+                row[0] = calendar.month_name[cell_date.month]
+                month_styles.append(('BACKGROUND', (0, row_index), (0, row_index), DOC_COLOR_BLUE))
+                first_day_boxes.append(('BOX', (column_index, row_index), (column_index, row_index),
+                                        1, DOC_COLOR_GRAY_2))
+            if event_type is not None:
+                event_cells.append((column_index, row_index,
+                                    ('BACKGROUND', EVENT_COLORS[event_type])))
+            else:
+                event_cells.append((column_index, row_index, ('TEXTCOLOR', colors.lightslategray)))
+            if cell_date in dst_changes:
+                dst_cells.append((column_index, row_index, ('BACKGROUND', colors.yellow)))
+            cell_date += timedelta(days=1)
+        row += [''] * (NUM_PREFIX_COLUMNS + 7 - len(row))
+        row.append(sunset_time.time().strftime('%H:%M'))
+        data.append(row)
+    # Later commands take precedence: DST changes are drawn over event colors.
+    styles = (list(calendarStyleTemplate()) + month_styles + _mergeRuns(event_cells) +
+              first_day_boxes + _mergeRuns(dst_cells))
+    table = Table(data, [1.0*inch] + (len(data[0])-2)*[0.25*inch] + [None], len(data)*[0.19*inch])
+    table.setStyle(TableStyle(styles))
+    return table, len(data)
+
+
+def scheduleTable(schedule: WeeklySchedule, year: int, num_rows: int) -> Table:
+    '''Return the table with the year, the occupancy schedule and the legend.
+    The weekly events are listed first, followed by the events on specific dates of the year,
+    and the legend follows the last event after an empty row. Events that do not fit
+    in the height of the calendar table are counted in the last event row.'''
+    data = [
+        ['', '', year, ''],
+        ['', '', '', ''],
+        ['', '', 'OCCUPANCY SCHEDULE', ''],
+        ['', 'Day', 'Start time', 'End time']]
+    event_rows = []
+    for i in range(7):
+        weekday = (i - 1) % 7   # list Sunday first, just like in calendar table
+        for event in schedule.events.get(weekday, []):
+            event_rows.append(['', calendar.day_name[weekday],
+                               time.strftime(event.start, '%H:%M'),
+                               time.strftime(event.stop, '%H:%M')])
+    for event_date in sorted(schedule.date_events):
+        if event_date.year == year:
+            for event in schedule.date_events[event_date]:
+                event_rows.append(['', event_date.strftime('%b %d, %a'),
+                                   time.strftime(event.start, '%H:%M'),
+                                   time.strftime(event.stop, '%H:%M')])
+    # Events that do not fit on the page are counted in the last event row.
+    max_event_rows = num_rows - ROW_ADJUST - len(data) - len(LEGEND_ROWS) - 1
+    if len(event_rows) > max_event_rows:
+        num_left_out = len(event_rows) - max_event_rows + 1
+        event_rows = event_rows[:max_event_rows - 1] + [['', f'{num_left_out} more events', '', '']]
+    data += event_rows
+    last_event_row = len(data) - 1
+    data.append(['', '', '', ''])
+    styles = (list(scheduleStyleTemplate()) + list(legendStyles(len(data))) +
+              [('GRID', (1, 3), (-1, last_event_row), 1, colors.black)])
+    data += [list(row) for row in LEGEND_ROWS]
+    data += (num_rows - len(data) - ROW_ADJUST) * [['', '', '', '']]
+    return Table(data,
+                 [0.25*inch, 0.95*inch, 0.75*inch, 0.75*inch],
+                 [1.0*inch, 1.0*inch, 0.50*inch] + (len(data)-3)*[0.25*inch],
+                 TableStyle(styles))
+
+
+def renderCalendar(schedule: WeeklySchedule, year: int, title: Optional[str] = None,
+                   author: str = '', subject: Optional[str] = None) -> bytes:
+    '''Render the lighting calendar of a schedule for a year.
+
+    Args:
+        schedule: The schedule to render.
+        year:     The year of the calendar.
+        title:    Document title. Default is "<year> Lighting Schedule".
+        author:   Document author.
+        subject:  Document subject. Default is the title.
+
+    Return:
+        The PDF document.
+    '''
+    title = f'{year} Lighting Schedule' if title is None else title
+    subject = title if subject is None else subject
+
+    def onFirstPage(canvas, _doc):
+        ''' function object for setting up the default document
+            this implementation does not use the doc parameter
+        '''
+        canvas.saveState()
+        canvas.setTitle(title)
+        canvas.setAuthor(author)
+        canvas.setSubject(subject)
+        canvas.setKeywords('')
+        canvas.restoreState()
+
+    output = io.BytesIO()
+    document = SimpleDocTemplate(output,
+                                 pagesize=letter,
+                                 leftMargin=0.2*inch,
+                                 rightMargin=0.2*inch,
+                                 topMargin=0.2*inch,
+                                 bottomMargin=0.2*inch)
+    # Plan the year first, so that the render stage times rendering only.
+    schedule.createEvents(year)
+    with INSTRUMENTATION.timer(STAGE_RENDER):
+        calendar_table, num_rows = calendarTable(schedule, year)
+        document.build([Table([[scheduleTable(schedule, year, num_rows), calendar_table]])],
+                       onFirstPage=onFirstPage)
+    return output.getvalue()
+
+
+def _renderJob(packed_site: Tuple, year: int, title: Optional[str], author: str) -> bytes:
+    '''Worker entry point: rebuild a schedule from its packed form and render it.'''
+    return renderCalendar(unpackSite(packed_site), year, title, author)
+
+
+def renderCalendars(jobs: Iterable[CalendarJob], author: str = '',
+                    max_workers: Optional[int] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> List[bytes]:
+    '''Render many calendars in a process pool.
+
+    Args:
+        jobs:        (schedule, year) or (schedule, year, title) tuples.
+        author:      Document author of all calendars.
+        max_workers: Number of worker processes. `None` uses one per CPU,
+                       and 1 renders all calendars serially in the calling process.
+        progress:    Optional callback invoked as ``progress(completed, total)``
+                       each time a calendar is finished.
+
+    Return:
+        The PDF documents, in the order of the jobs.
+    '''
+    packed_jobs = []
+    for schedule, year, *title in jobs:
+        packed_jobs.append((packSite(schedule), year, title[0] if title else None, author))
+    return runJobs(_renderJob, packed_jobs, max_workers, progress)
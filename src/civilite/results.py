@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+''' Compact columnar schedule results for civilite
+
+``EventColumns`` holds the same information as the dictionary returned by
+``WeeklySchedule.createEvents``, one column per field:
+    sunsets:     int64 UTC epoch seconds
+    event types: int8, 0 where a day has no event
+    change flags: a bitset, one bit per day
+plus the first date and the timezone. Days are consecutive from the first date.
+
+``TransitionIndex`` holds the ON/OFF transitions of a schedule's lights and can be
+saved to and loaded from a small plan file.
+
+``ClockSegment`` is one row of a run-length encoded astro clock program.
+'''
+
+# Builtins
+import json
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+from datetime import date, datetime, time, timedelta, timezone, tzinfo as TzInfo
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+# self
+import civilite._meta as meta
+from civilite.offsets import ianaName, timezoneName
+
+__version__ = meta.__version__
+
+# Event definitions for describing tasks on the Intermatic astro time clock
+# Assumptions:
+#   * Events occasionally end after sunset or start before sunrise.
+#
+# "Fixed" event: when an event starts after sunset or ends before sunrise,
+#   the ON and OFF times for lights must be explicitly fixed by user.
+EVT_FIXED = 1
+# "Sunset" event: when a sunset occurs during an event,
+#   the ON time is programmed according to the clock's sunset time for that day
+#   and the OFF time is programmed explicitly.
+EVT_SUNSET = 2
+# "Never on" event: when an event is entirely in daylight, lights do not need to be ON at all.
+EVT_NEVER_ON = 3
+# "Sunrise" event: when a sunrise occurs during an event,
+#   the ON time is programmed explicitly
+#   and the OFF time is programmed according to the clock's sunrise time for that day.
+EVT_SUNRISE = 4
+EVENT_TYPES = {EVT_FIXED: 'FIXED', EVT_SUNSET: 'SUNSET', EVT_NEVER_ON: 'NEVER-ON',
+               EVT_SUNRISE: 'SUNRISE'}
+
+# A day's record as in ``WeeklySchedule.createEvents``:
+# (sunset, event type, "event type changed" flag).
+DayRecord = Tuple[datetime, Optional[int], bool]
+# Version of the file format written by ``TransitionIndex.save``.
+PLAN_FILE_VERSION = 1
+
+
+class EventColumns(Mapping):
+    '''A read-only mapping of dates to day records, stored column by column.
+
+    Supports dict-like access by date, slicing by date with zero copies, e.g.
+    ``columns[date(2021, 3, 1):date(2021, 4, 1)]``, and zero-copy export of the columns.
+    '''
+
+    def __init__(self, start_date: date, tzinfo: Optional[TzInfo], sunsets: memoryview,
+                 event_types: memoryview, changes: memoryview, bit_offset: int = 0) -> None:
+        '''Wrap existing columns. Use ``EventColumns.fromEvents`` to build new ones.
+
+        Args:
+            start_date:  The date of the first record.
+            tzinfo:      Timezone in which to return sunset times.
+            sunsets:     Buffer of int64 UTC epoch seconds, one per day.
+            event_types: Buffer of int8 event types, one per day.
+            changes:     Bitset of "event type changed" flags, least significant bit first.
+            bit_offset:  Index of the first day's bit in changes.
+        '''
+        self.start_date = start_date
+        self.tzinfo = tzinfo
+        self.sunsets = memoryview(sunsets).cast('B').cast('q')
+        self.event_types = memoryview(event_types).cast('B').cast('b')
+        self.changes = memoryview(changes).cast('B')
+        self.bit_offset = bit_offset
+        if len(self.event_types) != len(self.sunsets):
+            raise ValueError('All columns must have the same number of days')
+
+    @classmethod
+    def fromEvents(cls, records: Iterable[Tuple[date, datetime, Optional[int], bool]],
+                   tzinfo: Optional[TzInfo] = None) -> 'EventColumns':
+        '''Build columns from consecutive (date, sunset, event type, changed) records,
+        such as those generated by ``WeeklySchedule.iterEvents``.'''
+        sunsets = array('q')
+        event_types = array('b')
+        changes = bytearray()
+        start_date = None
+        for index, (calendar_date, sunset_time, evt_type, evt_changed) in enumerate(records):
+            if start_date is None:
+                start_date = calendar_date
+                if tzinfo is None:
+                    tzinfo = sunset_time.tzinfo
+            elif calendar_date != start_date + timedelta(days=index):
+                raise ValueError(f'Records must be on consecutive days, '
+                                 f'got {calendar_date} at index {index}')
+            sunsets.append(round(sunset_time.timestamp()))
+            event_types.append(evt_type or 0)
+            if index % 8 == 0:
+                changes.append(0)
+            if evt_changed:
+                changes[-1] |= 1 << (index % 8)
+        return cls(start_date, tzinfo, sunsets, event_types, changes)
+
+    def __len__(self) -> int:
+        return len(self.sunsets)
+
+    def __iter__(self) -> Iterator[date]:
+        return (self.start_date + timedelta(days=index) for index in range(len(self)))
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, date) and 0 <= (key - self.start_date).days < len(self)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.slice(key.start, key.stop)
+        index = (key - self.start_date).days if isinstance(key, date) else -1
+        if not 0 <= index < len(self):
+            raise KeyError(key)
+        return self.record(index)
+
+    def __repr__(self) -> str:
+        return f'<EventColumns {self.start_date} +{len(self)} days, {self.nbytes} bytes>'
+
+    def __reduce__(self) -> Tuple:
+        # Pickled as the raw bytes of the columns and a single timezone.
+        return (EventColumns, (self.start_date, self.tzinfo, self.sunsets.tobytes(),
+                               self.event_types.tobytes(), self.changes.tobytes(),
+                               self.bit_offset))
+
+    def record(self, index: int) -> DayRecord:
+        '''Return the record of the day at a position.'''
+        sunset_time = datetime.fromtimestamp(self.sunsets[index],
+                                             timezone.utc).astimezone(self.tzinfo)
+        return sunset_time, self.event_types[index] or None, self.changed(index)
+
+    def changed(self, index: int) -> bool:
+        '''Return the "event type changed" flag of the day at a position.'''
+        bit = self.bit_offset + index
+        return bool(self.changes[bit >> 3] >> (bit & 7) & 1)
+
+    def slice(self, start_date: Optional[date] = None,
+              end_date: Optional[date] = None) -> 'EventColumns':
+        '''Return the records from start_date up to, but not including, end_date
+        as views on these columns.'''
+        start = 0
+        if start_date is not None:
+            start = min(max((start_date - self.start_date).days, 0), len(self))
+        stop = len(self)
+        if end_date is not None:
+            stop = min(max((end_date - self.start_date).days, start), len(self))
+        bit = self.bit_offset + start
+        return EventColumns(self.start_date + timedelta(days=start), self.tzinfo,
+                            self.sunsets[start:stop], self.event_types[start:stop],
+                            self.changes[bit >> 3:], bit & 7)
+
+    @property
+    def nbytes(self) -> int:
+        '''Size of the column data in bytes.'''
+        return (self.sunsets.nbytes + self.event_types.nbytes +
+                (self.bit_offset + len(self) + 7) // 8)
+
+    def export(self) -> Dict[str, memoryview]:
+        '''Return the raw columns as memoryviews, without copying.
+        The change flags are a bitset that starts at bit ``EventColumns.bit_offset``.'''
+        return {'sunset': self.sunsets, 'event_type': self.event_types, 'changed': self.changes}
+
+    def toNumpy(self) -> Dict[str, 'numpy.ndarray']:
+        '''Return the columns as NumPy arrays. Sunsets and event types are views on
+        these columns; the change flags are unpacked into a new bool array.'''
+        # Imported here so that NumPy is only needed for this export.
+        import numpy as np
+        bits = np.unpackbits(np.frombuffer(self.changes, dtype=np.uint8), bitorder='little')
+        return {'sunset': np.frombuffer(self.sunsets, dtype=np.int64),
+                'event_type': np.frombuffer(self.event_types, dtype=np.int8),
+                'changed': bits[self.bit_offset:self.bit_offset + len(self)].astype(bool)}
+
+
+class TransitionIndex:
+    '''Sorted ON/OFF transitions of a schedule's lights over a horizon of dates.
+    Queries take timezone-aware datetimes and are answered by bisection.'''
+
+    def __init__(self, start: datetime, end: datetime,
+                 transitions: Iterable[Tuple[datetime, bool]]) -> None:
+        '''Create a new index.
+
+        Args:
+            start:       The first instant covered by the index.
+            end:         The first instant after the horizon of the index.
+            transitions: Pairs of (instant, lights ON) in chronological order.
+        '''
+        self.start = start
+        self.end = end
+        # Transition instants as UTC epoch seconds, and the state of the lights after each.
+        self.times = array('d')
+        self.states = array('b')
+        for instant, state in transitions:
+            self.times.append(instant.timestamp())
+            self.states.append(state)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def covers(self, when: datetime) -> bool:
+        '''Return True if an instant lies within the horizon of this index.'''
+        return self.start <= when < self.end
+
+    def stateAt(self, when: datetime) -> bool:
+        '''Return True if the lights are ON at an instant.'''
+        index = bisect_right(self.times, when.timestamp()) - 1
+        return index >= 0 and bool(self.states[index])
+
+    def nextTransition(self, when: datetime) -> Optional[Tuple[datetime, bool]]:
+        '''Return the first transition strictly after an instant as a tuple of
+        (instant, lights ON), or `None` if there is none within the horizon.
+        The instant is returned in the timezone of this index's start.'''
+        index = bisect_right(self.times, when.timestamp())
+        if index == len(self.times):
+            return None
+        instant = datetime.fromtimestamp(self.times[index],
+                                         timezone.utc).astimezone(self.start.tzinfo)
+        return instant, bool(self.states[index])
+
+    def save(self, path: str) -> None:
+        '''Save this index as a small JSON file that ``TransitionIndex.load`` reads
+        without importing the solar and timezone libraries.'''
+        tzinfo = self.start.tzinfo
+        data = {'version': PLAN_FILE_VERSION,
+                'timezone': timezoneName(tzinfo),
+                'start': self.start.timestamp(),
+                'end': self.end.timestamp(),
+                'times': self.times.tolist(),
+                'states': self.states.tolist()}
+        if ianaName(tzinfo) is None:
+            # Fixed-offset and local timezones have no name to load them by: keep the UTC offset.
+            data['utc_offset'] = self.start.utcoffset().total_seconds()
+        with open(path, 'w', encoding='utf-8') as out_file:
+            json.dump(data, out_file)
+
+    @classmethod
+    def load(cls, path: str) -> 'TransitionIndex':
+        '''Load an index saved by ``TransitionIndex.save``. Instants are returned
+        in the saved timezone where ``zoneinfo`` knows it, at the saved UTC offset
+        for timezones without an IANA name, otherwise in UTC.'''
+        with open(path, 'r', encoding='utf-8') as in_file:
+            data = json.load(in_file)
+        if data.get('version') != PLAN_FILE_VERSION:
+            raise ValueError(f'{path} is not a version {PLAN_FILE_VERSION} plan file')
+        if 'utc_offset' in data:
+            tzinfo = timezone(timedelta(seconds=data['utc_offset']))
+        else:
+            tzinfo = _zoneInfo(data['timezone'])
+        result = cls(datetime.fromtimestamp(data['start'], tzinfo),
+                     datetime.fromtimestamp(data['end'], tzinfo), ())
+        result.times = array('d', data['times'])
+        result.states = array('b', data['states'])
+        return result
+
+
+def _zoneInfo(name: str) -> TzInfo:
+    '''Return a zoneinfo timezone by name, or UTC if it is unavailable.'''
+    try:
+        # Imported here because zoneinfo is new in Python 3.9 and only needed for loading plans.
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except (ImportError, LookupError, ValueError):
+        return timezone.utc
+
+
+class ClockSegment(NamedTuple):
+    '''A run of consecutive weeks in which a weekday's astro clock program stays the same.'''
+    # The weekday, Monday is 0.
+    weekday: int
+    # The event type of the weekday in every week of the run.
+    event_type: int
+    # The first and the last date of the run; both fall on the weekday.
+    first_date: date
+    last_date: date
+    # Times to program as (ON, OFF) pairs, one per merged event interval that turns lights ON,
+    # and two for an interval from before sunrise until after sunset.
+    # ON is `None` where lights turn ON at sunset, OFF is `None` where they turn OFF at sunrise.
+    switching: Tuple[Tuple[Optional[time], Optional[time]], ...]
+
+    @property
+    def weeks(self) -> int:
+        '''Number of weeks in the run.'''
+        return (self.last_date - self.first_date).days // 7 + 1
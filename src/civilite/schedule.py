@@ -3,35 +3,50 @@
 
 # Builtins
 import calendar
+import hashlib
+import math
 import sys
-from datetime import date, datetime, time, timedelta
-from typing import Dict, Optional, Tuple
+from bisect import bisect_left
+from collections import deque
+from datetime import date, datetime, time, timedelta, tzinfo as TzInfo
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 # 3rd party
 import pytz
 from astral import Observer, SunDirection
-from astral.sun import twilight
 
 # self
 import civilite._meta as meta
+from civilite.export import exportRecords
+from civilite.instrumentation import INSTRUMENTATION, STAGE_CLASSIFY
+from civilite.offsets import UtcOffsetIndex, timezoneName
+from civilite.plancache import PlanCache, environmentPlanCache, planKey
+from civilite.results import (EVT_FIXED, EVT_NEVER_ON, EVT_SUNRISE, EVT_SUNSET, ClockSegment,
+                              EventColumns, TransitionIndex)
+from civilite.site import HOP_LOCATION, HOP_TIMEZONE
+from civilite.tables import TwilightTable
+from civilite.twilight import (BACKEND_ASTRAL, BACKEND_FAST, BACKEND_NUMPY, EPOCH_DATE,
+                               FAST_MAX_ERROR, SiteTwilight)
 
 __version__ = meta.__version__
 
-# Event definitions for describing tasks on the Intermatic astro time clock
-# Assumptions:
-#   * Events never occur during sunrise. TODO: sunrises should be considered in the future.
-#   * Events occasionally end after sunset.
-#
-# "Fixed" event: when an event starts after sunset,
-#   the ON and OFF times for lights must be explicitly fixed by user.
-EVT_FIXED = 1
-# "Sunset" event: when a sunset occurs during an event,
-#   the ON time is programmed according to the clock's sunset time for that day
-#   and the OFF time is programmed explicitly.
-EVT_SUNSET = 2
-# "Never on" event: when an event ends before sunset, lights do not need to be ON at all.
-EVT_NEVER_ON = 3
-EVENT_TYPES = {EVT_FIXED: 'FIXED', EVT_SUNSET: 'SUNSET', EVT_NEVER_ON: 'NEVER-ON'}
+# A day's event type is the first of these found among the types of its intervals.
+EVENT_PRECEDENCE = (EVT_SUNSET, EVT_SUNRISE, EVT_FIXED, EVT_NEVER_ON)
+
+# Number of days of twilight computed at a time while streaming events.
+STREAM_BLOCK_DAYS = 64
+
+# Number of days covered by a transition index built on demand.
+TRANSITION_HORIZON_DAYS = 28
+
+# Gaps between events shorter than this are considered as if the building is occupied.
+GAP_THRESHOLD = timedelta(minutes=30)
+
+# Upper bound of the equation of time in seconds. Sunrise is never later than solar noon,
+# so sunrise is only computed on days with an interval starting before 12:00 mean solar time
+# plus this bound; days with evening events only never need it.
+MAX_EQUATION_OF_TIME = 17 * 60
 
 
 class ScheduleEvent:
@@ -46,11 +61,123 @@ class ScheduleEvent:
         self.start = start
         self.stop = stop
 
+    def __repr__(self) -> str:
+        return f'ScheduleEvent({self.start!r}, {self.stop!r})'
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ScheduleEvent):
+            return NotImplemented
+        return (self.start, self.stop) == (other.start, other.stop)
+
+    def __hash__(self) -> int:
+        return hash((self.start, self.stop))
+
+
+def _seconds(event_time: time) -> int:
+    '''Return the number of seconds since midnight of a time of day.'''
+    return event_time.hour * 3600 + event_time.minute * 60 + event_time.second
+
+
+class EventIntervals:
+    '''The occupancy of one day as sorted, disjoint intervals.
+
+    Built from any number of events: overlapping events, and events separated by
+    gaps shorter than the gap threshold, are merged into one interval.
+    '''
+
+    def __init__(self, events: Iterable[ScheduleEvent],
+                 gap_threshold: timedelta = GAP_THRESHOLD) -> None:
+        '''Merge events into intervals in O(n log n).'''
+        gap_seconds = gap_threshold.total_seconds()
+        # The merged intervals, sorted by start time.
+        self.events: List[ScheduleEvent] = []
+        for event in sorted(events, key=lambda evt: (evt.start, evt.stop)):
+            if self.events and _seconds(event.start) - _seconds(self.events[-1].stop) < gap_seconds:
+                if event.stop > self.events[-1].stop:
+                    self.events[-1] = ScheduleEvent(self.events[-1].start, event.stop)
+            else:
+                self.events.append(ScheduleEvent(event.start, event.stop))
+        # Start and stop times of the intervals, for bisection.
+        self.starts = [event.start for event in self.events]
+        self.stops = [event.stop for event in self.events]
+        # Seconds after midnight of the first start, for deciding whether sunrise is needed.
+        self.first_start = _seconds(self.starts[0]) if self.starts else None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[ScheduleEvent]:
+        return iter(self.events)
+
+    def _sunsetIndex(self, sunset_time: time) -> int:
+        '''Return the index of the first interval that does not end before sunset.'''
+        return bisect_left(self.stops, sunset_time)
+
+    def eventType(self, sunset_time: time, sunrise_time: Optional[time] = None) -> Optional[int]:
+        '''Return the event type of the whole day: SUNSET if sunset occurs during an interval,
+        otherwise FIXED if an interval starts after sunset, otherwise NEVER-ON.
+        Given the sunrise time and an interval that starts before it, the type is the first
+        of ``EVENT_PRECEDENCE`` among the types of ``EventIntervals.classify``.
+        Return `None` if there are no intervals.'''
+        if not self.events:
+            return None
+        if sunrise_time is not None and self.starts[0] < sunrise_time:
+            types = {interval_type for _, interval_type in self.classify(sunset_time, sunrise_time)}
+            return next(evt_type for evt_type in EVENT_PRECEDENCE if evt_type in types)
+        index = self._sunsetIndex(sunset_time)
+        if index == len(self.events):
+            return EVT_NEVER_ON
+        return EVT_FIXED if self.events[index].start > sunset_time else EVT_SUNSET
+
+    def nearBoundary(self, sunset_time: time, margin: timedelta) -> bool:
+        '''Return True if an interval starts or stops within a margin
+        of the sunset (or sunrise) time.'''
+        sunset_seconds = _seconds(sunset_time) + sunset_time.microsecond / 1e6
+        for boundaries in (self.starts, self.stops):
+            index = bisect_left(boundaries, sunset_time)
+            for neighbor in boundaries[max(index - 1, 0):index + 1]:
+                if abs(_seconds(neighbor) - sunset_seconds) <= margin.total_seconds():
+                    return True
+        return False
+
+    def classify(self, sunset_time: time,
+                 sunrise_time: Optional[time] = None) -> List[Tuple[ScheduleEvent, int]]:
+        '''Return each interval paired with its own event type.
+        Given the sunrise time, an interval that starts before sunrise is FIXED if it also ends
+        before sunrise and SUNRISE otherwise. An interval from before sunrise until after sunset
+        is listed twice, as SUNRISE and then as SUNSET.'''
+        index = self._sunsetIndex(sunset_time)
+        result = []
+        for position, event in enumerate(self.events):
+            if sunrise_time is not None and event.start < sunrise_time:
+                if event.stop <= sunrise_time:
+                    result.append((event, EVT_FIXED))
+                    continue
+                result.append((event, EVT_SUNRISE))
+            elif position < index:
+                result.append((event, EVT_NEVER_ON))
+            if position >= index:
+                result.append((event, EVT_FIXED if event.start > sunset_time else EVT_SUNSET))
+        return result
+
+
+class _PlanningState:
+    '''State of a ``WeeklySchedule`` derived from its events and settings,
+    discarded together after a change that affects every date.'''
+
+    def __init__(self) -> None:
+        # Merged EventIntervals. Key: weekday (int) or specific date.
+        self.intervals = {}
+        # Plans kept by createEvents and updated in place when events change. Key: year.
+        self.plans = {}
+
 
 class WeeklySchedule:
-    '''A collection of events that repeat every week.'''
+    '''A collection of events that repeat every week, and of events on specific dates.'''
 
-    def __init__(self, observer: Observer, tzinfo: pytz.tzinfo = pytz.utc) -> None:
+    def __init__(self, observer: Observer, tzinfo: pytz.tzinfo = pytz.utc,
+                 backend: str = BACKEND_ASTRAL, gap_threshold: timedelta = GAP_THRESHOLD,
+                 plan_cache: Optional[PlanCache] = None) -> None:
         '''Create a new weekly schedule.
 
         Args:
@@ -58,52 +185,531 @@ class WeeklySchedule:
             tzinfo:   Timezone in which to return times. If `None` is given,
                         the caller's local system timezone will be used.
                       The default is UTC.
+            backend:  The engine for computing civil twilight, one of ``BACKENDS``.
+                      The numpy backend requires NumPy and computes date ranges in batches.
+            gap_threshold: Gaps between events shorter than this are considered occupied.
+            plan_cache: A ``PlanCache`` in which ``WeeklySchedule.createEvents`` keeps year plans
+                      across runs. If `None` is given, plans are only kept in memory.
         '''
-        # The Observer associated with this schedule.
-        self.observer = observer
-        # The timezone in which to return times.
-        self.tzinfo = tzinfo
-        # The collection of events that occur every week. Key: weekday (int), value: ScheduleEvent instance.
+        # Civil twilight and UTC offsets of the location, with a private ``TwilightCache``
+        # that may be replaced by one shared with other schedules.
+        self.twilight = SiteTwilight(observer, tzinfo, backend=backend)
+        # The collection of events that occur every week.
+        # Key: weekday (int), value: list of ScheduleEvent.
         self.events = {}
+        # Additional events on specific dates. Key: date, value: list of ScheduleEvent.
+        self.date_events = {}
+        # Gaps between events shorter than this are considered occupied,
+        # see ``WeeklySchedule.gap_threshold``.
+        self._gap_threshold = gap_threshold
+        # Merged intervals and kept plans.
+        self._state = _PlanningState()
+        # Optional on-disk cache of the plans of createEvents, shared across runs.
+        self.plan_cache = plan_cache
+        # The most recently built TransitionIndex, if any.
+        self.transitions = None
+
+    @property
+    def observer(self) -> Observer:
+        '''The ``astral.Observer`` of this schedule's location. Setting it discards the kept plans,
+        and a twilight table computed for another location; replace the observer
+        instead of modifying it.'''
+        return self.twilight.observer
+
+    @observer.setter
+    def observer(self, observer: Observer) -> None:
+        self.twilight.observer = observer
+        self._planningChanged()
+
+    @property
+    def tzinfo(self) -> Optional[TzInfo]:
+        '''The timezone in which to return times, `None` for the local system timezone.
+        Setting it discards the kept plans, and a twilight table computed for another timezone.'''
+        return self.twilight.tzinfo
+
+    @tzinfo.setter
+    def tzinfo(self, tzinfo: Optional[TzInfo]) -> None:
+        self.twilight.tzinfo = tzinfo
+        self._planningChanged()
+
+    @property
+    def backend(self) -> str:
+        '''The engine used for computing civil twilight, one of ``BACKENDS``.
+        Setting it discards the kept plans.'''
+        return self.twilight.backend
+
+    @backend.setter
+    def backend(self, backend: str) -> None:
+        self.twilight.backend = backend
+        self._planningChanged()
+
+    @property
+    def gap_threshold(self) -> timedelta:
+        '''Gaps between events shorter than this are considered occupied.
+        Setting it discards the merged intervals and the kept plans.'''
+        return self._gap_threshold
+
+    @gap_threshold.setter
+    def gap_threshold(self, gap_threshold: timedelta) -> None:
+        self._gap_threshold = gap_threshold
+        self._planningChanged()
+
+    def _planningChanged(self) -> None:
+        '''Discard the merged intervals, the kept plans and the transition index
+        after a change that affects every date.'''
+        self._state = _PlanningState()
+        self.transitions = None
 
     def __str__(self) -> str:
         result = [(f'Weekly schedule for {self.observer}',)]
         result += [('Weekday', 'Start time', 'End time')]
         for weekday in range(7):
-            if weekday in self.events:
-                result += [(
-                    calendar.day_abbr[weekday],
-                    str(self.events[weekday].start),
-                    str(self.events[weekday].stop)
-                )]
+            for event in self.events.get(weekday, ()):
+                result += [(calendar.day_abbr[weekday], str(event.start), str(event.stop))]
+        for event_date in sorted(self.date_events):
+            for event in self.date_events[event_date]:
+                result += [(str(event_date), str(event.start), str(event.stop))]
         return '\n'.join(['\t'.join(ss) for ss in result])
 
+    def contentHash(self) -> str:
+        '''Return a hex digest of everything that determines the plans of this schedule:
+        the observer, the timezone, the backend, the gap threshold, the twilight table if any,
+        see ``TwilightTable.contentHash``, and the events.
+        Schedules with the same content have the same hash in any process, regardless of
+        the order in which their events were added.'''
+        observer = self.observer
+        content = [repr((observer.latitude, observer.longitude, observer.elevation)),
+                   '' if self.tzinfo is None else timezoneName(self.tzinfo), self.backend,
+                   repr(self.gap_threshold.total_seconds()),
+                   '' if self.twilight.table is None else self.twilight.table.contentHash()]
+        for key, events in sorted(self.events.items()) + sorted(self.date_events.items()):
+            content += [f'{key} {event.start.isoformat()} {event.stop.isoformat()}'
+                        for event in sorted(events, key=lambda evt: (evt.start, evt.stop))]
+        return hashlib.sha256('\n'.join(content).encode('utf-8')).hexdigest()
+
     def addEvent(self, weekday: int, event: ScheduleEvent) -> None:
-        '''Add a new event to this schedule.'''
-        self.events[weekday] = event
+        '''Add a new event to this schedule that repeats on a weekday.'''
+        self.events.setdefault(weekday, []).append(event)
+        self._eventsChanged(weekday=weekday)
+
+    def clearEvents(self, weekday: int) -> None:
+        '''Remove all events that repeat on a weekday.'''
+        if self.events.pop(weekday, None) is not None:
+            self._eventsChanged(weekday=weekday)
+
+    def addDateEvent(self, event_date: date, event: ScheduleEvent) -> None:
+        '''Add a new event to this schedule that occurs only on a specific date,
+        in addition to the events of that weekday.'''
+        self.date_events.setdefault(event_date, []).append(event)
+        self._eventsChanged(event_date=event_date)
+
+    def clearDateEvents(self, event_date: date) -> None:
+        '''Remove all events that occur only on a specific date.'''
+        if self.date_events.pop(event_date, None) is not None:
+            self._eventsChanged(event_date=event_date)
 
-    def getCivilTwilight(self, event_date: date = None) -> datetime:
-        '''Return the start of civil sunset on a given date.
-        Default is today's date in the timezone ``WeeklySchedule.tzinfo``.'''
-        twilight_start_end = twilight(self.observer, event_date, SunDirection.SETTING, self.tzinfo)
-        return twilight_start_end[0]
+    def _eventsChanged(self, weekday: Optional[int] = None,
+                       event_date: Optional[date] = None) -> None:
+        '''Update derived state after the events of a weekday or of a specific date changed.
+
+        Only the affected days of the kept plans are reclassified, using their stored
+        sunset times, followed by the "event type changed" flags that depend on them.
+        '''
+        if weekday is not None:
+            self._state.intervals.pop(weekday, None)
+            for other_date in self.date_events:
+                if other_date.weekday() == weekday:
+                    self._state.intervals.pop(other_date, None)
+        if event_date is not None:
+            self._state.intervals.pop(event_date, None)
+        self.transitions = None
+        affected = {}
+        for year, data in self._state.plans.items():
+            if weekday is not None:
+                first_date = date(year, 1, 1)
+                first_day = (weekday - first_date.weekday()) % 7
+                reclassified = [first_date + timedelta(days=days)
+                                for days in range(first_day, len(data), 7)]
+                affected[year] = (reclassified, reclassified)
+            else:
+                following = (event_date, event_date + timedelta(days=7))
+                affected[year] = ([event_date] if event_date in data else [],
+                                  [other_date for other_date in following if other_date in data])
+            for calendar_date in affected[year][0]:
+                sunset_time, _, evt_changed = data[calendar_date]
+                data[calendar_date] = (self._classifyDate(calendar_date, sunset_time) +
+                                       (evt_changed,))
+        # Flags depend on the types of the previous week, possibly in the previous year's plan.
+        for year, data in self._state.plans.items():
+            for calendar_date in affected[year][1]:
+                sunset_time, evt_type, _ = data[calendar_date]
+                evt_changed = evt_type is not None and evt_type != self._plannedEventType(
+                    calendar_date - timedelta(days=7))
+                data[calendar_date] = (sunset_time, evt_type, evt_changed)
+
+    def _plannedEventType(self, event_date: date) -> Optional[int]:
+        '''Return the event type of a date from the kept plans,
+        or classify it if it is not planned.'''
+        data = self._state.plans.get(event_date.year)
+        if data is not None:
+            return data[event_date][1]
+        return self.getEventType(event_date)
+
+    def getEvents(self, event_date: date) -> EventIntervals:
+        '''Return the merged occupancy intervals of a date.'''
+        key = event_date if event_date in self.date_events else event_date.weekday()
+        result = self._state.intervals.get(key)
+        if result is None:
+            events = self.events.get(event_date.weekday(), [])
+            if key is event_date:
+                events = events + self.date_events[event_date]
+            result = self._state.intervals[key] = EventIntervals(events, self.gap_threshold)
+        return result
+
+    def loadTwilightTable(self, path: str) -> TwilightTable:
+        '''Use a precomputed twilight table for the dates it covers, see
+        ``SiteTwilight.loadTable``. Loading a table discards the kept plans.'''
+        table = self.twilight.loadTable(path)
+        self._planningChanged()
+        return table
+
+    def getCivilTwilight(self, event_date: date = None,
+                         direction: SunDirection = SunDirection.SETTING) -> datetime:
+        '''Return the start of civil sunset on a given date,
+        or the end of civil sunrise for ``SunDirection.RISING``, see
+        ``SiteTwilight.getCivilTwilight``.'''
+        return self.twilight.getCivilTwilight(event_date, direction)
+
+    def _precomputeTwilight(self, start_date: date, end_date: date
+                            ) -> Tuple[List[datetime], List[Optional[datetime]]]:
+        '''Fill ``SiteTwilight.cache`` for all dates from start_date
+        up to, but not including, end_date: with sunsets, and with sunrises on the dates
+        where ``WeeklySchedule._needsSunrise`` says they are needed.
+        The numpy backend computes all missing dates in a single batch, computing
+        sunrises and sunsets together in one shared pass.
+
+        Return:
+            A tuple of lists (sunsets, sunrises) with the twilight of each date,
+            where sunrises are `None` on dates that do not need them.
+        '''
+        twilight = self.twilight
+        offsets = twilight.getUtcOffsets(start_date, end_date)
+        # Intervals starting after the latest local noon under every UTC offset of the timezone
+        # never need a sunrise, without looking up the UTC offset of their date.
+        noon = 43200.0 - 240.0 * self.observer.longitude + MAX_EQUATION_OF_TIME
+        morning_end = noon + max(offsets.offsets)
+        if noon + min(offsets.offsets) < 0.0 or morning_end >= 86400.0:
+            morning_end = math.inf
+        sunsets = []
+        sunrises = []
+        missing = []
+        missing_sunrises = []
+        for calendar_date in (start_date + timedelta(days=days)
+                              for days in range((end_date - start_date).days)):
+            sunsets.append(twilight.storedTwilight(calendar_date))
+            if sunsets[-1] is None:
+                missing.append(calendar_date)
+            sunrises.append(None)
+            intervals = self.getEvents(calendar_date)
+            if (intervals and intervals.first_start < morning_end and
+                    self._needsSunrise(calendar_date, intervals, offsets)):
+                sunrises[-1] = twilight.storedTwilight(calendar_date, SunDirection.RISING)
+                if sunrises[-1] is None:
+                    missing_sunrises.append(calendar_date)
+        self._computeMissing(start_date, (sunsets, sunrises), missing, missing_sunrises)
+        return sunsets, sunrises
+
+    def _computeMissing(self, start_date: date,
+                        twilight_lists: Tuple[List[datetime], List[Optional[datetime]]],
+                        missing: List[date], missing_sunrises: List[date]) -> None:
+        '''Compute the sunsets and sunrises missing from ``WeeklySchedule._precomputeTwilight``,
+        store them in ``SiteTwilight.cache``, and fill them into its lists of dates from
+        start_date.'''
+        twilight = self.twilight
+        results = []
+        if missing_sunrises and self.backend == BACKEND_NUMPY:
+            missing = sorted(set(missing).union(missing_sunrises))
+            pair = twilight.computeTwilightPair(missing)
+            results = [(missing, pair[1], SunDirection.SETTING),
+                       (missing, pair[0], SunDirection.RISING)]
+        else:
+            if missing:
+                results.append((missing, twilight.computeTwilight(missing), SunDirection.SETTING))
+            if missing_sunrises:
+                results.append((missing_sunrises,
+                                twilight.computeTwilight(missing_sunrises, SunDirection.RISING),
+                                SunDirection.RISING))
+        missing_sunrises = set(missing_sunrises)
+        for dates, values, direction in results:
+            for event_date, value in zip(dates, values):
+                twilight.cache.put(twilight.cacheKey(event_date, direction), value)
+                if direction == SunDirection.SETTING:
+                    twilight_lists[0][(event_date - start_date).days] = value
+                elif event_date in missing_sunrises:
+                    twilight_lists[1][(event_date - start_date).days] = value
+
+    def _needsSunrise(self, event_date: date, intervals: EventIntervals,
+                      offsets: Optional[UtcOffsetIndex] = None) -> bool:
+        '''Return True if an interval of a date may start before sunrise, so that its sunrise
+        must be known to classify it. This is decided from the latest possible solar noon,
+        without computing the sunrise. The UTC offsets of the date may be given.'''
+        if not intervals:
+            return False
+        if offsets is None:
+            offsets = self.twilight.getUtcOffsets(event_date)
+        day_seconds = (event_date - EPOCH_DATE).days * 86400.0
+        latest_noon = (day_seconds + 43200.0 - 240.0 * self.observer.longitude +
+                       MAX_EQUATION_OF_TIME)
+        local_noon = latest_noon + offsets.offsetAt(latest_noon) - day_seconds
+        # Outside of the day only with unusual timezones: then always compute the sunrise.
+        return not 0.0 <= local_noon < 86400.0 or intervals.first_start < local_noon
+
+    def _sunrise(self, event_date: date, intervals: EventIntervals) -> Optional[datetime]:
+        '''Return the end of civil sunrise on a date if ``WeeklySchedule._needsSunrise``,
+        otherwise `None`.'''
+        if not self._needsSunrise(event_date, intervals):
+            return None
+        return self.getCivilTwilight(event_date, SunDirection.RISING)
+
+    def _exactNearBoundary(self, event_date: date, intervals: EventIntervals,
+                           twilight_time: datetime,
+                           direction: SunDirection = SunDirection.SETTING) -> datetime:
+        '''Return the twilight of a date, replaced with the fast backend by the exact time,
+        also in ``SiteTwilight.cache``, if it is near the start or stop of an interval.'''
+        if self.twilight.backend != BACKEND_FAST or not intervals.nearBoundary(
+                twilight_time.time(), FAST_MAX_ERROR):
+            return twilight_time
+        if INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count('solar_computations')
+        exact_time = self.twilight.exactTwilight(event_date, direction)
+        if exact_time != twilight_time:
+            self.twilight.cache.put(self.twilight.cacheKey(event_date, direction), exact_time)
+        return exact_time
+
+    def _classifyIntervals(self, event_date: date,
+                           sunset_time: datetime) -> List[Tuple[ScheduleEvent, int, datetime]]:
+        '''Return each merged interval of a date with its own event type, as in
+        ``EventIntervals.classify``, and the sunset or sunrise that turns lights ON or OFF
+        for SUNSET or SUNRISE intervals.
+        Args:
+            event_date:  The date.
+            sunset_time: The sunset of the date, such as the one generated by
+                         ``WeeklySchedule.iterEvents``.
+        '''
+        intervals = self.getEvents(event_date)
+        sunrise_time = self._sunrise(event_date, intervals)
+        if sunrise_time is not None:
+            sunrise_time = self._exactNearBoundary(event_date, intervals, sunrise_time,
+                                                   SunDirection.RISING)
+        return [(event, interval_type,
+                 sunrise_time if interval_type == EVT_SUNRISE else sunset_time)
+                for event, interval_type in intervals.classify(
+                    sunset_time.time(), None if sunrise_time is None else sunrise_time.time())]
 
     def getEventType(self, event_date: date) -> Optional[int]:
         '''Return the type of event for manually programming an Intermatic astronomical time clock.
-        The event type primarily depends on whether a sunset occurs during the event.
+        The event type primarily depends on whether a sunset occurs during the event,
+        and for events that start before sunrise, whether a sunrise occurs during it.
+        With several events on a date, the type is determined from their merged intervals
+        as described in ``EventIntervals.eventType``.
         '''
-        event = self.events.get(event_date.weekday())
-        if event is None:
+        if not self.getEvents(event_date):
             return None
-        result = EVT_SUNSET
-        sunset_time = self.getCivilTwilight(event_date).time()
-        if event.start > sunset_time:
-            result = EVT_FIXED
-        elif sunset_time > event.stop:
-            result = EVT_NEVER_ON
+        return self._classifyDate(event_date, self.getCivilTwilight(event_date))[1]
+
+    def _classifyDate(self, event_date: date,
+                      sunset_time: datetime) -> Tuple[datetime, Optional[int]]:
+        '''Return the sunset and event type of a date given its sunset time, as in
+        ``WeeklySchedule._classify``, looking up its sunrise if it is needed.'''
+        return self._classify(event_date, sunset_time,
+                              self._sunrise(event_date, self.getEvents(event_date)))
+
+    def _classify(self, event_date: date, sunset_time: datetime,
+                  sunrise_time: Optional[datetime]) -> Tuple[datetime, Optional[int]]:
+        '''Return the sunset and event type of a date given its sunset time, and its sunrise time
+        if ``WeeklySchedule._needsSunrise``, otherwise `None`.
+        With the fast backend, a sunset (or sunrise) near the start or stop of an interval is first
+        replaced by the exact time, see ``WeeklySchedule._exactNearBoundary``.'''
+        enabled = INSTRUMENTATION.enabled
+        intervals = self.getEvents(event_date)
+        sunset_time = self._exactNearBoundary(event_date, intervals, sunset_time)
+        if sunrise_time is not None:
+            sunrise_time = self._exactNearBoundary(event_date, intervals, sunrise_time,
+                                                   SunDirection.RISING)
+        # Twilight computed above is timed as its own stage.
+        if enabled:
+            start = perf_counter()
+        result = sunset_time, intervals.eventType(
+            sunset_time.time(), None if sunrise_time is None else sunrise_time.time())
+        if enabled:
+            INSTRUMENTATION.count('days_classified')
+            INSTRUMENTATION.addTime(STAGE_CLASSIFY, perf_counter() - start)
+        return result
+
+    def iterEvents(self, start_date: date, end_date: Optional[date] = None
+                   ) -> Iterator[Tuple[date, datetime, Optional[int], bool]]:
+        '''Lazily generate events for every day from start_date up to, but not including, end_date.
+        Args:
+            start_date (date):
+                The first day for which to create events.
+            end_date (date):
+                The day after the last day. If `None`, events are generated indefinitely.
+
+        Yield:
+            Tuples of (date, sunset datetime, event type, "event type changed" flag)
+            with the same meaning as the values of ``WeeklySchedule.createEvents``.
+
+        Only the event types of the last week are kept in memory, and twilight
+        is computed in blocks as the iteration proceeds: of ``STREAM_BLOCK_DAYS`` days,
+        or with the numpy backend of the whole range as far as ``SiteTwilight.cache``
+        keeps the sunsets and sunrises of a block for ``WeeklySchedule._classifyIntervals``.
+        '''
+        week_start = start_date - timedelta(days=7)
+        self._precomputeTwilight(week_start, start_date)
+        # Event types of the previous seven days; the oldest is the same weekday last week.
+        last_week = deque((self.getEventType(week_start + timedelta(days=i)) for i in range(7)),
+                          maxlen=7)
+        block_days = self._blockDays(start_date, end_date)
+        calendar_date = block_start = block_end = start_date
+        sunsets = sunrises = []
+        while end_date is None or calendar_date < end_date:
+            if calendar_date >= block_end:
+                block_start = calendar_date
+                block_end = calendar_date + timedelta(days=block_days)
+                if end_date is not None:
+                    block_end = min(block_end, end_date)
+                sunsets, sunrises = self._precomputeTwilight(block_start, block_end)
+            index = (calendar_date - block_start).days
+            sunset_time = sunsets[index]
+            curr_event_type = None
+            if self.getEvents(calendar_date):
+                sunset_time, curr_event_type = self._classify(calendar_date, sunset_time,
+                                                              sunrises[index])
+            event_type_changed = curr_event_type is not None and curr_event_type != last_week[0]
+            yield calendar_date, sunset_time, curr_event_type, event_type_changed
+            last_week.append(curr_event_type)
+            calendar_date += timedelta(days=1)
+
+    def _plannedEvents(self, start_date: date, end_date: date
+                       ) -> Iterator[Tuple[date, datetime, Optional[int], bool]]:
+        '''Generate the events of ``WeeklySchedule.iterEvents`` for all days from start_date
+        up to, but not including, end_date, taken from the plans kept by
+        ``WeeklySchedule.createEvents`` for the years it has planned.'''
+        calendar_date = start_date
+        while calendar_date < end_date:
+            part_end = min(end_date, date(calendar_date.year + 1, 1, 1))
+            data = self._state.plans.get(calendar_date.year)
+            if data is None:
+                yield from self.iterEvents(calendar_date, part_end)
+            else:
+                for days in range((part_end - calendar_date).days):
+                    planned_date = calendar_date + timedelta(days=days)
+                    yield (planned_date,) + data[planned_date]
+            calendar_date = part_end
+
+    def _blockDays(self, start_date: date, end_date: Optional[date]) -> int:
+        '''Return the number of days of twilight computed at a time by ``WeeklySchedule.iterEvents``
+        for a range of dates.'''
+        capacity = self.twilight.cache.maxsize
+        if self.backend != BACKEND_NUMPY:
+            return STREAM_BLOCK_DAYS
+        if capacity is None:
+            return STREAM_BLOCK_DAYS if end_date is None else max((end_date - start_date).days, 1)
+        # Half of the cache, for the sunsets and sunrises of a block.
+        return max(capacity // 2, STREAM_BLOCK_DAYS)
+
+    def createColumns(self, start_date: date, end_date: date) -> EventColumns:
+        '''Create events for all days from start_date up to, but not including, end_date
+        as compact ``EventColumns``. Sunset times are rounded to whole seconds.'''
+        return EventColumns.fromEvents(self.iterEvents(start_date, end_date), self.tzinfo)
+
+    def buildTransitions(self, start_date: date, end_date: date) -> TransitionIndex:
+        '''Build the index of ON/OFF transitions of the lights for all days from start_date
+        up to, but not including, end_date, and keep it as ``WeeklySchedule.transitions``.
+
+        Each merged interval of a day is classified on its own: lights turn ON at sunset
+        for a SUNSET interval and at the start of a FIXED or SUNRISE interval, and turn OFF
+        at sunrise for a SUNRISE interval and at the end of the others. NEVER-ON intervals
+        have no transitions. Days of years planned by ``WeeklySchedule.createEvents`` are
+        classified from their kept plans.
+        '''
+        localize = self.twilight.localize
+        transitions = []
+        for calendar_date, sunset_time, evt_type, _ in self._plannedEvents(start_date, end_date):
+            if evt_type is None or evt_type == EVT_NEVER_ON:
+                continue
+            for event, interval_type, twilight in self._classifyIntervals(calendar_date,
+                                                                          sunset_time):
+                if interval_type == EVT_NEVER_ON:
+                    continue
+                transitions.append((twilight if interval_type == EVT_SUNSET
+                                    else localize(calendar_date, event.start), True))
+                transitions.append((twilight if interval_type == EVT_SUNRISE
+                                    else localize(calendar_date, event.stop), False))
+        self.transitions = TransitionIndex(localize(start_date, time()),
+                                           localize(end_date, time()), transitions)
+        return self.transitions
+
+    def createClockPlan(self, start_date: date, end_date: date) -> List[ClockSegment]:
+        '''Create the astro clock program for all days from start_date up to, but not including,
+        end_date as runs of consecutive weeks in which a weekday's program stays the same.
+
+        Return:
+            A list of ``ClockSegment`` ordered by weekday and first date. A new segment starts
+            wherever the event type or the times to program change; days without events are
+            not part of any segment.
+
+        Events are classified in a single pass over ``WeeklySchedule.iterEvents``, or taken
+        from the kept plans of years planned by ``WeeklySchedule.createEvents``.
+        '''
+        open_segments = {}
+        result = []
+        for calendar_date, sunset_time, evt_type, _ in self._plannedEvents(start_date, end_date):
+            weekday = calendar_date.weekday()
+            segment = open_segments.pop(weekday, None)
+            if evt_type is None:
+                if segment is not None:
+                    result.append(segment)
+                continue
+            intervals = self._classifyIntervals(calendar_date, sunset_time)
+            switching = tuple((None if interval_type == EVT_SUNSET else event.start,
+                               None if interval_type == EVT_SUNRISE else event.stop)
+                              for event, interval_type, _ in intervals
+                              if interval_type != EVT_NEVER_ON)
+            if (segment is not None and
+                    (segment.event_type, segment.switching) == (evt_type, switching)):
+                segment = segment._replace(last_date=calendar_date)
+            else:
+                if segment is not None:
+                    result.append(segment)
+                segment = ClockSegment(weekday, evt_type, calendar_date, calendar_date, switching)
+            open_segments[weekday] = segment
+        result.extend(open_segments.values())
+        result.sort(key=lambda segment: (segment.weekday, segment.first_date))
+        return result
+
+    def _transitionsAt(self, when: datetime) -> TransitionIndex:
+        '''Return a transition index covering an instant, building a new one if needed.'''
+        if self.transitions is None or not self.transitions.covers(when):
+            start_date = when.astimezone(self.tzinfo).date()
+            self.buildTransitions(start_date, start_date + timedelta(days=TRANSITION_HORIZON_DAYS))
+        return self.transitions
+
+    def stateAt(self, when: datetime) -> bool:
+        '''Return True if the lights should be ON at a timezone-aware instant.'''
+        return self._transitionsAt(when).stateAt(when)
+
+    def nextTransition(self, when: datetime) -> Optional[Tuple[datetime, bool]]:
+        '''Return the first ON/OFF transition strictly after a timezone-aware instant as a tuple
+        of (instant, lights ON), or `None` if there is none within ``TRANSITION_HORIZON_DAYS``.'''
+        result = self._transitionsAt(when).nextTransition(when)
+        if result is None:
+            # The index ends before the next transition: look ahead from the end of the index.
+            result = self._transitionsAt(self.transitions.end).nextTransition(when)
         return result
 
-    def createEvents(self, year: int, create_output: bool = False) -> Dict[date, Tuple[datetime, int, bool]]:
+    def createEvents(self, year: int,
+                     create_output: bool = False) -> Dict[date, Tuple[datetime, int, bool]]:
         '''Create events from a Schedule object at a custom location for the entire given year.
         Args:
             year (int):
@@ -118,35 +724,37 @@ class WeeklySchedule:
 
         The "event type changed" flag indicates that a change in the clock's
         manual programming is needed for the event that week.
+
+        The plan of each year is kept, and later changes of the events update
+        only the days they affect, so repeated calls return without recomputation.
+        With a ``WeeklySchedule.plan_cache``, plans are also loaded from and saved to it.
         '''
-        data = {}
-        calendar_date = date(year, 1, 1)
-        event_type_changed = False
-        while calendar_date.year == year:
-            curr_event_type = self.getEventType(calendar_date)
-            if curr_event_type is not None:
-                prev_week_event_type = self.getEventType(
-                    calendar_date - timedelta(days=7))
-                if curr_event_type != prev_week_event_type:
-                    event_type_changed = True
-            data[calendar_date] = (self.getCivilTwilight(calendar_date),
-                                   curr_event_type,
-                                   event_type_changed)
-            calendar_date += timedelta(days=1)
-            event_type_changed = False
+        plan = self._state.plans.get(year)
+        if INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count('plan_cache_hits' if plan is not None else 'plan_cache_misses')
+        if plan is None:
+            year_start, year_end = date(year, 1, 1), date(year + 1, 1, 1)
+            key = None if self.plan_cache is None else planKey(self, year)
+            if key is not None:
+                plan = self.plan_cache.load(
+                    key, self.twilight.getUtcOffsets(year_start, year_end).toLocal)
+                if INSTRUMENTATION.enabled:
+                    INSTRUMENTATION.count('plan_disk_hits' if plan is not None
+                                          else 'plan_disk_misses')
+            if plan is None:
+                plan = {}
+                for calendar_date, sunset_time, evt_type, evt_changed in self.iterEvents(year_start,
+                                                                                          year_end):
+                    plan[calendar_date] = (sunset_time, evt_type, evt_changed)
+                if key is not None:
+                    self.plan_cache.store(key, plan)
+            self._state.plans[year] = plan
+        data = dict(plan)
 
         if create_output:
             csv_name = f'sunsets_{year}.csv'
-            with open(csv_name, 'w') as out_file:
-                out_file.write('"Weekday","Date","Sunset","Event Type","Event Change?"\n')
-                for evt_date, (sunset_time, evt_type, evt_changed) in sorted(data.items()):
-                    out_file.write(
-                        f'"{calendar.day_abbr[evt_date.weekday()]}",'
-                        f'{evt_date},'
-                        f'{sunset_time.strftime("%H:%M:%S")},'
-                        f'"{EVENT_TYPES.get(evt_type, "")}",'
-                        f'{"*" if evt_changed else ""}\n'
-                    )
+            exportRecords(((None, evt_date) + record for evt_date, record in sorted(data.items())),
+                          csv_name)
             print(f'Schedule {csv_name} created.')
 
         return data
@@ -154,10 +762,9 @@ class WeeklySchedule:
 
 def getCurrentSchedule() -> WeeklySchedule:
     '''Current HoP weekly schedule.'''
-    # Observer at HoP: Rochester_HoP,USA,43°09'N,77°23'W,US/Eastern,170
-    # Note: elevation (in meters) is just a guess based on ROC airport. We may adjust it.
-    hop_observer = Observer(latitude=43.1606355, longitude=-77.3883843, elevation=170)
-    result = WeeklySchedule(hop_observer, tzinfo=pytz.timezone('US/Eastern'))
+    latitude, longitude, elevation = HOP_LOCATION
+    hop_observer = Observer(latitude=latitude, longitude=longitude, elevation=elevation)
+    result = WeeklySchedule(hop_observer, tzinfo=pytz.timezone(HOP_TIMEZONE))
     result.addEvent(calendar.SUNDAY, ScheduleEvent(time(16, 45), time(19, 0)))
     result.addEvent(calendar.TUESDAY, ScheduleEvent(time(18, 30), time(22, 0)))
     result.addEvent(calendar.WEDNESDAY, ScheduleEvent(time(18, 45), time(21, 0)))
@@ -165,11 +772,13 @@ def getCurrentSchedule() -> WeeklySchedule:
     return result
 
 
-def outputSunsets(year: int) -> None:
+def outputSunsets(year: int, plan_cache: Optional[PlanCache] = None) -> None:
     '''Create astronomical events as necessary for safe lighting
-    and output the schedule to a file.'''
+    and output the schedule to a file.
+    With a plan cache, the plan of an unchanged schedule is loaded from it.'''
     # Get Lot lighting schedule
     hop_schedule = getCurrentSchedule()
+    hop_schedule.plan_cache = plan_cache
     print('Occupancy schedule:')
     print(hop_schedule)
     # Save it
@@ -181,4 +790,4 @@ if __name__ == '__main__':
     YEAR = date.today().year
     if len(sys.argv) == 2:
         YEAR = int(sys.argv[1])
-    outputSunsets(YEAR)
+    outputSunsets(YEAR, environmentPlanCache())
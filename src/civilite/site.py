@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+''' Location of the default site of civilite, the HoP
+
+Kept apart from ``civilite.schedule`` so that modules it imports, such as
+``civilite.tables``, can default to this site without importing it back.
+'''
+
+# self
+import civilite._meta as meta
+
+__version__ = meta.__version__
+
+# Observer at HoP: Rochester_HoP,USA,43°09'N,77°23'W,US/Eastern,170
+# as (latitude, longitude, elevation in meters).
+# Note: elevation (in meters) is just a guess based on ROC airport. We may adjust it.
+HOP_LOCATION = (43.1606355, -77.3883843, 170)
+# IANA name of the timezone of the HoP.
+HOP_TIMEZONE = 'US/Eastern'
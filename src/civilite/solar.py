@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+''' Vectorized solar engine for civilite
+
+Computes civil twilight for whole arrays of dates in one batched NumPy pass.
+The formulas are the NOAA solar equations used by ``astral.sun``, so results
+agree with ``astral.sun.twilight`` to well within a second.
+
+Morning and evening twilight can be computed together: the first of the two
+NOAA passes evaluates the sun at the start of each day for both directions,
+so it is shared, and only the second pass is computed per direction.
+
+Given a ``civilite.offsets.UtcOffsetIndex``, the conversion to local dates and times
+is done on arrays as well, leaving only the creation of the datetimes per date.
+'''
+
+# Builtins
+from datetime import date, datetime, timezone, tzinfo as TzInfo
+from math import acos, degrees, radians, tan
+from typing import Iterable, List, Optional, Tuple, Union
+
+# 3rd party
+import numpy as np
+from astral import Observer, SunDirection
+
+# self
+import civilite._meta as meta
+from civilite.offsets import UtcOffsetIndex
+
+__version__ = meta.__version__
+
+# The Unix epoch date and its Julian day number at 00:00 UTC.
+EPOCH_DATE = date(1970, 1, 1)
+JD_UNIX_EPOCH = 2440587.5
+# Sun's apparent radius in degrees, using 32 arc minutes as its apparent diameter.
+SUN_APPARENT_RADIUS = 32.0 / (60.0 * 2.0)
+# Zenith angle of the sun at sunset and sunrise, i.e. the start of evening
+# and the end of morning civil twilight.
+ZENITH_HORIZON = 90.0 + SUN_APPARENT_RADIUS
+# Polar radius of the earth in meters, used for the observer elevation correction.
+EARTH_RADIUS = 6356900.0
+
+DateArray = Union[np.ndarray, Iterable[date]]
+
+
+def toDayNumbers(dates: DateArray) -> np.ndarray:
+    '''Return an int64 array of days since 1970-01-01 for an array of dates.'''
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def elevationCorrection(observer: Observer) -> float:
+    '''Return the extra degrees of depression seen from the observer's elevation.
+    A tuple elevation describes an obscuring feature as (height, distance).'''
+    elevation = observer.elevation
+    if isinstance(elevation, tuple):
+        height, distance = elevation
+        if height == 0.0:
+            return 0.0
+        sign = -1.0 if height < 0.0 else 1.0
+        return sign * degrees(acos(abs(height) / (height * height + distance * distance) ** 0.5))
+    if elevation <= 0.0:
+        return 0.0
+    return degrees(acos(EARTH_RADIUS / (EARTH_RADIUS + elevation)))
+
+
+def refractionCorrection(zenith: float) -> float:
+    '''Return the degrees of atmospheric refraction of the sun at a given zenith angle.'''
+    elevation = 90.0 - zenith
+    if elevation >= 85.0:
+        return 0.0
+    te = tan(radians(elevation))
+    if elevation > 5.0:
+        result = 58.1 / te - 0.07 / te ** 3 + 0.000086 / te ** 5
+    elif elevation > -0.575:
+        result = 1735.0 + elevation * (-518.2 + elevation * (103.4 + elevation * (
+            -12.79 + elevation * 0.711)))
+    else:
+        result = -20.774 / te
+    return result / 3600.0
+
+
+def solarDeclination(julian_century: np.ndarray) -> np.ndarray:
+    '''Return the sun's declination in degrees.'''
+    return np.degrees(np.arcsin(np.sin(np.radians(_obliquityCorrection(julian_century))) *
+                                np.sin(np.radians(_apparentLongitude(julian_century)))))
+
+
+def equationOfTime(julian_century: np.ndarray) -> np.ndarray:
+    '''Return the equation of time in minutes.'''
+    jc = julian_century
+    l0 = np.radians(_meanLongitude(jc))
+    m = np.radians(_meanAnomaly(jc))
+    e = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    y = np.tan(np.radians(_obliquityCorrection(jc)) / 2.0) ** 2
+    sinm = np.sin(m)
+    e_time = (y * np.sin(2.0 * l0)
+              - 2.0 * e * sinm
+              + 4.0 * e * y * sinm * np.cos(2.0 * l0)
+              - 0.5 * y * y * np.sin(4.0 * l0)
+              - 1.25 * e * e * np.sin(2.0 * m))
+    return np.degrees(e_time) * 4.0
+
+
+def hourAngle(latitude: float, declination: np.ndarray, zenith: float,
+              direction: SunDirection) -> np.ndarray:
+    '''Return the hour angle of the sun in radians.
+    The result is NaN on days when the sun never reaches the zenith angle.'''
+    lat = radians(latitude)
+    dec = np.radians(declination)
+    with np.errstate(invalid='ignore'):
+        result = np.arccos((np.cos(radians(zenith)) - np.sin(lat) * np.sin(dec)) /
+                           (np.cos(lat) * np.cos(dec)))
+    if direction == SunDirection.SETTING:
+        result = -result
+    return result
+
+
+def transitTimes(observer: Observer, dates: DateArray, zenith: float,
+                 direction: SunDirection, with_refraction: bool = True) -> np.ndarray:
+    '''Return the instants when the sun crosses a zenith angle on each of the given dates.
+
+    Args:
+        observer:  An ``astral.Observer`` instance for a desired location.
+        dates:     Array-like of dates, as ``datetime.date`` or ``numpy.datetime64``.
+        zenith:    The zenith angle in degrees.
+        direction: ``SunDirection.RISING`` or ``SunDirection.SETTING``.
+        with_refraction: If True, correct the zenith angle for atmospheric refraction.
+
+    Return:
+        A float64 array of UTC epoch seconds, NaN where the sun does not transit.
+    '''
+    latitude = min(max(observer.latitude, -89.8), 89.8)
+    adjusted_zenith = _adjustedZenith(observer, zenith, with_refraction)
+    days = toDayNumbers(dates)
+    julian_day = days + JD_UNIX_EPOCH
+    adjustment = 0.0
+    time_utc = np.zeros(days.shape)
+    # Two passes: the second evaluates the sun's position at the first estimate.
+    for _ in range(2):
+        time_utc = _transitMinutes(observer.longitude, latitude, adjusted_zenith,
+                                   julian_day + adjustment, direction)
+        adjustment = time_utc / 1440.0
+    return days * 86400.0 + time_utc * 60.0
+
+
+def transitTimePair(observer: Observer, dates: DateArray, zenith: float,
+                    with_refraction: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    '''Return the instants when the sun crosses a zenith angle rising and setting
+    on each of the given dates.
+
+    The result is the same as that of ``transitTimes`` for each direction, with the
+    first pass computed once for both.
+
+    Return:
+        A tuple of float64 arrays (rising, setting) of UTC epoch seconds,
+        NaN where the sun does not transit.
+    '''
+    latitude = min(max(observer.latitude, -89.8), 89.8)
+    adjusted_zenith = _adjustedZenith(observer, zenith, with_refraction)
+    days = toDayNumbers(dates)
+    julian_day = days + JD_UNIX_EPOCH
+    # First pass, shared: the sun's position at the start of the day.
+    julian_century = (julian_day - 2451545.0) / 36525.0
+    hour_angle = np.degrees(hourAngle(latitude, solarDeclination(julian_century), adjusted_zenith,
+                                      SunDirection.RISING))
+    e_time = equationOfTime(julian_century)
+    first_rising = _utcMinutes(observer.longitude, hour_angle, e_time)
+    first_setting = _utcMinutes(observer.longitude, -hour_angle, e_time)
+    # Second pass of both directions in one batch.
+    both_days = np.concatenate((julian_day, julian_day))
+    time_utc = _transitMinutes(observer.longitude, latitude, adjusted_zenith,
+                               both_days + np.concatenate((first_rising, first_setting)) / 1440.0,
+                               None)
+    seconds = np.concatenate((days, days)) * 86400.0 + time_utc * 60.0
+    return seconds[:len(days)], seconds[len(days):]
+
+
+def civilTwilightTimes(observer: Observer, dates: DateArray,
+                       direction: SunDirection = SunDirection.SETTING) -> np.ndarray:
+    '''Return the start of evening (or end of morning) civil twilight on each UTC date
+    as a float64 array of UTC epoch seconds.'''
+    return transitTimes(observer, dates, ZENITH_HORIZON, direction)
+
+
+def civilTwilight(observer: Observer, dates: DateArray, tzinfo: Optional[TzInfo] = timezone.utc,
+                  direction: SunDirection = SunDirection.SETTING, strict: bool = True,
+                  utc_offsets: Optional[UtcOffsetIndex] = None) -> List[Optional[datetime]]:
+    '''Return the start of civil sunset (or the end of civil sunrise) on each of the given dates.
+
+    This is the batched equivalent of ``astral.sun.twilight(...)[0]`` for SETTING
+    and ``astral.sun.twilight(...)[1]`` for RISING: dates are local to `tzinfo`,
+    and the returned datetimes are in `tzinfo`.
+
+    A `utc_offsets` index of `tzinfo` covering the dates replaces the conversion by `tzinfo`
+    itself, converting all dates at once with the same results as ``UtcOffsetIndex.toLocal``.
+
+    Raises:
+        ValueError: if the sun does not rise or set on one of the dates and `strict`
+            is True. Otherwise `None` is returned for such dates.
+    '''
+    days = toDayNumbers(dates)
+    seconds = civilTwilightTimes(observer, days, direction)
+    return _localTwilight(observer, days, seconds, tzinfo, direction, strict, utc_offsets)
+
+
+def civilTwilightPair(observer: Observer, dates: DateArray, tzinfo: Optional[TzInfo] = timezone.utc,
+                      strict: bool = True, utc_offsets: Optional[UtcOffsetIndex] = None
+                      ) -> Tuple[List[Optional[datetime]], List[Optional[datetime]]]:
+    '''Return both the end of civil sunrise and the start of civil sunset on each of the given dates
+    as a tuple of lists (sunrises, sunsets), computed in one shared pass.
+
+    The results are the same as those of ``civilTwilight`` for RISING and SETTING,
+    which also describes the arguments.
+    '''
+    days = toDayNumbers(dates)
+    rising, setting = transitTimePair(observer, days, ZENITH_HORIZON)
+    return (_localTwilight(observer, days, rising, tzinfo, SunDirection.RISING, strict,
+                           utc_offsets),
+            _localTwilight(observer, days, setting, tzinfo, SunDirection.SETTING, strict,
+                           utc_offsets))
+
+
+def _localTwilight(observer: Observer, days: np.ndarray, seconds: np.ndarray,
+                   tzinfo: Optional[TzInfo], direction: SunDirection, strict: bool,
+                   utc_offsets: Optional[UtcOffsetIndex]) -> List[Optional[datetime]]:
+    '''Convert the twilight times of UTC dates to datetimes on the same local dates.'''
+    if utc_offsets is not None:
+        result = None
+        local_days = np.floor(_localSeconds(seconds, utc_offsets)[1] / 86400.0)
+    else:
+        result = _toDatetimes(seconds, tzinfo)
+        local_days = np.array([(dt.date() - EPOCH_DATE).days if dt is not None else 0
+                               for dt in result], dtype=np.int64)
+    # Like astral, retry on the neighboring UTC date when the local date does not match.
+    mismatched = np.nonzero((local_days != days) & ~np.isnan(seconds))[0]
+    if mismatched.size:
+        shifted = days[mismatched] + np.where(local_days[mismatched] < days[mismatched], 1, -1)
+        retried = civilTwilightTimes(observer, shifted, direction)
+        if result is None:
+            seconds = seconds.copy()
+            seconds[mismatched] = retried
+        else:
+            for index, value in zip(mismatched, _toDatetimes(retried, tzinfo)):
+                result[index] = value
+    if result is None:
+        result = _offsetDatetimes(seconds, utc_offsets)
+    if strict and any(dt is None for dt in result):
+        raise ValueError('Sun does not reach the horizon on a requested date at this location.')
+    return result
+
+
+def _toDatetimes(seconds: np.ndarray, tzinfo: Optional[TzInfo]) -> List[Optional[datetime]]:
+    '''Convert UTC epoch seconds to datetimes in a timezone. NaN becomes `None`.'''
+    return [None if np.isnan(ts) else datetime.fromtimestamp(ts, timezone.utc).astimezone(tzinfo)
+            for ts in seconds.tolist()]
+
+
+def _localSeconds(seconds: np.ndarray, utc_offsets: UtcOffsetIndex
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+    '''Return the index of the segment of constant UTC offset containing each of the UTC epoch
+    seconds, as ``UtcOffsetIndex._segment``, and the seconds shifted by that offset.'''
+    segments = np.maximum(np.searchsorted(np.asarray(utc_offsets.times), seconds, 'right') - 1, 0)
+    return segments, seconds + np.asarray(utc_offsets.offsets)[segments]
+
+
+def _offsetDatetimes(seconds: np.ndarray, utc_offsets: UtcOffsetIndex) -> List[Optional[datetime]]:
+    '''Convert UTC epoch seconds to datetimes like ``UtcOffsetIndex.toLocal``. NaN becomes `None`.
+    Local times repeated when clocks are set back are left to ``UtcOffsetIndex.toLocal``.'''
+    segments, local_seconds = _localSeconds(seconds, utc_offsets)
+    valid = ~np.isnan(local_seconds)
+    local_seconds = np.where(valid, local_seconds, 0.0)
+    whole = np.floor(local_seconds)
+    # Round to microseconds like ``datetime.timedelta``.
+    microseconds = np.round((local_seconds - whole) * 1e6).astype(np.int64)
+    naive = (whole.astype(np.int64).astype('datetime64[s]') +
+             microseconds.astype('timedelta64[us]')).tolist()
+    times = np.asarray(utc_offsets.times)
+    offsets = np.asarray(utc_offsets.offsets)
+    previous = np.maximum(segments - 1, 0)
+    repeated = (segments > 0) & (local_seconds < times[segments] + offsets[previous])
+    zones = utc_offsets.zones
+    result = [local_time.replace(tzinfo=zones[segment]) if is_valid else None
+              for local_time, segment, is_valid in zip(naive, segments.tolist(), valid.tolist())]
+    for index in np.nonzero(repeated & valid)[0].tolist():
+        result[index] = utc_offsets.toLocal(float(seconds[index]))
+    return result
+
+
+def _adjustedZenith(observer: Observer, zenith: float, with_refraction: bool) -> float:
+    '''Return a zenith angle corrected for the observer's elevation and, optionally, refraction.'''
+    result = zenith + elevationCorrection(observer)
+    if with_refraction:
+        result += refractionCorrection(result)
+    return result
+
+
+def _utcMinutes(longitude: float, hour_angle: np.ndarray, e_time: np.ndarray) -> np.ndarray:
+    '''Return minutes after midnight UTC of a transit given its hour angle in degrees,
+    positive when rising, and the equation of time in minutes.'''
+    offset = (-longitude - hour_angle) * 4.0 - e_time
+    return 720.0 + np.where(offset < -720.0, offset + 1440.0, offset)
+
+
+def _transitMinutes(longitude: float, latitude: float, zenith: float, julian_day: np.ndarray,
+                    direction: Optional[SunDirection]) -> np.ndarray:
+    '''Return minutes after midnight UTC of transits with the sun's position evaluated at the given
+    Julian days. With `direction` `None`, the first half of the days is rising
+    and the second setting.'''
+    julian_century = (julian_day - 2451545.0) / 36525.0
+    hour_angle = np.degrees(hourAngle(latitude, solarDeclination(julian_century), zenith,
+                                      SunDirection.RISING))
+    if direction is None:
+        half = len(hour_angle) // 2
+        hour_angle[half:] = -hour_angle[half:]
+    elif direction == SunDirection.SETTING:
+        hour_angle = -hour_angle
+    return _utcMinutes(longitude, hour_angle, equationOfTime(julian_century))
+
+
+def _meanLongitude(jc: np.ndarray) -> np.ndarray:
+    '''Geometric mean longitude of the sun in degrees.'''
+    return (280.46646 + jc * (36000.76983 + 0.0003032 * jc)) % 360.0
+
+
+def _meanAnomaly(jc: np.ndarray) -> np.ndarray:
+    '''Geometric mean anomaly of the sun in degrees.'''
+    return 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+
+
+def _apparentLongitude(jc: np.ndarray) -> np.ndarray:
+    '''Apparent longitude of the sun in degrees.'''
+    m = np.radians(_meanAnomaly(jc))
+    center = (np.sin(m) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+              + np.sin(2.0 * m) * (0.019993 - 0.000101 * jc)
+              + np.sin(3.0 * m) * 0.000289)
+    omega = 125.04 - 1934.136 * jc
+    return _meanLongitude(jc) + center - 0.00569 - 0.00478 * np.sin(np.radians(omega))
+
+
+def _obliquityCorrection(jc: np.ndarray) -> np.ndarray:
+    '''Corrected obliquity of the ecliptic in degrees.'''
+    seconds = 21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))
+    mean_obliquity = 23.0 + (26.0 + seconds / 60.0) / 60.0
+    omega = 125.04 - 1934.136 * jc
+    return mean_obliquity + 0.00256 * np.cos(np.radians(omega))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+''' Precomputed civil twilight tables for civilite
+
+A twilight table is a compact binary file of civil sunset and sunrise times
+for one observer and timezone across a span of years. Loading a table maps the
+file into memory, so a lookup is an index into the mapped records with no solar
+computation and no per-process warm-up.
+
+File layout (little-endian):
+    header:  ``HEADER`` (magic, format version, fields per record, first day,
+             number of days, latitude, longitude, elevation, timezone name,
+             UTC offset in seconds of a timezone without an IANA name, else ``MISSING``)
+    records: one per day starting at the first day, each a pair of int32 UTC
+             epoch seconds (sunset, sunrise), ``MISSING`` if there is none.
+'''
+
+# Builtins
+import argparse
+import hashlib
+import mmap
+import struct
+from datetime import date, datetime, timedelta, timezone, tzinfo as TzInfo
+from typing import Optional, Tuple
+
+# 3rd party
+import pytz
+from astral import Observer
+
+# self
+import civilite._meta as meta
+from civilite.offsets import UtcOffsetIndex, ianaName, timezoneName
+from civilite.site import HOP_LOCATION, HOP_TIMEZONE
+
+__version__ = meta.__version__
+
+MAGIC = b'CVTW'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHiiddd32si')
+# Record fields, in the order they are stored for each day.
+FIELD_SUNSET = 0
+FIELD_SUNRISE = 1
+NUM_FIELDS = 2
+# Stored in place of a time when the sun does not rise or set on that day.
+MISSING = -2 ** 31
+# Days in the header are counted from this date.
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def writeTwilightTable(path: str, observer: Observer, tzinfo: TzInfo,
+                       first_year: int, last_year: int) -> int:
+    '''Compute civil sunsets and sunrises for every day of the given years, inclusive,
+    and save them as a twilight table.
+
+    Return:
+        The number of days in the table.
+    '''
+    # Imported here so that loading a table needs neither NumPy nor the solar engine.
+    import numpy as np
+    from civilite import solar
+
+    if isinstance(observer.elevation, tuple):
+        raise ValueError('Twilight tables do not support obscuring-feature elevations')
+    tz_fields = _timezoneFields(tzinfo, first_year, last_year)
+    first_day = (date(first_year, 1, 1) - EPOCH_DATE).days
+    num_days = (date(last_year + 1, 1, 1) - EPOCH_DATE).days - first_day
+    days = np.arange(first_day, first_day + num_days, dtype=np.int64)
+    records = np.empty((num_days, NUM_FIELDS), dtype='<i4')
+    sunrises, sunsets = solar.civilTwilightPair(observer, days, tzinfo, strict=False)
+    for field, times in ((FIELD_SUNSET, sunsets), (FIELD_SUNRISE, sunrises)):
+        records[:, field] = [MISSING if dt is None else round(dt.timestamp()) for dt in times]
+    with open(path, 'wb') as out_file:
+        out_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, NUM_FIELDS, first_day, num_days,
+                                   observer.latitude, observer.longitude, float(observer.elevation),
+                                   *tz_fields))
+        out_file.write(records.tobytes())
+    return num_days
+
+
+def _timezoneFields(tzinfo: TzInfo, first_year: int, last_year: int) -> Tuple[bytes, int]:
+    '''Return the timezone fields of the header of a table: the timezone name, and the UTC offset
+    in seconds of a timezone without an IANA name, which cannot be loaded by name.'''
+    tz_name = timezoneName(tzinfo).encode('utf-8')
+    if len(tz_name) > 32:
+        raise ValueError(f'Timezone name {tz_name!r} is too long for a twilight table')
+    if ianaName(tzinfo) is not None:
+        return tz_name, MISSING
+    offsets = UtcOffsetIndex(tzinfo, date(first_year, 1, 1), date(last_year + 1, 1, 1))
+    if len(offsets) != 1:
+        raise ValueError(f'Timezone {timezoneName(tzinfo)} has neither an IANA name '
+                         f'nor a fixed UTC offset')
+    return tz_name, offsets.offsets[0]
+
+
+class TwilightTable:
+    '''A read-only, memory-mapped twilight table.'''
+
+    def __init__(self, path: str) -> None:
+        '''Map a twilight table file created by ``writeTwilightTable``.'''
+        with open(path, 'rb') as in_file:
+            self._mmap = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, num_fields, first_day, num_days,
+         latitude, longitude, elevation, tz_name, utc_offset) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION or num_fields != NUM_FIELDS:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} twilight table')
+        # The location and timezone the table was computed for.
+        self.observer = Observer(latitude, longitude, elevation)
+        tz_name = tz_name.rstrip(b'\0').decode('utf-8')
+        self.tzinfo = (pytz.timezone(tz_name) if utc_offset == MISSING
+                       else timezone(timedelta(seconds=utc_offset), tz_name))
+        # The first date in the table and the number of days it covers.
+        self.first_date = EPOCH_DATE + timedelta(days=first_day)
+        self.num_days = num_days
+        # Zero-copy view of the records as a flat array of int32.
+        records_end = HEADER.size + num_days * NUM_FIELDS * 4
+        self._records = memoryview(self._mmap)[HEADER.size:records_end].cast('i')
+
+    def __enter__(self) -> 'TwilightTable':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_days
+
+    def __contains__(self, event_date: date) -> bool:
+        return 0 <= (event_date - self.first_date).days < self.num_days
+
+    def close(self) -> None:
+        '''Release the memory map.'''
+        self._records.release()
+        self._mmap.close()
+
+    def matches(self, observer: Observer, tzinfo: TzInfo) -> bool:
+        '''Return True if this table was computed for the given location and timezone.'''
+        return ((self.observer.latitude, self.observer.longitude, self.observer.elevation) ==
+                (observer.latitude, observer.longitude, observer.elevation) and
+                timezoneName(self.tzinfo) == timezoneName(tzinfo))
+
+    def contentHash(self) -> str:
+        '''Return a hex digest of the location, timezone and dates this table was computed for,
+        and of the contents of its file.'''
+        observer = self.observer
+        identity = (f'{observer.latitude!r} {observer.longitude!r} {observer.elevation!r} '
+                    f'{timezoneName(self.tzinfo)} {self.first_date.isoformat()} {self.num_days}')
+        result = hashlib.sha256(identity.encode('utf-8'))
+        result.update(self._mmap)
+        return result.hexdigest()
+
+    def lookup(self, event_date: date, field: int = FIELD_SUNSET) -> Optional[datetime]:
+        '''Return the stored time for a date in the table's timezone.
+        Return `None` if the date is not covered or the sun does not rise or set that day.'''
+        index = (event_date - self.first_date).days
+        if not 0 <= index < self.num_days:
+            return None
+        seconds = self._records[index * NUM_FIELDS + field]
+        if seconds == MISSING:
+            return None
+        return datetime.fromtimestamp(seconds, timezone.utc).astimezone(self.tzinfo)
+
+    def sunset(self, event_date: date) -> Optional[datetime]:
+        '''Return the start of civil sunset on a date.'''
+        return self.lookup(event_date, FIELD_SUNSET)
+
+    def sunrise(self, event_date: date) -> Optional[datetime]:
+        '''Return the end of civil sunrise on a date.'''
+        return self.lookup(event_date, FIELD_SUNRISE)
+
+
+if __name__ == '__main__':
+    # Default usage: create a twilight table for the HoP site
+    PARSER = argparse.ArgumentParser(description='Precompute a civil twilight table.')
+    PARSER.add_argument('first_year', type=int)
+    PARSER.add_argument('last_year', type=int)
+    PARSER.add_argument('output', nargs='?', default='twilight.bin')
+    PARSER.add_argument('--latitude', type=float, default=HOP_LOCATION[0])
+    PARSER.add_argument('--longitude', type=float, default=HOP_LOCATION[1])
+    PARSER.add_argument('--elevation', type=float, default=HOP_LOCATION[2])
+    PARSER.add_argument('--timezone', default=HOP_TIMEZONE)
+    ARGS = PARSER.parse_args()
+    NUM_DAYS = writeTwilightTable(ARGS.output,
+                                  Observer(ARGS.latitude, ARGS.longitude, ARGS.elevation),
+                                  pytz.timezone(ARGS.timezone), ARGS.first_year, ARGS.last_year)
+    print(f'Twilight table {ARGS.output} created with {NUM_DAYS} days.')
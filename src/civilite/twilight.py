@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+''' Civil twilight of a site for civilite
+
+The civil sunsets and sunrises of one observer in one timezone, computed with one of
+``BACKENDS``, memoized in a ``TwilightCache`` and optionally read from a twilight table,
+together with the UTC offset transitions of the timezone.
+'''
+
+# Builtins
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, tzinfo as TzInfo
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# 3rd party
+import pytz
+from astral import Observer, SunDirection
+from astral.sun import SUN_APPARENT_RADIUS, time_of_transit
+
+# self
+import civilite._meta as meta
+from civilite.instrumentation import INSTRUMENTATION, STAGE_TWILIGHT
+from civilite.offsets import UtcOffsetIndex
+from civilite.tables import TwilightTable
+
+__version__ = meta.__version__
+
+# Default number of twilight times kept by a schedule's cache: enough for
+# a full year plus the one-week look-back of the following year.
+TWILIGHT_CACHE_SIZE = 1024
+
+# Engines for computing civil twilight:
+#   astral: one ``astral.sun.twilight`` call per date.
+#   numpy:  batched computation of whole date ranges by ``civilite.solar``.
+#   fast:   exact astral computations at anchor dates every ``FAST_ANCHOR_DAYS`` days,
+#           and cubic interpolation between them. See ``FAST_MAX_ERROR``.
+BACKEND_ASTRAL = 'astral'
+BACKEND_NUMPY = 'numpy'
+BACKEND_FAST = 'fast'
+BACKENDS = (BACKEND_ASTRAL, BACKEND_NUMPY, BACKEND_FAST)
+
+# Days between the anchor dates of the fast backend.
+FAST_ANCHOR_DAYS = 12
+# Maximum error of interpolated twilight in the fast backend. The actual error up to
+# ``FAST_MAX_LATITUDE`` is below 8 seconds; at higher latitudes every date is computed exactly.
+# Dates whose interpolated twilight lies within this margin of an event's start or stop,
+# dates of DST changes, and dates where the interpolated time falls on another local date
+# are computed exactly, so event types are identical to the exact backends.
+FAST_MAX_ERROR = timedelta(seconds=20)
+FAST_MAX_LATITUDE = 60.0
+
+# Shortest number of days covered by a UTC offset index built on demand.
+OFFSET_HORIZON_DAYS = 400
+
+# Day numbers count days since this date.
+EPOCH_DATE = date(1970, 1, 1)
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _lagrangeWeights(position: int) -> Tuple[float, ...]:
+    '''Return the weights of the four anchors of the fast backend for a date ``position`` days
+    after the second anchor, in the order of the anchors.'''
+    day = FAST_ANCHOR_DAYS + position
+    anchors = [i * FAST_ANCHOR_DAYS for i in range(4)]
+    result = []
+    for i, anchor in enumerate(anchors):
+        weight = 1.0
+        for j, other in enumerate(anchors):
+            if i != j:
+                weight *= (day - other) / (anchor - other)
+        result.append(weight)
+    return tuple(result)
+
+
+# Interpolation weights of the fast backend for each day of a block of ``FAST_ANCHOR_DAYS`` days.
+_FAST_WEIGHTS = tuple(_lagrangeWeights(position) for position in range(FAST_ANCHOR_DAYS))
+
+
+class TwilightCache:
+    '''A bounded, least-recently-used cache of civil twilight times.
+
+    Keys are tuples of (observer, date, tzinfo) as built by ``SiteTwilight.cacheKey``.
+    The cache may be shared by several schedules at the same location.
+    '''
+
+    def __init__(self, maxsize: Optional[int] = TWILIGHT_CACHE_SIZE) -> None:
+        '''Create a new cache.
+
+        Args:
+            maxsize: Maximum number of entries to keep. The least recently used
+                        entry is evicted when the bound is exceeded.
+                     ``None`` means unbounded, and 0 disables caching.
+        '''
+        self.maxsize = maxsize
+        # Number of lookups answered from the cache.
+        self.hits = 0
+        # Number of lookups that required a new solar computation.
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[datetime]:
+        '''Return the cached twilight time for a key, or `None` if it is not cached.
+        Updates the hit/miss counters.'''
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: datetime) -> None:
+        '''Store a twilight time, evicting the least recently used entries if needed.'''
+        if self.maxsize == 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        '''Remove all entries and reset the hit/miss counters.'''
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class SiteTwilight:
+    '''Civil twilight and UTC offsets of an observer's location in a timezone.'''
+
+    def __init__(self, observer: Observer, tzinfo: pytz.tzinfo = pytz.utc,
+                 cache: Optional[TwilightCache] = None, backend: str = BACKEND_ASTRAL) -> None:
+        '''Create the twilight of a site.
+
+        Args:
+            observer: An ``astral.Observer`` instance for a desired location.
+            tzinfo:   Timezone in which to return times. If `None` is given,
+                        the caller's local system timezone will be used.
+                      The default is UTC.
+            cache:    A ``TwilightCache`` for civil twilight times.
+                      If `None` is given, a private cache of the default size is created.
+            backend:  The engine for computing civil twilight, one of ``BACKENDS``.
+                      The numpy backend requires NumPy and computes date ranges in batches.
+        '''
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown twilight backend {backend!r}, expected one of {BACKENDS}')
+        # The Observer of this site, see ``SiteTwilight.observer``.
+        self._observer = observer
+        # The timezone in which to return times, see ``SiteTwilight.tzinfo``.
+        self._tzinfo = tzinfo
+        # The engine used for computing civil twilight, see ``SiteTwilight.backend``.
+        self._backend = backend
+        # Memoized civil twilight times used by getCivilTwilight.
+        self.cache = TwilightCache() if cache is None else cache
+        # Optional precomputed twilight table, consulted before any computation.
+        self.table = None
+        # UTC offset transitions of the timezone around the most recently requested dates.
+        self.utc_offsets = None
+        # Exact sunsets and sunrises at the anchor dates of the fast backend, as seconds after
+        # midnight UTC of the date. Key: (days since 1970-01-01, SunDirection).
+        self._anchors = {}
+
+    @property
+    def observer(self) -> Observer:
+        '''The ``astral.Observer`` of this site. Setting it discards a twilight table computed
+        for another location; replace the observer instead of modifying it.'''
+        return self._observer
+
+    @observer.setter
+    def observer(self, observer: Observer) -> None:
+        self._observer = observer
+        self._anchors = {}
+        self._dropMismatchedTable()
+
+    @property
+    def tzinfo(self) -> Optional[TzInfo]:
+        '''The timezone in which to return times, `None` for the local system timezone.
+        Setting it discards a twilight table computed for another timezone.'''
+        return self._tzinfo
+
+    @tzinfo.setter
+    def tzinfo(self, tzinfo: Optional[TzInfo]) -> None:
+        self._tzinfo = tzinfo
+        self.utc_offsets = None
+        self._dropMismatchedTable()
+
+    @property
+    def backend(self) -> str:
+        '''The engine used for computing civil twilight, one of ``BACKENDS``.'''
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend: str) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown twilight backend {backend!r}, expected one of {BACKENDS}')
+        self._backend = backend
+
+    def _dropMismatchedTable(self) -> None:
+        '''Close and discard a twilight table created for another observer or timezone.'''
+        if self.table is not None and not self.table.matches(self._observer, self._tzinfo):
+            self.table.close()
+            self.table = None
+
+    def loadTable(self, path: str) -> TwilightTable:
+        '''Use a precomputed twilight table for the dates it covers.
+        The table must have been created for this site's observer and timezone.'''
+        table = TwilightTable(path)
+        if not table.matches(self.observer, self.tzinfo):
+            table.close()
+            raise ValueError(
+                f'Twilight table {path} was not created for this observer and timezone')
+        if self.table is not None:
+            self.table.close()
+        self.table = table
+        return table
+
+    def getUtcOffsets(self, start_date: date, end_date: Optional[date] = None) -> UtcOffsetIndex:
+        '''Return the UTC offset transitions of ``SiteTwilight.tzinfo`` for all dates
+        from start_date up to, but not including, end_date (default: start_date only).
+        The index is kept as ``SiteTwilight.utc_offsets``. When dates outside of it are
+        requested, it is extended to them, by at least ``OFFSET_HORIZON_DAYS`` days at the end.'''
+        end_date = start_date + timedelta(days=1) if end_date is None else end_date
+        offsets = self.utc_offsets
+        # Start a week early for the look-back of ``WeeklySchedule.iterEvents``.
+        if offsets is None or offsets.tzinfo is not self.tzinfo:
+            offsets = self.utc_offsets = UtcOffsetIndex(
+                self.tzinfo, start_date - timedelta(days=7),
+                max(end_date, start_date + timedelta(days=OFFSET_HORIZON_DAYS)))
+        elif not (offsets.start_date <= start_date and end_date <= offsets.end_date):
+            if end_date > offsets.end_date:
+                end_date = max(end_date, offsets.end_date + timedelta(days=OFFSET_HORIZON_DAYS))
+            offsets.extend(start_date - timedelta(days=7), end_date)
+        return offsets
+
+    def localize(self, event_date: date, event_time: time) -> datetime:
+        '''Return a timezone-aware datetime for a local date and time in ``SiteTwilight.tzinfo``.
+        A time that occurs twice when clocks are set back is the first occurrence, and a time
+        skipped when clocks are set forward is moved forward by the gap.'''
+        return self.getUtcOffsets(event_date).localize(datetime.combine(event_date, event_time))
+
+    def dstChangeDates(self, start_date: date, end_date: date) -> List[date]:
+        '''Return the dates from start_date up to, but not including, end_date
+        on which the UTC offset of ``SiteTwilight.tzinfo`` changes.'''
+        offsets = self.getUtcOffsets(start_date, end_date)
+        return [change_date for change_date in offsets.changeDates()
+                if start_date <= change_date < end_date]
+
+    def isDstChange(self, event_date: date) -> bool:
+        '''Return True if the UTC offset of ``SiteTwilight.tzinfo`` changes on a date.'''
+        return bool(self.dstChangeDates(event_date, event_date + timedelta(days=1)))
+
+    def cacheKey(self, event_date: date,
+                 direction: SunDirection = SunDirection.SETTING) -> Tuple:
+        '''Return the key of a date in ``SiteTwilight.cache``.'''
+        observer = self._observer
+        key = (observer.latitude, observer.longitude, observer.elevation,
+               event_date, self._tzinfo, self._backend)
+        return key if direction == SunDirection.SETTING else key + (direction,)
+
+    def getCivilTwilight(self, event_date: date = None,
+                         direction: SunDirection = SunDirection.SETTING) -> datetime:
+        '''Return the start of civil sunset on a given date,
+        or the end of civil sunrise for ``SunDirection.RISING``.
+        Default is today's date in the timezone ``SiteTwilight.tzinfo``.
+        Dates covered by ``SiteTwilight.table`` are read from the table,
+        and other results are memoized in ``SiteTwilight.cache``.'''
+        if event_date is None:
+            event_date = datetime.now(self.tzinfo).date()
+        if self.table is not None:
+            if direction == SunDirection.SETTING:
+                result = self.table.sunset(event_date)
+            else:
+                result = self.table.sunrise(event_date)
+            if result is not None:
+                if INSTRUMENTATION.enabled:
+                    INSTRUMENTATION.count('twilight_table_hits')
+                return result
+        key = self.cacheKey(event_date, direction)
+        result = self.cache.get(key)
+        if result is None:
+            if INSTRUMENTATION.enabled:
+                INSTRUMENTATION.count('twilight_cache_misses')
+            result = self.computeTwilight([event_date], direction)[0]
+            self.cache.put(key, result)
+        elif INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count('twilight_cache_hits')
+        return result
+
+    def storedTwilight(self, event_date: date,
+                       direction: SunDirection = SunDirection.SETTING) -> Optional[datetime]:
+        '''Return the sunset (or sunrise) of a date from ``SiteTwilight.table`` or
+        ``SiteTwilight.cache``, or `None` if it must be computed.'''
+        result = None
+        if self.table is not None:
+            result = (self.table.sunset(event_date) if direction == SunDirection.SETTING
+                      else self.table.sunrise(event_date))
+        if result is None:
+            result = self.cache.get(self.cacheKey(event_date, direction))
+        return result
+
+    def computeTwilight(self, dates: List[date],
+                        direction: SunDirection = SunDirection.SETTING) -> List[datetime]:
+        '''Compute the start of civil sunset (or the end of civil sunrise) on each of the given
+        dates with the selected backend.'''
+        if INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count('solar_computations', len(dates))
+            with INSTRUMENTATION.timer(STAGE_TWILIGHT):
+                return self._computeTwilightWith(dates, direction)
+        return self._computeTwilightWith(dates, direction)
+
+    def _computeTwilightWith(self, dates: List[date], direction: SunDirection) -> List[datetime]:
+        '''Dispatch ``SiteTwilight.computeTwilight`` to the selected backend.'''
+        if self.backend == BACKEND_NUMPY:
+            # Imported here so that NumPy is only needed when this backend is used.
+            from civilite import solar
+            offsets = self.getUtcOffsets(min(dates), max(dates) + timedelta(days=1))
+            return solar.civilTwilight(self.observer, dates, self.tzinfo, direction,
+                                       utc_offsets=offsets)
+        if self.backend == BACKEND_FAST and abs(self.observer.latitude) <= FAST_MAX_LATITUDE:
+            return self._interpolateTwilight(dates, direction)
+        return [self.exactTwilight(event_date, direction) for event_date in dates]
+
+    def computeTwilightPair(self, dates: List[date]) -> Tuple[List[datetime], List[datetime]]:
+        '''Compute both the end of civil sunrise and the start of civil sunset on each of the given
+        dates in one shared pass of the numpy backend.
+        Return a tuple of lists (sunrises, sunsets).'''
+        # Imported here so that NumPy is only needed when this backend is used.
+        from civilite import solar
+        if INSTRUMENTATION.enabled:
+            INSTRUMENTATION.count('solar_computations', 2 * len(dates))
+        with INSTRUMENTATION.timer(STAGE_TWILIGHT):
+            offsets = self.getUtcOffsets(min(dates), max(dates) + timedelta(days=1))
+            return solar.civilTwilightPair(self.observer, dates, self.tzinfo, utc_offsets=offsets)
+
+    def exactTwilight(self, event_date: date,
+                      direction: SunDirection = SunDirection.SETTING) -> datetime:
+        '''Compute the start of civil sunset (or the end of civil sunrise) on a date with astral,
+        in UTC, and convert it with ``SiteTwilight.utc_offsets``.'''
+        to_local = self.getUtcOffsets(event_date).toLocal
+        result = to_local(time_of_transit(self.observer, event_date, 90.0 + SUN_APPARENT_RADIUS,
+                                          direction).timestamp())
+        if result.date() != event_date:
+            # Like astral, retry on the neighboring UTC date when the local date does not match.
+            utc_date = event_date + timedelta(days=1 if result.date() < event_date else -1)
+            result = to_local(time_of_transit(self.observer, utc_date, 90.0 + SUN_APPARENT_RADIUS,
+                                              direction).timestamp())
+            if result.date() != event_date:
+                name = 'sunset' if direction == SunDirection.SETTING else 'sunrise'
+                raise ValueError(f'Unable to find a {name} time on the date specified')
+        return result
+
+    def _anchorTwilight(self, day_number: int,
+                        direction: SunDirection = SunDirection.SETTING) -> float:
+        '''Return the exact sunset (or sunrise) at an anchor date of the fast backend
+        in seconds after midnight UTC.'''
+        result = self._anchors.get((day_number, direction))
+        if result is None:
+            anchor_date = EPOCH_DATE + timedelta(days=day_number)
+            transit = time_of_transit(self.observer, anchor_date, 90.0 + SUN_APPARENT_RADIUS,
+                                      direction)
+            midnight = datetime.combine(anchor_date, time())
+            result = self._anchors[day_number, direction] = (
+                transit.replace(tzinfo=None) - midnight).total_seconds()
+        return result
+
+    def _interpolatedSeconds(self, day_number: int, direction: SunDirection,
+                             blocks: Dict[int, Optional[Tuple[float, ...]]]) -> Optional[float]:
+        '''Return the interpolated sunset (or sunrise) of a UTC date in UTC epoch seconds,
+        or `None` if the sun does not rise or set on one of its anchor dates.
+        The anchors of each block of ``FAST_ANCHOR_DAYS`` days are kept in blocks.'''
+        block = day_number // FAST_ANCHOR_DAYS
+        if block not in blocks:
+            first_anchor = (block - 1) * FAST_ANCHOR_DAYS
+            try:
+                blocks[block] = tuple(
+                    self._anchorTwilight(first_anchor + i * FAST_ANCHOR_DAYS, direction)
+                    for i in range(4))
+            except ValueError:
+                blocks[block] = None
+        values = blocks[block]
+        if values is None:
+            return None
+        weights = _FAST_WEIGHTS[day_number % FAST_ANCHOR_DAYS]
+        return (weights[0] * values[0] + weights[1] * values[1] + weights[2] * values[2] +
+                weights[3] * values[3] + day_number * 86400.0)
+
+    def _interpolateTwilight(self, dates: List[date],
+                             direction: SunDirection = SunDirection.SETTING) -> List[datetime]:
+        '''Interpolate the start of civil sunset (or the end of civil sunrise) on each of the given
+        dates from the four surrounding anchor dates with a cubic polynomial. The anchors are looked
+        up once per block of ``FAST_ANCHOR_DAYS`` days, and the UTC offset only when twilight
+        leaves the segment of the previous date.
+        Falls back to the exact computation where ``FAST_MAX_ERROR`` says it must.'''
+        offsets = self.getUtcOffsets(min(dates), max(dates) + timedelta(days=1))
+        result = []
+        # The UTC offset segment of the previous twilight, see ``UtcOffsetIndex.segmentAt``.
+        segment = offsets.segmentAt(offsets.start)
+        # Key: block, value: its anchors, see ``SiteTwilight._interpolatedSeconds``.
+        blocks: Dict[int, Optional[Tuple[float, ...]]] = {}
+        # Like ``SiteTwilight.exactTwilight``, twilight on a local date may fall on the
+        # neighboring UTC date, e.g. sunrises east of Greenwich. The shift from the local date to
+        # that UTC date is kept for the following dates.
+        shift = 0
+        for event_date in dates:
+            local_day = (event_date - EPOCH_DATE).days
+            local_time = None
+            for _ in range(2):
+                seconds = self._interpolatedSeconds(local_day + shift, direction, blocks)
+                if seconds is None:
+                    break
+                if not segment[0] <= seconds < segment[1]:
+                    segment = offsets.segmentAt(seconds)
+                found_day = int((seconds + segment[2]) // 86400.0)
+                if found_day == local_day:
+                    # A change of the UTC offset since the previous twilight marks a DST change day.
+                    if segment[0] <= seconds - 86400.0:
+                        local_time = (_EPOCH + timedelta(seconds=seconds + segment[2])).replace(
+                            tzinfo=segment[3])
+                    break
+                shift += 1 if found_day < local_day else -1
+            if local_time is None:
+                if INSTRUMENTATION.enabled:
+                    INSTRUMENTATION.count('fast_exact_fallbacks')
+                local_time = self.exactTwilight(event_date, direction)
+            result.append(local_time)
+        return result
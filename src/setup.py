@@ -49,12 +49,20 @@ setup(
     author_email=__author_email__,
     url=__url__,
     license=__license__,
-    python_requires=">=3.6, ",
+    python_requires=">=3.7, ",
     install_requires=[
         'astral>=2.1',
         'pytz>=2019.3',
         'reportlab>=3.5.42',
     ],
+    entry_points={
+        'console_scripts': ['civilite=civilite.cli:main'],
+    },
+    extras_require={
+        'http': ['requests>=2.23.0'],
+        'numpy': ['numpy>=1.18'],
+        'parquet': ['pyarrow>=1.0'],
+    },
     project_urls={
         'Documentation': '',
         'Source': __url__,
@@ -67,7 +75,6 @@ setup(
         'Operating System :: POSIX :: Linux',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7'
     ],
 )
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.batch'''
+
+# Builtins
+import calendar
+import pickle
+from datetime import date, time
+
+# 3rd party
+import pytz
+from astral import Observer
+
+# Our stuff
+from civilite import batch, schedule
+
+
+class TestBatch:
+    '''Test suite for multi-site batch planning.'''
+
+    def test_plan_sites(self):
+        '''Verify that pooled and serial planning agree with planning each site directly.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        other_site = (Observer(47.6, -122.3, 50), pytz.timezone('US/Pacific'),
+                      {calendar.MONDAY: schedule.ScheduleEvent(time(17, 0), time(20, 0))})
+        years = range(2021, 2023)
+        progress = []
+        pooled = batch.planSites(
+            [hop_schedule, other_site], years, max_workers=2,
+            progress=lambda completed, total: progress.append((completed, total)))
+        serial = batch.planSites([hop_schedule, other_site], years, max_workers=1)
+        assert progress == [(1, 2), (2, 2)]
+        assert pooled == serial
+        assert set(pooled[0]) == {2021, 2022}
+        assert pooled[0][2021] == hop_schedule.createColumns(date(2021, 1, 1), date(2022, 1, 1))
+        for evt_date, (sunset_time, *etc) in hop_schedule.createEvents(2021).items():
+            other_sunset, *other_etc = pooled[0][2021][evt_date]
+            assert abs((sunset_time - other_sunset).total_seconds()) <= 0.5
+            assert etc == other_etc
+        assert pooled[1][2022][date(2022, 7, 1)][0].tzinfo.zone == 'US/Pacific'
+
+    def test_pickled_columns(self):
+        '''Verify that a slice of columns survives pickling with its records.'''
+        columns = schedule.getCurrentSchedule().createColumns(date(2021, 1, 1), date(2022, 1, 1))
+        part = columns[date(2021, 3, 3):date(2021, 5, 1)]
+        copy = pickle.loads(pickle.dumps(part))
+        assert copy == part
+        assert (copy.start_date, copy.tzinfo, len(copy)) == (part.start_date, part.tzinfo, 59)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.cli'''
+
+# Builtins
+import io
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime, time
+
+# 3rd party
+import pytest
+import pytz
+from astral import Observer
+
+# Our stuff
+from civilite import cli, export, loader, schedule
+from civilite.results import TransitionIndex
+
+CALENDAR = '''BEGIN:VCALENDAR\r
+BEGIN:VEVENT\r
+DTSTART;TZID=America/Los_Angeles:20210104T170000\r
+DTEND;TZID=America/Los_Angeles:20210104T200000\r
+RRULE:FREQ=WEEKLY;BYDAY=MO\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+
+class TestCli:
+    '''Test suite for the command line interface.'''
+
+    @pytest.fixture(autouse=True)
+    def planCacheDirectory(self, tmp_path, monkeypatch):
+        '''Keep the plan cache of the commands in a temporary directory.'''
+        monkeypatch.setenv('CIVILITE_CACHE_DIR', str(tmp_path / 'plans'))
+
+    def test_plan_and_state_at(self, tmp_path, capsys):
+        '''Verify that state-at answers from a saved plan like the schedule itself.'''
+        plan_path = str(tmp_path / 'plan.json')
+        assert cli.main(['plan', '2021', '--plan', plan_path]) == 0
+        hop_schedule = schedule.getCurrentSchedule()
+        transitions = TransitionIndex.load(plan_path)
+        assert transitions.start == hop_schedule.twilight.localize(date(2021, 1, 1), time())
+        capsys.readouterr()
+        for when in ('2021-03-02T19:00:00-05:00', '2021-06-01T21:30:00-04:00',
+                     '2021-12-31T23:00:00-05:00'):
+            cli.main(['state-at', when, '--plan', plan_path])
+            instant = datetime.fromisoformat(when)
+            expected = 'ON' if hop_schedule.stateAt(instant) else 'OFF'
+            expected += f' until {hop_schedule.nextTransition(instant)[0].isoformat()}'
+            assert capsys.readouterr().out.strip() == expected
+
+    def test_state_at_lazy_imports(self, tmp_path):
+        '''Verify that state-at with a plan file does not import the solar and timezone
+        libraries.'''
+        plan_path = str(tmp_path / 'plan.json')
+        cli.main(['plan', '2021', '--plan', plan_path])
+        code = ('import sys; from civilite import cli; '
+                f'cli.main(["state-at", "2021-06-01T20:00", "--plan", {plan_path!r}]); '
+                'print(sorted({"astral", "pytz", "reportlab", "numpy"} & set(sys.modules)))')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                check=True, env=env)
+        assert output.stdout.splitlines()[-1] == '[]'
+
+    def test_metrics(self, tmp_path, capsys):
+        '''Verify that --metrics prints the instrumentation snapshot and leaves instrumentation
+        disabled.'''
+        output = str(tmp_path / 'program.csv')
+        assert cli.main(['--metrics', 'program', '2021', '--output', output]) == 0
+        snapshot = json.loads(capsys.readouterr().err)
+        assert snapshot['counters']['days_classified'] > 0
+        assert snapshot['timers']['export']['calls'] == 1
+        assert not schedule.INSTRUMENTATION.enabled
+        schedule.INSTRUMENTATION.reset()
+
+    def test_calendar_site(self, tmp_path, capsys):
+        '''Verify that a site given by an iCalendar file, a location and a timezone replaces
+            the built-in schedule.'''
+        calendar_path = tmp_path / 'site.ics'
+        calendar_path.write_text(CALENDAR, encoding='utf-8')
+        assert cli.main(['--calendar', str(calendar_path), '--latitude', '47.6',
+                         '--longitude', '-122.3', '--elevation', '50', '--timezone', 'US/Pacific',
+                         'export', '2021']) == 0
+        tzinfo = pytz.timezone('US/Pacific')
+        site_schedule = loader.buildSchedule(Observer(47.6, -122.3, 50), tzinfo,
+                                             loader.parseCalendar(CALENDAR, tzinfo))
+        expected = io.StringIO()
+        export.exportSchedules(site_schedule, [2021], expected)
+        assert capsys.readouterr().out == expected.getvalue()
+        with pytest.raises(SystemExit):
+            cli.main(['--latitude', '47.6', 'export', '2021'])
+
+    def test_plan_cache(self, tmp_path, capsys):
+        '''Verify that exports use the plan cache unless --no-cache is given.'''
+        cache_path = tmp_path / 'plans'
+        assert cli.main(['--no-cache', 'export', '2021']) == 0
+        expected = capsys.readouterr().out
+        assert not cache_path.exists()
+        for _ in range(2):
+            assert cli.main(['export', '2021']) == 0
+            assert capsys.readouterr().out == expected
+        assert len(os.listdir(str(cache_path))) == 1
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.controller'''
+
+# Builtins
+import asyncio
+import calendar
+import heapq
+import logging
+from datetime import datetime, time, timedelta
+
+# Our stuff
+from civilite import controller, schedule
+
+
+class FakeClock:
+    '''A clock whose time jumps to the earliest pending wake-up once all tasks are waiting.'''
+
+    def __init__(self, start: datetime) -> None:
+        self.current = start
+        self.sleeps = 0
+        self._sleepers = []
+
+    def now(self) -> datetime:
+        '''Return the current time of the clock.'''
+        return self.current
+
+    async def sleep(self, seconds: float) -> None:
+        '''Wait until the clock reaches the wake-up time, seconds from now.'''
+        self.sleeps += 1
+        waker = asyncio.get_running_loop().create_future()
+        wake_time = self.current + timedelta(seconds=seconds)
+        heapq.heappush(self._sleepers, (wake_time, self.sleeps, waker))
+        await waker
+
+    async def advance(self, stop: datetime, on_stop) -> None:
+        '''Advance time until the stop instant, then call on_stop.'''
+        while True:
+            # let every other task run until it waits on the clock again
+            for _ in range(20):
+                await asyncio.sleep(0)
+            while self._sleepers and self._sleepers[0][2].done():
+                heapq.heappop(self._sleepers)
+            if not self._sleepers:
+                continue
+            wake_up, _, waker = heapq.heappop(self._sleepers)
+            if wake_up >= stop:
+                on_stop()
+                return
+            self.current = max(self.current, wake_up)
+            waker.set_result(None)
+
+
+class TestController:
+    '''Test suite for the asyncio lighting controller.'''
+
+    def _run(self, start, stop, zones):
+        '''Run a controller with a fake clock and return the recorded output changes.'''
+        changes = []
+
+        async def output(zone_name, state, when):
+            changes.append((zone_name, state, when))
+
+        async def main():
+            await asyncio.gather(lighting.run(), clock.advance(stop, lighting.stop))
+
+        clock = FakeClock(start)
+        lighting = controller.LightingController(clock, max_sleep=3600.0)
+        for name, zone_schedule in zones:
+            lighting.addZone(name, zone_schedule, output)
+        asyncio.run(main())
+        return changes, lighting
+
+    def test_transitions(self):
+        '''Verify that outputs switch exactly at the transitions of each zone.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        local_tz = hop_schedule.tzinfo
+        other_schedule = schedule.WeeklySchedule(hop_schedule.observer, local_tz)
+        other_schedule.addEvent(calendar.WEDNESDAY,
+                                schedule.ScheduleEvent(time(20, 0), time(23, 0)))
+        start = local_tz.localize(datetime(2020, 12, 1, 12, 0))
+        changes, lighting = self._run(start, start + timedelta(days=1, hours=12),
+                                      [('lot', hop_schedule), ('field', other_schedule)])
+        assert sorted(changes, key=lambda change: (change[2], change[0])) == [
+            ('field', False, start),
+            ('lot', False, start),
+            ('lot', True, local_tz.localize(datetime(2020, 12, 1, 18, 30))),
+            ('lot', False, local_tz.localize(datetime(2020, 12, 1, 22, 0))),
+            ('lot', True, local_tz.localize(datetime(2020, 12, 2, 18, 45))),
+            ('field', True, local_tz.localize(datetime(2020, 12, 2, 20, 0))),
+            ('lot', False, local_tz.localize(datetime(2020, 12, 2, 21, 0))),
+            ('field', False, local_tz.localize(datetime(2020, 12, 2, 23, 0))),
+        ]
+        # sleeps are driven by transitions, midnight and the longest sleep, not by polling
+        assert lighting.clock.sleeps < 100
+
+    def test_failing_output(self, caplog):
+        '''Verify that an output that raises is logged and stops neither its zone,
+            nor the other outputs of the zone, nor the other zones.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        local_tz = hop_schedule.tzinfo
+        start = local_tz.localize(datetime(2020, 12, 1, 12, 0))
+        changes = []
+
+        async def output(zone_name, state, when):
+            changes.append((zone_name, state, when))
+
+        async def broken(_zone_name, _state, _when):
+            raise OSError('relay unreachable')
+
+        async def main():
+            await asyncio.gather(lighting.run(), clock.advance(start + timedelta(days=1),
+                                                               lighting.stop))
+
+        clock = FakeClock(start)
+        lighting = controller.LightingController(clock, max_sleep=3600.0)
+        lighting.addZone('lot', hop_schedule, broken, output)
+        lighting.addZone('field', schedule.getCurrentSchedule(), output)
+        with caplog.at_level(logging.ERROR, logger=controller.LOGGER.name):
+            asyncio.run(main())
+        for zone_name in ('lot', 'field'):
+            assert [change[1:] for change in changes if change[0] == zone_name] == [
+                (False, start),
+                (True, local_tz.localize(datetime(2020, 12, 1, 18, 30))),
+                (False, local_tz.localize(datetime(2020, 12, 1, 22, 0)))]
+        assert len(caplog.records) == 3
+        assert 'relay unreachable' in caplog.text
+
+    def test_dst_change(self):
+        '''Verify that a FIXED event on the day after a DST change switches at local time.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        local_tz = hop_schedule.tzinfo
+        # DST ended on Sunday 2020-11-01; the Tuesday event after it is FIXED
+        start = local_tz.localize(datetime(2020, 10, 31, 12, 0))
+        changes, _ = self._run(start, start + timedelta(days=4), [('lot', hop_schedule)])
+        assert ('lot', True, local_tz.localize(datetime(2020, 11, 3, 18, 30))) in changes
+
+    def test_update_schedule(self):
+        '''Verify that a schedule edited while running takes effect without waiting for midnight.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        local_tz = hop_schedule.tzinfo
+        start = local_tz.localize(datetime(2020, 12, 3, 12, 0))
+        changes = []
+
+        async def output(_zone_name, state, when):
+            changes.append((state, when))
+
+        async def edit():
+            await clock.sleep(3600.0)
+            hop_schedule.addEvent(calendar.THURSDAY,
+                                  schedule.ScheduleEvent(time(17, 0), time(18, 0)))
+            lighting.updateSchedule('lot')
+
+        async def main():
+            await asyncio.gather(lighting.run(), edit(),
+                                 clock.advance(start + timedelta(hours=8), lighting.stop))
+
+        clock = FakeClock(start)
+        lighting = controller.LightingController(clock, max_sleep=86400.0)
+        lighting.addZone('lot', hop_schedule, output)
+        asyncio.run(main())
+        assert changes == [(False, start),
+                           (True, local_tz.localize(datetime(2020, 12, 3, 17, 0))),
+                           (False, local_tz.localize(datetime(2020, 12, 3, 18, 0)))]
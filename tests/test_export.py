@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.export'''
+
+# Builtins
+import calendar
+import io
+import json
+from datetime import date, time
+
+# 3rd party
+import pytest
+
+# Our stuff
+from civilite import export, results, schedule
+
+
+class TestExport:
+    '''Test suite for the streaming exporters.'''
+
+    def test_csv_matches_events(self):
+        '''Verify that CSV rows match createEvents, independently of the batch size.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        outputs = []
+        for batch_size in (1, 10, export.EXPORT_BATCH_SIZE):
+            out_file = io.StringIO()
+            records = export.iterRecords(hop_schedule, date(2021, 1, 1), date(2022, 1, 1))
+            assert export.exportRecords(records, out_file, batch_size=batch_size) == 365
+            outputs.append(out_file.getvalue())
+        assert outputs[0] == outputs[1] == outputs[2]
+        lines = outputs[0].splitlines()
+        assert lines[0] == '"Weekday","Date","Sunset","Event Type","Event Change?"'
+        sunset_time, evt_type, evt_changed = hop_schedule.createEvents(2021)[date(2021, 1, 1)]
+        assert lines[1] == (f'"Fri",2021-01-01,{sunset_time:%H:%M:%S},'
+                            f'"{results.EVENT_TYPES[evt_type]}",{"*" if evt_changed else ""}')
+
+    def test_multi_site_jsonl(self):
+        '''Verify that JSON Lines export of many sites and years writes one object per site
+        and day.'''
+        sites = {'north': schedule.getCurrentSchedule(), 'south': schedule.getCurrentSchedule()}
+        out_file = io.StringIO()
+        count = export.exportSchedules(sites, [2020, 2021], out_file, export.FORMAT_JSONL,
+                                       batch_size=100)
+        assert count == 2 * 731
+        rows = [json.loads(line) for line in out_file.getvalue().splitlines()]
+        assert {row['site'] for row in rows} == {'north', 'south'}
+        assert rows[0]['date'] == '2020-01-01'
+        assert rows[0]['sunset'].startswith('2020-01-01T16:')
+
+    def test_clock_plan(self):
+        '''Verify that the clock program is written as one CSV row per segment.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        segments = hop_schedule.createClockPlan(date(2021, 1, 1), date(2022, 1, 1))
+        out_file = io.StringIO()
+        assert export.exportClockPlan(segments, out_file) == len(segments)
+        lines = out_file.getvalue().splitlines()
+        assert lines[0] == '"Weekday","Event Type","First Date","Last Date","Weeks","ON","OFF"'
+        assert '"Tue","SUNSET",' in out_file.getvalue()
+        assert '"SUNSET","22:00"' in out_file.getvalue()
+        assert len(lines) == len(segments) + 1
+
+    def test_clock_plan_sunrise(self):
+        '''Verify that lights turning OFF at sunrise are written as SUNRISE.'''
+        morning_schedule = schedule.getCurrentSchedule()
+        morning_schedule.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(6, 0), time(8, 0)))
+        out_file = io.StringIO()
+        segments = morning_schedule.createClockPlan(date(2021, 1, 1), date(2021, 2, 1))
+        export.exportClockPlan(segments, out_file)
+        assert (out_file.getvalue().splitlines()[1] ==
+                '"Mon","SUNRISE",2021-01-04,2021-01-25,4,"06:00","SUNRISE"')
+
+    def test_parquet(self, tmp_path):
+        '''Verify that Parquet rows match createEvents with sunsets in UTC and their offsets.'''
+        parquet = pytest.importorskip('pyarrow.parquet')
+        hop_schedule = schedule.getCurrentSchedule()
+        out_path = str(tmp_path / 'hop.parquet')
+        records = export.iterRecords(hop_schedule, date(2021, 1, 1), date(2022, 1, 1))
+        assert export.exportRecords(records, out_path, export.FORMAT_PARQUET, batch_size=100) == 365
+        parquet_file = parquet.ParquetFile(out_path)
+        assert parquet_file.metadata.num_row_groups == 4
+        rows = parquet_file.read().to_pylist()
+        events = hop_schedule.createEvents(2021)
+        assert [row['date'] for row in rows] == sorted(events)
+        for row in rows:
+            sunset_time, evt_type, evt_changed = events[row['date']]
+            assert row['sunset'] == sunset_time.replace(microsecond=0)
+            assert row['utc_offset'] == sunset_time.utcoffset().total_seconds()
+            assert (row['site'], row['event_type'], row['changed']) == (
+                None, results.EVENT_TYPES.get(evt_type), evt_changed)
+
+    def test_text_encoding(self, tmp_path):
+        '''Verify that exports to a path are UTF-8 whatever the locale, with site names
+            outside of ASCII.'''
+        out_path = tmp_path / 'sites.csv'
+        sites = {'Zürich': schedule.getCurrentSchedule()}
+        export.exportSchedules(sites, [2021], str(out_path))
+        assert out_path.read_bytes().splitlines()[1].startswith('"Zürich",'.encode('utf-8'))
+
+    def test_unknown_format(self):
+        '''Verify that an unknown format is rejected.'''
+        with pytest.raises(ValueError):
+            export.exportRecords([], io.StringIO(), 'xlsx')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.instrumentation'''
+
+# Builtins
+import calendar
+import json
+from datetime import date, time, timedelta
+from time import perf_counter
+
+# Our stuff
+from civilite import export, render, schedule
+from civilite.instrumentation import (INSTRUMENTATION, STAGE_CLASSIFY, STAGE_EXPORT, STAGE_RENDER,
+                                      STAGE_TWILIGHT)
+
+
+class TestInstrumentation:
+    '''Test suite for the opt-in instrumentation.'''
+
+    def test_counters_and_hooks(self):
+        '''Verify counters, stage timers and hooks while enabled, and that nothing is recorded
+        while disabled.'''
+        instrumentation = INSTRUMENTATION
+        stages = []
+
+        def hook(stage, _seconds):
+            stages.append(stage)
+
+        instrumentation.reset()
+        instrumentation.addHook(hook)
+        try:
+            schedule.getCurrentSchedule().createEvents(2021)
+            assert instrumentation.snapshot() == {'counters': {}, 'timers': {}}
+
+            instrumentation.enable()
+            hop_schedule = schedule.getCurrentSchedule()
+            hop_schedule.createEvents(2021)
+            hop_schedule.createEvents(2021)
+            hop_schedule.getCivilTwilight(date(2021, 6, 1))
+            with instrumentation.timer(STAGE_EXPORT):
+                pass
+        finally:
+            instrumentation.enable(False)
+            instrumentation.removeHook(hook)
+        snapshot = instrumentation.snapshot()
+        instrumentation.reset()
+        # The week before the year is classified as well, for the "event type changed" flags.
+        num_classified = sum(bool(hop_schedule.getEvents(date(2020, 12, 25) + timedelta(days=i)))
+                             for i in range(7 + 365))
+        assert snapshot['counters']['days_classified'] == num_classified
+        counters = snapshot['counters']
+        assert counters['plan_cache_misses'] == counters['plan_cache_hits'] == 1
+        assert snapshot['counters']['twilight_cache_hits'] >= 1
+        assert snapshot['timers'][STAGE_CLASSIFY]['calls'] == num_classified
+        assert snapshot['timers'][STAGE_EXPORT]['calls'] == 1
+        assert stages.count(STAGE_CLASSIFY) == num_classified
+        assert STAGE_EXPORT in stages
+        json.dumps(snapshot)
+
+    def test_solar_computations(self):
+        '''Verify that twilight computed by a backend is counted and timed.'''
+        instrumentation = INSTRUMENTATION
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            schedule.getCurrentSchedule().getCivilTwilight(date(2021, 6, 1))
+        finally:
+            instrumentation.enable(False)
+        snapshot = instrumentation.snapshot()
+        instrumentation.reset()
+        assert snapshot['counters'] == {'twilight_cache_misses': 1, 'solar_computations': 1}
+        assert snapshot['timers'][STAGE_TWILIGHT]['calls'] == 1
+
+    def test_stage_totals(self, tmp_path):
+        '''Verify that no stage is timed within another one: the stage totals of an export
+            and a render do not add up to more than their wall time.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        curr_schedule.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(6, 0), time(8, 0)))
+        INSTRUMENTATION.reset()
+        INSTRUMENTATION.enable()
+        start = perf_counter()
+        try:
+            export.exportSchedules(curr_schedule, [2020, 2021], str(tmp_path / 'events.csv'),
+                                   batch_size=100)
+            render.renderCalendar(curr_schedule, 2022)
+        finally:
+            wall_time = perf_counter() - start
+            INSTRUMENTATION.enable(False)
+        timers = INSTRUMENTATION.snapshot()['timers']
+        INSTRUMENTATION.reset()
+        assert {STAGE_TWILIGHT, STAGE_CLASSIFY, STAGE_EXPORT, STAGE_RENDER} <= set(timers)
+        # one call per batch of records
+        assert timers[STAGE_EXPORT]['calls'] >= 731 // 100
+        assert sum(timer['seconds'] for timer in timers.values()) <= wall_time
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.loader'''
+
+# Builtins
+import threading
+from datetime import date, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 3rd party
+import pytest
+import pytz
+
+# Our stuff
+from civilite import loader, schedule
+
+CALENDAR = '''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+SUMMARY:Sunday service\r
+DTSTART;TZID=America/New_York:20200105T164500\r
+DTEND;TZID=America/New_York:20200105T190000\r
+RRULE:FREQ=WEEKLY;BYDAY=SU\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:Midweek\r
+ meetings\r
+DTSTART:20200107T233000Z\r
+DURATION:PT3H30M\r
+RRULE:FREQ=WEEKLY;BYDAY=TU\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:Concert\r
+DTSTART:20201224T220000\r
+DTEND:20201225T010000\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:Holiday\r
+DTSTART;VALUE=DATE:20201225\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+BOUNDED_CALENDAR = '''BEGIN:VCALENDAR\r
+BEGIN:VEVENT\r
+DTSTART;TZID=America/New_York:20151216T190000\r
+DTEND;TZID=America/New_York:20151216T210000\r
+RRULE:FREQ=WEEKLY;UNTIL=20151231\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+DTSTART:20200106T230000Z\r
+DURATION:PT2H\r
+RRULE:FREQ=WEEKLY;BYDAY=MO,TH;COUNT=3\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+DTSTART:20200301T180000\r
+DTEND:20200301T200000\r
+RRULE:FREQ=DAILY;INTERVAL=2;UNTIL=20200309T180000\r
+EXDATE:20200303T180000\r
+EXDATE;VALUE=DATE:20200305,20200307\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+
+class CalendarHandler(BaseHTTPRequestHandler):
+    '''Serves CALENDAR with an ETag, answering conditional requests with 304.'''
+    etag = '"v1"'
+    requests = 0
+
+    def do_GET(self):
+        '''Serve CALENDAR, or 304 if the request's ETag matches.'''
+        CalendarHandler.requests += 1
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = CALENDAR.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'text/calendar')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def calendar_url():
+    '''A local HTTP server serving CALENDAR.'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CalendarHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/calendar.ics'
+    server.shutdown()
+    server.server_close()
+
+
+class TestLoader:
+    '''Test suite for loading occupancy schedules from iCalendar sources.'''
+
+    def test_parse(self):
+        '''Verify recurring, UTC, midnight-spanning and all-day events.'''
+        events = loader.parseCalendar(CALENDAR, pytz.timezone('US/Eastern'))
+        assert sorted(events, key=str) == sorted([
+            (6, time(16, 45), time(19, 0)),
+            # 23:30 UTC on Tuesday is 18:30 EST on Tuesday
+            (1, time(18, 30), time(22, 0)),
+            (date(2020, 12, 24), time(22, 0), time(23, 59, 59)),
+            (date(2020, 12, 25), time(0, 0), time(1, 0)),
+        ], key=str)
+
+    def test_bounded_rules(self):
+        '''Verify that rules with UNTIL or COUNT become events on their dates, without the
+        dates of EXDATE.'''
+        events = loader.parseCalendar(BOUNDED_CALENDAR, pytz.timezone('US/Eastern'))
+        assert events == [
+            (date(2015, 12, 16), time(19, 0), time(21, 0)),
+            (date(2015, 12, 23), time(19, 0), time(21, 0)),
+            (date(2015, 12, 30), time(19, 0), time(21, 0)),
+            # 23:00 UTC is 18:00 EST
+            (date(2020, 1, 6), time(18, 0), time(20, 0)),
+            (date(2020, 1, 9), time(18, 0), time(20, 0)),
+            (date(2020, 1, 13), time(18, 0), time(20, 0)),
+            (date(2020, 3, 1), time(18, 0), time(20, 0)),
+            (date(2020, 3, 9), time(18, 0), time(20, 0)),
+        ]
+        hop_schedule = schedule.getCurrentSchedule()
+        bounded_schedule = loader.buildSchedule(hop_schedule.observer, hop_schedule.tzinfo, events)
+        assert bounded_schedule.events == {}
+        assert bounded_schedule.getEventType(date(2016, 1, 6)) is None
+
+    def test_http_cache(self, calendar_url, tmp_path):
+        '''Verify that unchanged calendars are neither downloaded nor parsed again, even by a
+        new loader.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        sites = {name: (hop_schedule.observer, hop_schedule.tzinfo, calendar_url)
+                 for name in ('north', 'south')}
+        with loader.CalendarLoader(str(tmp_path)) as calendar_loader:
+            schedules = calendar_loader.loadSchedules(sites)
+            assert calendar_loader.parsed >= 1 and calendar_loader.downloads == 2
+        assert schedules['north'].events[6] == [schedule.ScheduleEvent(time(16, 45), time(19, 0))]
+        assert (schedules['south'].getEventType(date(2020, 12, 1)) ==
+                hop_schedule.getEventType(date(2020, 12, 1)))
+        with loader.CalendarLoader(str(tmp_path)) as calendar_loader:
+            calendar_loader.loadSchedules(sites)
+            assert (calendar_loader.downloads, calendar_loader.not_modified,
+                    calendar_loader.parsed) == (0, 2, 0)
+
+    def test_file_cache(self, tmp_path):
+        '''Verify that an unchanged file is not read again and a changed one is.'''
+        path = tmp_path / 'calendar.ics'
+        path.write_text(CALENDAR)
+        calendar_loader = loader.CalendarLoader(str(tmp_path / 'cache'))
+        tzinfo = pytz.timezone('US/Eastern')
+        first = calendar_loader.loadEvents(str(path), tzinfo)
+        assert calendar_loader.loadEvents(str(path), tzinfo) == first
+        assert (calendar_loader.parsed, calendar_loader.not_modified) == (1, 1)
+        path.write_text(CALENDAR.replace('BYDAY=SU', 'BYDAY=SA'))
+        assert (5, time(16, 45), time(19, 0)) in calendar_loader.loadEvents(str(path), tzinfo)
+        assert calendar_loader.parsed == 2
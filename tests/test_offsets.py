@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.offsets'''
+
+# Builtins
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# 3rd party
+import pytz
+
+# Our stuff
+from civilite import schedule
+from civilite.offsets import UtcOffsetIndex
+
+
+class TestUtcOffsetIndex:
+    '''Test suite for the UTC offset transition index.'''
+
+    def test_to_local(self):
+        '''Verify that conversions from UTC match the timezone itself, for pytz and zoneinfo.'''
+        for tzinfo in (pytz.timezone('US/Eastern'), ZoneInfo('Australia/Lord_Howe'), pytz.utc):
+            offsets = UtcOffsetIndex(tzinfo, date(2021, 1, 1), date(2022, 1, 1))
+            start = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+            for seconds in range(int(start), int(start) + 366 * 86400, 1777):
+                expected = datetime.fromtimestamp(seconds, timezone.utc).astimezone(tzinfo)
+                result = offsets.toLocal(seconds)
+                assert (result, result.utcoffset(), result.replace(tzinfo=None)) == \
+                    (expected, expected.utcoffset(), expected.replace(tzinfo=None))
+
+    def test_localize(self):
+        '''Verify that local times are resolved like PEP 495 with fold=0, for pytz timezones too.'''
+        zone = ZoneInfo('US/Eastern')
+        for tzinfo in (pytz.timezone('US/Eastern'), zone):
+            offsets = UtcOffsetIndex(tzinfo, date(2021, 1, 1), date(2022, 1, 1))
+            naive = datetime(2021, 1, 1)
+            while naive.year == 2021:
+                assert offsets.localize(naive).timestamp() == naive.replace(tzinfo=zone).timestamp()
+                naive += timedelta(minutes=15)
+        offsets = UtcOffsetIndex(pytz.timezone('US/Eastern'), date(2021, 1, 1), date(2022, 1, 1))
+        # Repeated: the first occurrence. Skipped: moved forward by the gap.
+        assert (offsets.localize(datetime(2021, 11, 7, 1, 30)).isoformat() ==
+                '2021-11-07T01:30:00-04:00')
+        assert (offsets.localize(datetime(2021, 3, 14, 2, 30)).isoformat() ==
+                '2021-03-14T03:30:00-04:00')
+
+    def test_dst_change_dates(self):
+        '''Verify the DST change days of a schedule.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        assert (curr_schedule.twilight.dstChangeDates(date(2021, 1, 1), date(2022, 1, 1)) ==
+                [date(2021, 3, 14), date(2021, 11, 7)])
+        assert curr_schedule.twilight.isDstChange(date(2030, 3, 10))
+        assert not curr_schedule.twilight.isDstChange(date(2030, 3, 11))
+        utc_schedule = schedule.WeeklySchedule(curr_schedule.observer)
+        assert utc_schedule.twilight.dstChangeDates(date(2021, 1, 1), date(2022, 1, 1)) == []
+
+    def test_extend(self):
+        '''Verify that an extended index equals one built for the whole span, and that
+        a schedule extends its index instead of replacing it.'''
+        for tzinfo in (pytz.timezone('US/Eastern'), ZoneInfo('Australia/Lord_Howe')):
+            offsets = UtcOffsetIndex(tzinfo, date(2021, 3, 1), date(2021, 9, 1))
+            offsets.extend(date(2019, 11, 3), date(2024, 1, 1))
+            expected = UtcOffsetIndex(tzinfo, date(2019, 11, 3), date(2024, 1, 1))
+            assert (offsets.start, offsets.end) == (expected.start, expected.end)
+            assert list(offsets.times) == list(expected.times)
+            assert list(offsets.offsets) == list(expected.offsets)
+            assert offsets.changeDates() == expected.changeDates()
+        curr_schedule = schedule.getCurrentSchedule()
+        offsets = curr_schedule.twilight.getUtcOffsets(date(2021, 1, 1))
+        assert curr_schedule.twilight.getUtcOffsets(date(2030, 3, 10)) is offsets
+        assert curr_schedule.twilight.getUtcOffsets(date(2020, 6, 1)) is offsets
+        assert offsets.start_date <= date(2020, 6, 1) and date(2030, 3, 11) <= offsets.end_date
+        assert curr_schedule.twilight.dstChangeDates(date(2021, 1, 1), date(2022, 1, 1)) == [
+            date(2021, 3, 14), date(2021, 11, 7)]
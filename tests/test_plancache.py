@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.plancache'''
+
+# Builtins
+import calendar
+import io
+import os
+from datetime import date, time
+
+# Our stuff
+from civilite import export, plancache, schedule, tables, twilight
+
+
+def cachedSchedule(path) -> schedule.WeeklySchedule:
+    '''Return the HoP schedule with a plan cache in a directory.'''
+    result = schedule.getCurrentSchedule()
+    result.plan_cache = plancache.PlanCache(str(path))
+    return result
+
+
+class TestPlanCache:
+    '''Test suite for the persistent plan cache.'''
+
+    def test_content_hash(self):
+        '''Verify that the content hash depends on the events but not on the order they were
+        added in.'''
+        first = schedule.getCurrentSchedule()
+        second = schedule.getCurrentSchedule()
+        assert first.contentHash() == second.contentHash()
+        first.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(6, 0), time(7, 0)))
+        first.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(19, 0), time(20, 0)))
+        assert first.contentHash() != second.contentHash()
+        second.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(19, 0), time(20, 0)))
+        second.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(6, 0), time(7, 0)))
+        assert first.contentHash() == second.contentHash()
+        second.backend = twilight.BACKEND_FAST
+        assert first.contentHash() != second.contentHash()
+        assert plancache.planKey(first, 2021) != plancache.planKey(first, 2022)
+
+    def test_planned_transitions(self, tmp_path):
+        '''Verify that transitions and clock plans built from a plan loaded from the cache
+            equal the computed ones.'''
+        cachedSchedule(tmp_path).createEvents(2021)
+        loaded = cachedSchedule(tmp_path)
+        loaded.createEvents(2021)
+        assert loaded.plan_cache.hits == 1
+        computed = schedule.getCurrentSchedule()
+        start_date, end_date = date(2021, 1, 1), date(2022, 1, 8)
+        transitions = loaded.buildTransitions(start_date, end_date)
+        expected = computed.buildTransitions(start_date, end_date)
+        assert (transitions.times, transitions.states) == (expected.times, expected.states)
+        assert (loaded.createClockPlan(start_date, end_date) ==
+                computed.createClockPlan(start_date, end_date))
+
+    def test_environment_cache(self, tmp_path, monkeypatch):
+        '''Verify that scripts only use a plan cache when $CIVILITE_CACHE_DIR is set.'''
+        monkeypatch.delenv('CIVILITE_CACHE_DIR', raising=False)
+        assert plancache.environmentPlanCache() is None
+        monkeypatch.setenv('CIVILITE_CACHE_DIR', str(tmp_path))
+        assert plancache.environmentPlanCache().path == str(tmp_path)
+
+    def test_table_hash(self, tmp_path):
+        '''Verify that the content hash depends on which twilight table is loaded.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        without_table = hop_schedule.contentHash()
+        hashes = []
+        for first_year, last_year in ((2021, 2021), (2021, 2022)):
+            table_path = str(tmp_path / f'hop_{last_year}.bin')
+            tables.writeTwilightTable(table_path, hop_schedule.observer, hop_schedule.tzinfo,
+                                      first_year, last_year)
+            hop_schedule.loadTwilightTable(table_path)
+            hashes.append(hop_schedule.contentHash())
+        hop_schedule.twilight.table.close()
+        assert len({without_table, *hashes}) == 3
+
+    def test_round_trip(self, tmp_path):
+        '''Verify that a plan loaded from the cache equals the computed plan, and that changed
+        schedules miss.'''
+        computed = cachedSchedule(tmp_path).createEvents(2021)
+        hop_schedule = cachedSchedule(tmp_path)
+        loaded = hop_schedule.createEvents(2021)
+        assert (hop_schedule.plan_cache.hits, hop_schedule.plan_cache.misses) == (1, 0)
+        assert loaded == computed
+        assert ([str(record[0]) for record in loaded.values()] ==
+                [str(record[0]) for record in computed.values()])
+        # no twilight was computed
+        assert hop_schedule.twilight.cache.misses == 0
+        changed_schedule = cachedSchedule(tmp_path)
+        changed_schedule.addDateEvent(date(2021, 5, 5),
+                                      schedule.ScheduleEvent(time(20, 0), time(23, 0)))
+        changed_schedule.createEvents(2021)
+        assert changed_schedule.plan_cache.misses == 1
+        assert len(os.listdir(str(tmp_path))) == 2
+
+    def test_damaged_file(self, tmp_path):
+        '''Verify that a damaged plan file is a miss and is replaced.'''
+        hop_schedule = cachedSchedule(tmp_path)
+        expected = hop_schedule.createEvents(2021)
+        plan_file = os.path.join(str(tmp_path),
+                                 plancache.planKey(hop_schedule, 2021) + plancache.PLAN_SUFFIX)
+        with open(plan_file, 'r+b') as out_file:
+            out_file.truncate(100)
+        hop_schedule = cachedSchedule(tmp_path)
+        assert hop_schedule.createEvents(2021) == expected
+        assert hop_schedule.plan_cache.misses == 1
+        assert os.path.getsize(plan_file) == plancache.HEADER.size + 365 * plancache.DAY_SIZE
+
+    def test_eviction(self, tmp_path):
+        '''Verify that the least recently used plans are removed beyond the size limit.'''
+        plan_size = plancache.HEADER.size + 365 * plancache.DAY_SIZE
+        hop_schedule = cachedSchedule(tmp_path)
+        hop_schedule.plan_cache.max_bytes = 2 * plan_size
+        for year in (2021, 2022, 2023):
+            hop_schedule.createEvents(year)
+        assert sorted(os.listdir(str(tmp_path))) == sorted(
+            plancache.planKey(hop_schedule, year) + plancache.PLAN_SUFFIX for year in (2022, 2023))
+        hop_schedule.plan_cache.clear()
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_export(self, tmp_path):
+        '''Verify that exports of schedules with a plan cache are the same as without.'''
+        outputs = []
+        for hop_schedule in (schedule.getCurrentSchedule(), cachedSchedule(tmp_path),
+                             cachedSchedule(tmp_path)):
+            out_file = io.StringIO()
+            export.exportSchedules({'north': hop_schedule}, [2021, 2022], out_file)
+            outputs.append(out_file.getvalue())
+        assert outputs[0] == outputs[1] == outputs[2]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.render'''
+
+# Builtins
+from datetime import date, time
+
+# Our stuff
+from civilite import render, schedule
+
+
+class TestRender:
+    '''Test suite for PDF calendar rendering.'''
+
+    def test_render_calendar(self):
+        '''Verify that a calendar is rendered as a PDF document with the given metadata.'''
+        document = render.renderCalendar(schedule.getCurrentSchedule(), 2021, title='Test calendar')
+        assert document.startswith(b'%PDF')
+        assert b'Test calendar' in document
+
+    def test_merge_runs(self):
+        '''Verify that adjacent cells with the same style in a row become one command.'''
+        cells = [(1, 1, ('BACKGROUND', 'green')), (2, 1, ('BACKGROUND', 'green')),
+                 (3, 1, ('BACKGROUND', 'gray')), (4, 1, ('BACKGROUND', 'green')),
+                 (1, 2, ('BACKGROUND', 'green'))]
+        assert render._mergeRuns(cells) == [('BACKGROUND', (1, 1), (2, 1), 'green'),
+                                            ('BACKGROUND', (3, 1), (3, 1), 'gray'),
+                                            ('BACKGROUND', (4, 1), (4, 1), 'green'),
+                                            ('BACKGROUND', (1, 2), (1, 2), 'green')]
+
+    def test_render_calendars(self):
+        '''Verify that pooled rendering returns one document per job, in order.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        progress = []
+        documents = render.renderCalendars(
+            [(hop_schedule, 2021, 'First'), (hop_schedule, 2022, 'Second')], max_workers=2,
+            progress=lambda completed, total: progress.append(completed))
+        assert progress == [1, 2]
+        assert b'First' in documents[0] and b'Second' in documents[1]
+
+    def test_schedule_table(self):
+        '''Verify that all weekly and date events are listed and that the legend follows them.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        busy_schedule = schedule.WeeklySchedule(hop_schedule.observer, hop_schedule.tzinfo)
+        for weekday in range(7):
+            for hour in (6, 17, 20):
+                busy_schedule.addEvent(weekday,
+                                       schedule.ScheduleEvent(time(hour, 0), time(hour + 1, 0)))
+        for christmas_eve in (date(2021, 12, 24), date(2022, 12, 24)):
+            busy_schedule.addDateEvent(christmas_eve,
+                                       schedule.ScheduleEvent(time(15, 0), time(23, 0)))
+        table = render.scheduleTable(busy_schedule, 2021, 60)
+        rows = table._cellvalues
+        events = rows[4:4 + 7 * 3 + 1]
+        assert [row[1] for row in events[:3]] == ['Sunday'] * 3
+        assert [row[1] for row in events[-4:-1]] == ['Saturday'] * 3
+        assert events[-1] == ['', 'Dec 24, Fri', '15:00', '23:00']
+        assert rows[4 + 7 * 3 + 1] == ['', '', '', '']
+        assert rows[4 + 7 * 3 + 2][0] == 'LEGEND'
+        assert len(rows) == max(60 - render.ROW_ADJUST, 4 + 7 * 3 + 1 + 8)
+        crowded_table = render.scheduleTable(busy_schedule, 2021, 40)
+        rows = crowded_table._cellvalues
+        assert len(rows) == 40 - render.ROW_ADJUST
+        assert rows[-len(render.LEGEND_ROWS)][0] == 'LEGEND'
+        assert rows[-len(render.LEGEND_ROWS) - 2][1] == '16 more events'
+        assert render.renderCalendar(busy_schedule, 2021).startswith(b'%PDF')
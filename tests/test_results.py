@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.results'''
+
+# Builtins
+import json
+from datetime import date, timedelta, timezone
+
+# Our stuff
+from civilite import results, schedule
+
+
+class TestEventColumns:
+    '''Test suite for the columnar result container.'''
+
+    def test_matches_events(self):
+        '''Verify that columns hold the same records as createEvents.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        expected = curr_schedule.createEvents(2021)
+        columns = curr_schedule.createColumns(date(2021, 1, 1), date(2022, 1, 1))
+        assert len(columns) == len(expected)
+        assert list(columns) == sorted(expected)
+        for evt_date, (sunset_time, evt_type, evt_changed) in expected.items():
+            col_sunset, col_type, col_changed = columns[evt_date]
+            assert abs((col_sunset - sunset_time).total_seconds()) <= 0.5
+            assert (col_type, col_changed) == (evt_type, evt_changed)
+            assert col_sunset.utcoffset() == sunset_time.utcoffset()
+        assert date(2022, 1, 1) not in columns
+        assert columns.get(date(2022, 1, 1)) is None
+        # a year of records in a few kilobytes
+        assert columns.nbytes < 4 * 1024
+
+    def test_slice(self):
+        '''Verify that slices at arbitrary offsets share the parent's records.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        columns = curr_schedule.createColumns(date(2020, 1, 1), date(2022, 1, 1))
+        march = columns[date(2021, 3, 3):date(2021, 4, 1)]
+        assert len(march) == 29
+        assert march.start_date == date(2021, 3, 3)
+        assert dict(march.items()) == {evt_date: columns[evt_date] for evt_date in march}
+        assert march.export()['sunset'].obj is columns.export()['sunset'].obj
+        arrays = march.toNumpy()
+        assert arrays['changed'].tolist() == [march[evt_date][2] for evt_date in march]
+        assert arrays['event_type'].tolist() == [march[evt_date][1] or 0 for evt_date in march]
+
+
+class TestTransitionIndex:
+    '''Test suite for saving and loading transition indexes.'''
+
+    def test_save_fixed_offset(self, tmp_path):
+        '''Verify that an index of a timezone without an IANA name is loaded at its UTC offset.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        fixed_schedule = schedule.WeeklySchedule(hop_schedule.observer,
+                                                 timezone(timedelta(hours=-5)))
+        fixed_schedule.events = hop_schedule.events
+        transitions = fixed_schedule.buildTransitions(date(2021, 1, 1), date(2021, 2, 1))
+        plan_path = str(tmp_path / 'plan.json')
+        transitions.save(plan_path)
+        loaded = results.TransitionIndex.load(plan_path)
+        assert loaded.start == transitions.start
+        assert loaded.start.utcoffset() == timedelta(hours=-5)
+        instant = transitions.start + timedelta(days=3)
+        assert loaded.nextTransition(instant) == transitions.nextTransition(instant)
+        assert loaded.nextTransition(instant)[0].utcoffset() == timedelta(hours=-5)
+        hop_schedule.buildTransitions(date(2021, 1, 1), date(2021, 2, 1)).save(plan_path)
+        with open(plan_path, 'r', encoding='utf-8') as in_file:
+            data = json.load(in_file)
+        assert data['timezone'] == 'US/Eastern' and 'utc_offset' not in data
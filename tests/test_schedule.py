@@ -8,16 +8,18 @@ import json
 import os
 import re
 import time
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time as dtime, timedelta
 
 # 3rd party
+import pytest
 import pytz
+from astral import Observer, SunDirection, sun
 from bs4 import BeautifulSoup
 from dateutil.parser import parse
 from requests import request
 
 # Our stuff
-from civilite import schedule
+from civilite import schedule, tables, twilight
 
 RE_NUMERIC = re.compile(r'\d+')
 
@@ -46,7 +48,8 @@ class TestSchedule:
                 if (datetime.now() - last_request_time).total_seconds() < min_request_interval:
                     # don't bang the poor server to death
                     time.sleep(min_request_interval)
-                url = f'https://www.timeanddate.com/sun/usa/rochester?month={test_month}&year={test_year}'
+                url = ('https://www.timeanddate.com/sun/usa/rochester'
+                       f'?month={test_month}&year={test_year}')
                 print(f'{datetime.now()} : Sending a GET request to {url}')
                 response = request('GET', url)
                 soup = BeautifulSoup(response.content, features='html.parser')
@@ -56,8 +59,9 @@ class TestSchedule:
                 # These are <td> tag indexes 0 and 1. The day of month is in a <th> tag.
                 # T&D.com defines sunrise as the end of civil twilight in the morning, and
                 # sunset as the beginning of civil twilight in the evening.
-                # The columns labeled Start and End under the "Civil Twilight" column define the duration
-                # of the whole day including the absolute start and absolute end of twilight phases for the day.
+                # The columns labeled Start and End under the "Civil Twilight" column define
+                # the duration of the whole day including the absolute start and absolute end
+                # of twilight phases for the day.
                 day_tags = soup('tr', {'data-day': RE_NUMERIC})
                 num_days = calendar.monthlen(test_year, test_month)
                 assert num_days == len(day_tags), \
@@ -66,11 +70,13 @@ class TestSchedule:
                     test_day = int(day_tag('th')[0].string)
                     test_datetime = datetime(test_year, test_month, test_day)
                     # first two <td> tags are the sunrise & sunset cells.
-                    # grab just the time expression via .contents, forget the rise/set symbol and azimuth in string
+                    # grab just the time expression via .contents, forget the rise/set symbol
+                    # and azimuth in string
                     sun_times = [dt.contents[0] for dt in day_tag('td')[:2]]
                     # parse each time, dump to an ISO-formatted string for JSON storage
-                    sunrise, sunset = [local_tz.localize(parse(t, default=test_datetime)).isoformat()
-                                       for t in sun_times]
+                    sunrise, sunset = [
+                        local_tz.localize(parse(t, default=test_datetime)).isoformat()
+                        for t in sun_times]
                     # cache the data
                     astro_cache[test_datetime.date().isoformat()] = sunrise, sunset
         if cache_needs_update:
@@ -85,3 +91,293 @@ class TestSchedule:
             # print(f'calculated sunset: {sunset_time}')
             # print(f'             diff: {abs_sunset_diff}')
             assert abs_sunset_diff.total_seconds() < 180.0, f'Unexpected sunset time on {evt_date}'
+
+
+class TestIterEvents:
+    '''Test suite for lazy iteration of schedule events.'''
+
+    def test_across_years(self):
+        '''Verify that streamed events across a year boundary match the yearly results.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        expected = curr_schedule.createEvents(2020)
+        expected.update(curr_schedule.createEvents(2021))
+        streamed = {evt_date: (sunset_time, evt_type, evt_changed)
+                    for evt_date, sunset_time, evt_type, evt_changed
+                    in curr_schedule.iterEvents(date(2020, 1, 1), date(2022, 1, 1))}
+        assert streamed == expected
+
+    def test_unbounded(self):
+        '''Verify that an open-ended iteration can be consumed incrementally.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        events = curr_schedule.iterEvents(date(2020, 12, 30))
+        first, second = next(events), next(events)
+        assert (first[0], second[0]) == (date(2020, 12, 30), date(2020, 12, 31))
+        assert next(events)[0] == date(2021, 1, 1)
+
+
+class TestTransitions:
+    '''Test suite for the ON/OFF transition index.'''
+
+    def test_state_at(self):
+        '''Verify lights states and transitions for SUNSET, FIXED and NEVER-ON events.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        local_tz = curr_schedule.tzinfo
+        # Tuesday 2020-12-01: the 18:30 event starts after sunset, so it is FIXED
+        assert curr_schedule.getEventType(date(2020, 12, 1)) == schedule.EVT_FIXED
+        assert not curr_schedule.stateAt(local_tz.localize(datetime(2020, 12, 1, 18, 29)))
+        assert curr_schedule.stateAt(local_tz.localize(datetime(2020, 12, 1, 18, 31)))
+        assert curr_schedule.nextTransition(local_tz.localize(datetime(2020, 12, 1, 18, 31))) == \
+            (local_tz.localize(datetime(2020, 12, 1, 22, 0)), False)
+        # Sunday 2020-10-04: sunset occurs during the 16:45-19:00 event
+        assert curr_schedule.getEventType(date(2020, 10, 4)) == schedule.EVT_SUNSET
+        sunset_time = curr_schedule.getCivilTwilight(date(2020, 10, 4))
+        assert curr_schedule.nextTransition(local_tz.localize(datetime(2020, 10, 4, 12, 0))) == \
+            (sunset_time, True)
+        assert not curr_schedule.stateAt(sunset_time - timedelta(seconds=1))
+        assert curr_schedule.stateAt(sunset_time)
+        # Sunday 2020-06-21: the event ends before sunset, so lights stay off
+        assert curr_schedule.getEventType(date(2020, 6, 21)) == schedule.EVT_NEVER_ON
+        assert not curr_schedule.stateAt(local_tz.localize(datetime(2020, 6, 21, 18, 0)))
+
+    def test_next_transition_beyond_horizon(self):
+        '''Verify that a transition after the end of the current index is found.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        local_tz = curr_schedule.tzinfo
+        curr_schedule.buildTransitions(date(2020, 12, 1), date(2020, 12, 2))
+        next_on, state = curr_schedule.nextTransition(
+            local_tz.localize(datetime(2020, 12, 1, 23, 0)))
+        assert (next_on, state) == (local_tz.localize(datetime(2020, 12, 2, 18, 45)), True)
+
+
+class TestEventIntervals:
+    '''Test suite for multiple events per day.'''
+
+    def test_merge(self):
+        '''Verify that overlapping events and short gaps are merged, and long gaps are not.'''
+        intervals = schedule.EventIntervals([
+            schedule.ScheduleEvent(dtime(19, 0), dtime(20, 0)),
+            schedule.ScheduleEvent(dtime(9, 0), dtime(10, 0)),
+            schedule.ScheduleEvent(dtime(18, 0), dtime(18, 45)),
+            schedule.ScheduleEvent(dtime(9, 30), dtime(9, 45)),
+            schedule.ScheduleEvent(dtime(20, 30), dtime(21, 0)),
+        ])
+        assert list(intervals) == [schedule.ScheduleEvent(dtime(9, 0), dtime(10, 0)),
+                                   schedule.ScheduleEvent(dtime(18, 0), dtime(20, 0)),
+                                   schedule.ScheduleEvent(dtime(20, 30), dtime(21, 0))]
+        assert len(schedule.EventIntervals(intervals, timedelta(minutes=31))) == 2
+        assert intervals.classify(dtime(18, 30)) == [
+            (schedule.ScheduleEvent(dtime(9, 0), dtime(10, 0)), schedule.EVT_NEVER_ON),
+            (schedule.ScheduleEvent(dtime(18, 0), dtime(20, 0)), schedule.EVT_SUNSET),
+            (schedule.ScheduleEvent(dtime(20, 30), dtime(21, 0)), schedule.EVT_FIXED)]
+        assert intervals.eventType(dtime(18, 30)) == schedule.EVT_SUNSET
+        assert intervals.eventType(dtime(20, 15)) == schedule.EVT_FIXED
+        assert intervals.eventType(dtime(21, 30)) == schedule.EVT_NEVER_ON
+
+    def test_classify_sunrise(self):
+        '''Verify that intervals starting before sunrise are FIXED or SUNRISE, and the precedence
+        of day types.'''
+        intervals = schedule.EventIntervals([
+            schedule.ScheduleEvent(dtime(5, 0), dtime(6, 0)),
+            schedule.ScheduleEvent(dtime(6, 30), dtime(8, 0)),
+            schedule.ScheduleEvent(dtime(19, 0), dtime(21, 0)),
+        ])
+        assert intervals.classify(dtime(18, 30), dtime(7, 15)) == [
+            (schedule.ScheduleEvent(dtime(5, 0), dtime(6, 0)), schedule.EVT_FIXED),
+            (schedule.ScheduleEvent(dtime(6, 30), dtime(8, 0)), schedule.EVT_SUNRISE),
+            (schedule.ScheduleEvent(dtime(19, 0), dtime(21, 0)), schedule.EVT_FIXED)]
+        assert intervals.eventType(dtime(18, 30), dtime(7, 15)) == schedule.EVT_SUNRISE
+        assert intervals.eventType(dtime(19, 30), dtime(7, 15)) == schedule.EVT_SUNSET
+        assert intervals.eventType(dtime(21, 30), dtime(5, 30)) == schedule.EVT_SUNRISE
+        assert intervals.eventType(dtime(21, 30), dtime(6, 15)) == schedule.EVT_FIXED
+        assert intervals.eventType(dtime(21, 30), dtime(4, 30)) == schedule.EVT_NEVER_ON
+        # without a sunrise time, as before
+        assert intervals.eventType(dtime(21, 30)) == schedule.EVT_NEVER_ON
+        # one interval from before sunrise until after sunset
+        all_day = schedule.EventIntervals([schedule.ScheduleEvent(dtime(6, 0), dtime(22, 0))])
+        assert [evt_type for _, evt_type in all_day.classify(dtime(18, 30), dtime(7, 15))] == [
+            schedule.EVT_SUNRISE, schedule.EVT_SUNSET]
+
+    def test_schedule_events(self):
+        '''Verify that events accumulate per weekday and that date events add to them.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        local_tz = curr_schedule.tzinfo
+        curr_schedule.addEvent(calendar.TUESDAY, schedule.ScheduleEvent(dtime(9, 0), dtime(11, 0)))
+        assert len(curr_schedule.events[calendar.TUESDAY]) == 2
+        assert len(curr_schedule.getEvents(date(2020, 12, 1))) == 2
+        # a Tuesday booking that closes the gap to the evening event
+        curr_schedule.addDateEvent(date(2020, 12, 1),
+                                   schedule.ScheduleEvent(dtime(16, 0), dtime(18, 10)))
+        assert list(curr_schedule.getEvents(date(2020, 12, 1)))[1] == \
+            schedule.ScheduleEvent(dtime(16, 0), dtime(22, 0))
+        assert curr_schedule.getEventType(date(2020, 12, 1)) == schedule.EVT_SUNSET
+        assert curr_schedule.getEventType(date(2020, 12, 8)) == schedule.EVT_FIXED
+        index = curr_schedule.buildTransitions(date(2020, 12, 1), date(2020, 12, 2))
+        assert len(index) == 2
+        assert curr_schedule.stateAt(local_tz.localize(datetime(2020, 12, 1, 21, 0)))
+        assert not curr_schedule.stateAt(local_tz.localize(datetime(2020, 12, 1, 10, 0)))
+
+
+class TestReplanning:
+    '''Test suite for incremental re-planning after schedule changes.'''
+
+    @staticmethod
+    def changeEvents(curr_schedule: schedule.WeeklySchedule) -> None:
+        '''Move the Tuesday event earlier and add two evening date events.'''
+        curr_schedule.clearEvents(calendar.TUESDAY)
+        curr_schedule.addEvent(calendar.TUESDAY,
+                               schedule.ScheduleEvent(dtime(16, 0), dtime(17, 30)))
+        for evt_date in (date(2021, 1, 3), date(2020, 12, 31)):
+            curr_schedule.addDateEvent(evt_date, schedule.ScheduleEvent(dtime(17, 0), dtime(20, 0)))
+
+    def test_change_weekday(self):
+        '''Verify that a kept plan updated after changing events equals a fresh plan.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        curr_schedule.createEvents(2020)
+        curr_schedule.createEvents(2021)
+        computed = curr_schedule.twilight.cache.misses
+        self.changeEvents(curr_schedule)
+        updated = {**curr_schedule.createEvents(2020), **curr_schedule.createEvents(2021)}
+        # no twilight was computed again
+        assert curr_schedule.twilight.cache.misses == computed
+
+        fresh_schedule = schedule.getCurrentSchedule()
+        self.changeEvents(fresh_schedule)
+        expected = {**fresh_schedule.createEvents(2020), **fresh_schedule.createEvents(2021)}
+        assert updated == expected
+        assert updated[date(2020, 12, 31)][2]
+
+    def test_change_settings(self, tmp_path):
+        '''Verify that kept plans are discarded when the gap threshold, the backend or the
+        twilight table change.'''
+        late_event = schedule.ScheduleEvent(dtime(21, 30), dtime(23, 0))
+        curr_schedule = schedule.getCurrentSchedule()
+        curr_schedule.addDateEvent(date(2021, 3, 3), late_event)
+        curr_schedule.createEvents(2021)
+        curr_schedule.buildTransitions(date(2021, 1, 1), date(2021, 2, 1))
+        curr_schedule.gap_threshold = timedelta(hours=1)
+        assert curr_schedule.transitions is None
+        assert len(curr_schedule.getEvents(date(2021, 3, 3))) == 1
+        fresh_schedule = schedule.getCurrentSchedule()
+        fresh_schedule.addDateEvent(date(2021, 3, 3), late_event)
+        fresh_schedule.gap_threshold = timedelta(hours=1)
+        assert curr_schedule.createEvents(2021) == fresh_schedule.createEvents(2021)
+
+        curr_schedule.backend = twilight.BACKEND_FAST
+        fresh_schedule = schedule.getCurrentSchedule()
+        fresh_schedule.backend = twilight.BACKEND_FAST
+        assert curr_schedule.createEvents(2020) == fresh_schedule.createEvents(2020)
+        with pytest.raises(ValueError):
+            curr_schedule.backend = 'unknown'
+
+        table_path = str(tmp_path / 'hop.bin')
+        tables.writeTwilightTable(table_path, curr_schedule.observer, curr_schedule.tzinfo,
+                                  2020, 2020)
+        curr_schedule.loadTwilightTable(table_path)
+        assert (curr_schedule.createEvents(2020)[date(2020, 6, 1)][0] ==
+                curr_schedule.twilight.table.sunset(date(2020, 6, 1)))
+        curr_schedule.twilight.table.close()
+
+
+    def test_change_location(self, tmp_path):
+        '''Verify that kept plans and a mismatched twilight table are discarded when the observer
+        or the timezone change.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        table_path = str(tmp_path / 'hop.bin')
+        tables.writeTwilightTable(table_path, curr_schedule.observer, curr_schedule.tzinfo,
+                                  2021, 2021)
+        curr_schedule.loadTwilightTable(table_path)
+        curr_schedule.createEvents(2021)
+        curr_schedule.buildTransitions(date(2021, 1, 1), date(2021, 2, 1))
+        seattle = Observer(47.6062, -122.3321, 50)
+        curr_schedule.observer = seattle
+        assert curr_schedule.transitions is None
+        assert curr_schedule.twilight.table is None
+        curr_schedule.tzinfo = pytz.timezone('US/Pacific')
+        fresh_schedule = schedule.WeeklySchedule(seattle, pytz.timezone('US/Pacific'))
+        for weekday, events in curr_schedule.events.items():
+            for event in events:
+                fresh_schedule.addEvent(weekday, event)
+        assert curr_schedule.createEvents(2021) == fresh_schedule.createEvents(2021)
+        assert curr_schedule.createEvents(2021)[date(2021, 7, 1)][0].tzinfo.zone == 'US/Pacific'
+
+
+class TestClockPlan:
+    '''Test suite for the run-length encoded astro clock program.'''
+
+    def test_clock_plan(self):
+        '''Verify that segments cover exactly the days with events and agree with createEvents.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        segments = curr_schedule.createClockPlan(date(2020, 1, 1), date(2022, 1, 1))
+        assert len(segments) < 40
+        events = curr_schedule.createEvents(2020)
+        events.update(curr_schedule.createEvents(2021))
+        covered = {}
+        for segment in segments:
+            for week in range(segment.weeks):
+                covered[segment.first_date + timedelta(days=7 * week)] = segment
+        assert set(covered) == {evt_date for evt_date, (_, evt_type, _) in events.items()
+                                if evt_type is not None}
+        for evt_date, segment in covered.items():
+            assert segment.weekday == evt_date.weekday()
+            assert segment.event_type == events[evt_date][1]
+            # Each new segment after the first of a weekday is flagged as a change of the
+            # clock program.
+            if evt_date == segment.first_date and evt_date - timedelta(days=7) in covered:
+                assert events[evt_date][2]
+        tuesday_segment = covered[date(2020, 6, 2)]
+        assert tuesday_segment.event_type == schedule.EVT_SUNSET
+        assert tuesday_segment.switching == ((None, dtime(22, 0)),)
+        assert covered[date(2020, 12, 1)].switching == ((dtime(18, 30), dtime(22, 0)),)
+
+
+class TestSunrise:
+    '''Test suite for sunrise-aware classification.'''
+
+    @staticmethod
+    def morningSchedule(backend: str) -> schedule.WeeklySchedule:
+        '''Return the HoP schedule with early morning events.'''
+        result = schedule.getCurrentSchedule()
+        result.backend = backend
+        result.addEvent(calendar.MONDAY, schedule.ScheduleEvent(dtime(6, 0), dtime(8, 0)))
+        result.addEvent(calendar.THURSDAY, schedule.ScheduleEvent(dtime(5, 0), dtime(6, 30)))
+        return result
+
+    def test_backends_agree(self):
+        '''Verify that all backends classify morning events alike and match astral's sunrise.'''
+        plans = {backend: self.morningSchedule(backend).createEvents(2021)
+                 for backend in twilight.BACKENDS}
+        expected = plans[twilight.BACKEND_ASTRAL]
+        for plan in plans.values():
+            assert ([record[1:] for record in plan.values()] ==
+                    [record[1:] for record in expected.values()])
+        assert expected[date(2021, 1, 4)][1] == schedule.EVT_SUNRISE
+        assert expected[date(2021, 1, 7)][1] == schedule.EVT_FIXED
+        assert expected[date(2021, 6, 7)][1] == schedule.EVT_NEVER_ON
+        numpy_schedule = self.morningSchedule(twilight.BACKEND_NUMPY)
+        sunrise_time = numpy_schedule.getCivilTwilight(date(2021, 1, 4), SunDirection.RISING)
+        expected_time = sun.sunrise(numpy_schedule.observer, date(2021, 1, 4),
+                                    numpy_schedule.tzinfo)
+        assert abs((sunrise_time - expected_time).total_seconds()) < 1.0
+
+    def test_transitions(self):
+        '''Verify that lights turn OFF at sunrise during a SUNRISE event.'''
+        morning_schedule = self.morningSchedule(twilight.BACKEND_ASTRAL)
+        local_tz = morning_schedule.tzinfo
+        sunrise_time = morning_schedule.getCivilTwilight(date(2021, 1, 4), SunDirection.RISING)
+        assert morning_schedule.nextTransition(local_tz.localize(datetime(2021, 1, 4, 5, 0))) == (
+            local_tz.localize(datetime(2021, 1, 4, 6, 0)), True)
+        assert morning_schedule.nextTransition(local_tz.localize(datetime(2021, 1, 4, 7, 0))) == (
+            sunrise_time, False)
+        segment = morning_schedule.createClockPlan(date(2021, 1, 1), date(2021, 2, 1))[0]
+        assert (segment.weekday, segment.event_type) == (calendar.MONDAY, schedule.EVT_SUNRISE)
+        assert segment.switching == ((dtime(6, 0), None),)
+
+    def test_evening_schedule(self):
+        '''Verify that a schedule with evening events only never computes a sunrise.'''
+        hop_schedule = schedule.getCurrentSchedule()
+        hop_schedule.createEvents(2021)
+        test_dates = [date(2021, 1, 1) + timedelta(days=i) for i in range(365)]
+        assert not any(hop_schedule._needsSunrise(test_date, hop_schedule.getEvents(test_date))
+                       for test_date in test_dates)
+        assert all(key[-1] is not SunDirection.RISING
+                   for key in hop_schedule.twilight.cache._entries)
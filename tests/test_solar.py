@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.solar'''
+
+# Builtins
+import calendar
+from datetime import date, time, timedelta
+
+# 3rd party
+import pytz
+from astral import Observer, SunDirection
+from astral.sun import twilight
+
+# Our stuff
+from civilite import schedule, solar
+from civilite.offsets import UtcOffsetIndex
+from civilite.twilight import BACKEND_ASTRAL, BACKEND_NUMPY
+
+
+class TestSolar:
+    '''Test suite for the vectorized civil twilight engine.'''
+
+    def test_matches_astral(self):
+        '''Verify that batched sunsets and sunrises match astral within a second
+            for locations in both hemispheres.'''
+        test_dates = [date(2020, 1, 1) + timedelta(days=i) for i in range(366)]
+        for observer, tz_name in [(Observer(43.1606355, -77.3883843, 170), 'US/Eastern'),
+                                  (Observer(-36.85, 174.76, 0), 'Pacific/Auckland')]:
+            local_tz = pytz.timezone(tz_name)
+            for direction, index in [(SunDirection.SETTING, 0), (SunDirection.RISING, 1)]:
+                batch = solar.civilTwilight(observer, test_dates, local_tz, direction)
+                for test_date, actual in zip(test_dates, batch):
+                    expected = twilight(observer, test_date, direction, local_tz)[index]
+                    assert abs((actual - expected).total_seconds()) < 1.0, \
+                        f'Unexpected time on {test_date}'
+
+    def test_polar_night(self):
+        '''Verify that a date without a sunset is reported as an error.'''
+        observer = Observer(78.22, 15.65, 0)
+        try:
+            solar.civilTwilight(observer, [date(2020, 12, 21)])
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected a ValueError during polar night'
+
+    def test_schedule_backend(self):
+        '''Verify that both WeeklySchedule backends create the same events.'''
+        exact = schedule.getCurrentSchedule()
+        batched = schedule.getCurrentSchedule()
+        batched.backend = BACKEND_NUMPY
+        exact_events = exact.createEvents(2021)
+        batched_events = batched.createEvents(2021)
+        assert exact_events.keys() == batched_events.keys()
+        for evt_date, (sunset_time, *etc) in exact_events.items():
+            other_sunset, *other_etc = batched_events[evt_date]
+            assert abs((sunset_time - other_sunset).total_seconds()) < 1.0
+            assert etc == other_etc
+
+    def test_long_range(self):
+        '''Verify that streaming years of events with sunrises in batches of the numpy backend
+            gives the same events as the astral backend.'''
+        streams = []
+        for backend in (BACKEND_ASTRAL, BACKEND_NUMPY):
+            curr_schedule = schedule.getCurrentSchedule()
+            curr_schedule.backend = backend
+            curr_schedule.addEvent(calendar.MONDAY, schedule.ScheduleEvent(time(6, 0), time(8, 0)))
+            streams.append(list(curr_schedule.iterEvents(date(2020, 1, 1), date(2023, 1, 1))))
+        assert len(streams[0]) == len(streams[1]) == 1096
+        for (evt_date, sunset_time, *etc), (other_date, other_sunset, *other_etc) in zip(*streams):
+            assert evt_date == other_date
+            assert abs((sunset_time - other_sunset).total_seconds()) < 1.0
+            assert etc == other_etc
+
+    def test_pair(self):
+        '''Verify that sunrises and sunsets computed together equal those computed separately.'''
+        test_dates = [date(2021, 1, 1) + timedelta(days=i) for i in range(365)]
+        for observer, tz_name in [(Observer(43.1606355, -77.3883843, 170), 'US/Eastern'),
+                                  (Observer(69.65, 18.96, 0), 'Europe/Oslo')]:
+            local_tz = pytz.timezone(tz_name)
+            sunrises, sunsets = solar.civilTwilightPair(observer, test_dates, local_tz,
+                                                        strict=False)
+            assert sunrises == solar.civilTwilight(observer, test_dates, local_tz,
+                                                   SunDirection.RISING, strict=False)
+            assert sunsets == solar.civilTwilight(observer, test_dates, local_tz,
+                                                  SunDirection.SETTING, strict=False)
+
+    def test_offset_index(self):
+        '''Verify that converting with a UTC offset index gives the same datetimes
+            as ``UtcOffsetIndex.toLocal``.'''
+        test_dates = [date(2020, 1, 1) + timedelta(days=i) for i in range(731)]
+        for observer, tz_name in [(Observer(43.1606355, -77.3883843, 170), 'US/Eastern'),
+                                  (Observer(35.68, 139.69, 40), 'Asia/Tokyo'),
+                                  (Observer(69.65, 18.96, 0), 'Europe/Oslo')]:
+            local_tz = pytz.timezone(tz_name)
+            offsets = UtcOffsetIndex(local_tz, test_dates[0], test_dates[-1] + timedelta(days=1))
+            for direction in (SunDirection.SETTING, SunDirection.RISING):
+                expected = solar.civilTwilight(observer, test_dates, local_tz, direction,
+                                               strict=False)
+                actual = solar.civilTwilight(observer, test_dates, local_tz, direction,
+                                             strict=False, utc_offsets=offsets)
+                assert actual == expected
+                assert [repr(dt) for dt in actual] == [
+                    repr(dt if dt is None else offsets.toLocal(dt.timestamp())) for dt in expected]
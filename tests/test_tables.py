@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.tables'''
+
+# Builtins
+from datetime import date, timedelta, timezone
+
+# 3rd party
+import pytz
+from astral import Observer
+from dateutil import tz
+
+# Our stuff
+from civilite import schedule, tables
+
+
+class TestTables:
+    '''Test suite for precomputed, memory-mapped twilight tables.'''
+
+    def test_table_lookup(self, tmp_path):
+        '''Verify that a schedule reads twilight from a table and that it matches
+            the computed values to within a second.'''
+        table_path = str(tmp_path / 'hop.bin')
+        curr_schedule = schedule.getCurrentSchedule()
+        num_days = tables.writeTwilightTable(table_path, curr_schedule.observer,
+                                             curr_schedule.tzinfo, 2020, 2021)
+        assert num_days == 366 + 365
+        curr_schedule.loadTwilightTable(table_path)
+        reference = schedule.getCurrentSchedule()
+        test_date = date(2020, 1, 1)
+        while test_date.year < 2022:
+            actual = curr_schedule.getCivilTwilight(test_date)
+            expected = reference.getCivilTwilight(test_date)
+            assert abs((actual - expected).total_seconds()) <= 1.0, \
+                f'Unexpected sunset on {test_date}'
+            test_date += timedelta(days=1)
+        # nothing was computed for the dates covered by the table
+        assert len(curr_schedule.twilight.cache) == 0
+        assert curr_schedule.twilight.table.sunrise(date(2020, 6, 20)).hour == 5
+        assert date(2022, 1, 1) not in curr_schedule.twilight.table
+        curr_schedule.twilight.table.close()
+
+    def test_table_mismatch(self, tmp_path):
+        '''Verify that a table for another location is rejected.'''
+        table_path = str(tmp_path / 'other.bin')
+        tables.writeTwilightTable(table_path, Observer(78.22, 15.65, 0),
+                                  pytz.timezone('Arctic/Longyearbyen'), 2020, 2020)
+        with tables.TwilightTable(table_path) as table:
+            # polar night has no sunset
+            assert table.sunset(date(2020, 12, 21)) is None
+        try:
+            schedule.getCurrentSchedule().loadTwilightTable(table_path)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected a ValueError for a mismatched table'
+
+    def test_fixed_offset(self, tmp_path):
+        '''Verify that a table for a fixed-offset timezone loads with that offset
+            and that a timezone without an IANA name or a fixed offset is rejected.'''
+        table_path = str(tmp_path / 'fixed.bin')
+        fixed_tz = timezone(timedelta(hours=5, minutes=30))
+        observer = Observer(28.61, 77.21, 216)
+        tables.writeTwilightTable(table_path, observer, fixed_tz, 2021, 2021)
+        curr_schedule = schedule.WeeklySchedule(observer, fixed_tz)
+        table = curr_schedule.loadTwilightTable(table_path)
+        assert table.tzinfo.utcoffset(None) == timedelta(hours=5, minutes=30)
+        reference = schedule.WeeklySchedule(observer, fixed_tz)
+        for test_date in (date(2021, 1, 1), date(2021, 6, 21), date(2021, 12, 31)):
+            actual = curr_schedule.getCivilTwilight(test_date)
+            assert actual.utcoffset() == timedelta(hours=5, minutes=30)
+            assert abs((actual - reference.getCivilTwilight(test_date)).total_seconds()) <= 1.0
+        table.close()
+        try:
+            tables.writeTwilightTable(str(tmp_path / 'dst.bin'), observer, tz.tzstr('EST5EDT'),
+                                      2021, 2021)
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected a ValueError for a timezone with DST but no name'
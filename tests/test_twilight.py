@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Unit tests for civilite.twilight'''
+
+# Builtins
+from datetime import date, time as dtime, timedelta
+
+# 3rd party
+import pytz
+from astral import Observer, SunDirection
+
+# Our stuff
+from civilite import schedule, twilight
+from civilite.instrumentation import INSTRUMENTATION
+
+
+class TestTwilightCache:
+    '''Test suite for memoization of civil twilight times.'''
+
+    def test_cache_counts(self):
+        '''Verify that repeated lookups are answered from the cache.'''
+        curr_schedule = schedule.getCurrentSchedule()
+        cache = curr_schedule.twilight.cache
+        first = curr_schedule.getCivilTwilight(date(2020, 6, 1))
+        second = curr_schedule.getCivilTwilight(date(2020, 6, 1))
+        assert first == second
+        assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+        curr_schedule.createEvents(2020)
+        # every date of the year plus one week of look-back, computed once each
+        assert len(cache) == 366 + 7
+        assert cache.misses == len(cache)
+        cache.clear()
+        assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+    def test_cache_eviction(self):
+        '''Verify that the least recently used entries are evicted first.'''
+        cache = twilight.TwilightCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert 'a' in cache and 'c' in cache
+        disabled = twilight.TwilightCache(maxsize=0)
+        disabled.put('a', 1)
+        assert len(disabled) == 0
+
+    def test_shared_cache_backends(self):
+        '''Verify that schedules with different backends sharing a cache each get their own
+        values.'''
+        exact = schedule.getCurrentSchedule()
+        fast = schedule.WeeklySchedule(exact.observer, exact.tzinfo,
+                                       backend=twilight.BACKEND_FAST)
+        fast.twilight.cache = exact.twilight.cache
+        fast_sunset = fast.getCivilTwilight(date(2020, 6, 5))
+        exact_sunset = exact.getCivilTwilight(date(2020, 6, 5))
+        assert exact_sunset != fast_sunset
+        assert exact_sunset == exact.twilight.exactTwilight(date(2020, 6, 5))
+        fast.backend = twilight.BACKEND_ASTRAL
+        assert fast.getCivilTwilight(date(2020, 6, 5)) == exact_sunset
+
+
+class TestFastBackend:
+    '''Test suite for interpolated twilight.'''
+
+    def test_error_bound(self):
+        '''Verify that fast sunsets are within the documented error and event types are exact.'''
+        exact = schedule.getCurrentSchedule()
+        fast = schedule.getCurrentSchedule()
+        fast.backend = twilight.BACKEND_FAST
+        # an event that starts within a second of sunset
+        boundary = exact.getCivilTwilight(date(2021, 3, 20))
+        boundary_event = schedule.ScheduleEvent(boundary.time().replace(microsecond=0),
+                                                dtime(23, 0))
+        exact.addDateEvent(date(2021, 3, 20), boundary_event)
+        fast.addDateEvent(date(2021, 3, 20), boundary_event)
+        for year in (2020, 2021):
+            exact_events = exact.createEvents(year)
+            fast_events = fast.createEvents(year)
+            for evt_date, (sunset_time, *etc) in exact_events.items():
+                fast_sunset, *fast_etc = fast_events[evt_date]
+                assert abs(fast_sunset - sunset_time) < twilight.FAST_MAX_ERROR
+                assert fast_etc == etc, f'Unexpected event type on {evt_date}'
+        # far fewer exact computations than days
+        assert len(fast.twilight._anchors) < 2 * 366 / twilight.FAST_ANCHOR_DAYS + 8
+
+    def test_eastern_timezones(self):
+        '''Verify that sunrises east of Greenwich, which fall on the previous UTC date,
+            are interpolated, and that only DST change days are computed exactly.'''
+        test_dates = [date(2021, 1, 1) + timedelta(days=i) for i in range(365)]
+        for observer, tz_name in [(Observer(35.68, 139.69, 40), 'Asia/Tokyo'),
+                                  (Observer(-33.87, 151.21, 0), 'Australia/Sydney')]:
+            fast = twilight.SiteTwilight(observer, pytz.timezone(tz_name),
+                                         backend=twilight.BACKEND_FAST)
+            exact = twilight.SiteTwilight(observer, pytz.timezone(tz_name))
+            for direction in (SunDirection.RISING, SunDirection.SETTING):
+                INSTRUMENTATION.reset()
+                INSTRUMENTATION.enable()
+                try:
+                    fast_times = fast.computeTwilight(test_dates, direction)
+                finally:
+                    INSTRUMENTATION.enable(False)
+                fallbacks = INSTRUMENTATION.counters.get('fast_exact_fallbacks', 0)
+                INSTRUMENTATION.reset()
+                assert fallbacks == len(exact.dstChangeDates(test_dates[0], date(2022, 1, 1)))
+                for fast_time, exact_time in zip(fast_times,
+                                                 exact.computeTwilight(test_dates, direction)):
+                    assert fast_time.date() == exact_time.date()
+                    assert abs(fast_time - exact_time) < twilight.FAST_MAX_ERROR